@@ -0,0 +1,260 @@
+"""Benchmarks of the WHO and CDC page extractors and of serializing their records.
+
+    uv run benchmark.py parsers                         # pages from the fixtures, else the HTML cache
+    uv run benchmark.py parsers --page URL=FILE ...     # explicit pages
+    uv run benchmark.py parsers --parsers html.parser,lxml --repeat 5
+    uv run benchmark.py extractors                      # every dataset extractor of every page
+    uv run benchmark.py serialize                       # JSON and BSON (MongoDB) encoding of the records
+    uv run benchmark.py compare extractors [OLD] [NEW]  # two stored runs, by default the last two
+
+`parsers` reports, for every page and tree builder, the best parse and extract time, the
+peak traced memory of parse + extract, and whether the extracted records match html.parser's,
+once building the whole page and once only the containers the page's extractor declares.
+`extractors` times and memory-profiles each dataset of each page on the parsed page, and
+`serialize` each dataset's json.dumps/loads and bson encode/decode.
+
+Pages come from the recorded FireCrawl fixtures (FIRECRAWL_MODE=record) so runs are
+comparable. Every run is stored in BENCHMARK_DIR and compared with the previous run of the
+same suite; times or memory more than BENCHMARK_REGRESSION times the previous are flagged,
+ignoring measurements under BENCHMARK_MIN_MS / BENCHMARK_MIN_MB.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import bson
+from datetime import datetime, timezone
+from html_cache import HTML_CACHE
+from utils import ElementIndex, make_soup, resolve_parser, HTML_PARSERS, FIXTURES
+from extraction import REGISTRY, extract_index, page_containers
+# importing the sources registers their pages
+import who_pages # noqa: F401
+import us_pages # noqa: F401
+
+BENCHMARK_DIR = os.getenv('BENCHMARK_DIR', 'benchmarks')
+BENCHMARK_REGRESSION = float(os.getenv('BENCHMARK_REGRESSION', 1.25))
+# measurements this small are timer and allocator noise and are never flagged
+BENCHMARK_MIN_MS = float(os.getenv('BENCHMARK_MIN_MS', 1))
+BENCHMARK_MIN_MB = float(os.getenv('BENCHMARK_MIN_MB', 0.5))
+# row fields identifying a measurement, and the measured ones compared between runs
+BENCHMARK_KEYS = ('url', 'parser', 'tree', 'dataset', 'format', 'op')
+BENCHMARK_METRICS = ('parse_ms', 'extract_ms', 'ms', 'peak_mb')
+
+def page_extractors():
+    time_now = datetime.now(timezone.utc)
+    return {
+        url: ((lambda soup, url=url: extract_index(url, ElementIndex(soup), time_now)), page_containers(url))
+        for url in REGISTRY
+    }
+
+def load_pages(page_specs, extractors):
+    if page_specs:
+        pages = []
+        for spec in page_specs:
+            url, path = spec.split('=', 1)
+            with open(path, encoding='utf-8') as f:
+                pages.append((url, f.read()))
+        return pages
+    recorded = dict(FIXTURES.pages())
+    pages = [(url, recorded.get(url) or HTML_CACHE.peek(url)) for url in extractors]
+    return [(url, html) for url, html in pages if html is not None]
+
+def normalize(records):
+    # realtime datasets are stamped with the extraction time, which differs between runs
+    today = str(datetime.now(timezone.utc).date())
+    def strip(value):
+        if isinstance(value, dict):
+            return {k: ('<now>' if k == 'date' and str(v).startswith(today) else strip(v)) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [strip(i) for i in value]
+        return value
+    return json.dumps(strip(records), sort_keys=True, default=str)
+
+def measure(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_parsers(pages, extractors, parsers, repeat):
+    rows = []
+    for url, html in pages:
+        extract, page_containers = extractors[url]
+        baseline = None
+        for parser in parsers:
+            for tree, containers in [('full', None), ('subtree', page_containers)]:
+                soup, parse_sec = measure(lambda: make_soup(html, parser, containers), repeat)
+                records, extract_sec = measure(lambda: extract(soup), repeat)
+                peak = peak_memory(lambda: extract(make_soup(html, parser, containers)))
+                if baseline is None:
+                    baseline = normalize(records)
+                rows.append({
+                    'url': url,
+                    'parser': parser,
+                    'tree': tree,
+                    'html_kb': len(html) / 1024,
+                    'parse_ms': parse_sec * 1000,
+                    'extract_ms': extract_sec * 1000,
+                    'peak_mb': peak / 1024 / 1024,
+                    'identical': normalize(records) == baseline
+                })
+    return rows
+
+def bench_extractors(pages, repeat):
+    time_now = datetime.now(timezone.utc)
+    rows = []
+    for url, html in pages:
+        index, parse_sec = measure(lambda: ElementIndex(make_soup(html, None, page_containers(url))), repeat)
+        rows.append({'url': url, 'dataset': '<parse>', 'records': None, 'ms': parse_sec * 1000,
+                     'peak_mb': peak_memory(lambda: ElementIndex(make_soup(html, None, page_containers(url)))) / 1024 / 1024})
+        for dataset in REGISTRY[url]:
+            records, extract_sec = measure(lambda: dataset.extract(index, time_now), repeat)
+            rows.append({'url': url, 'dataset': dataset.name, 'records': len(records), 'ms': extract_sec * 1000,
+                         'peak_mb': peak_memory(lambda: dataset.extract(index, time_now)) / 1024 / 1024})
+    return rows
+
+def bench_serialize(pages, repeat):
+    time_now = datetime.now(timezone.utc)
+    datasets = {}
+    for url, html in pages:
+        for name, records in extract_index(url, ElementIndex(make_soup(html, None, page_containers(url))), time_now).items():
+            datasets.setdefault(name, []).extend(records)
+    rows = []
+    for name, records in datasets.items():
+        # MongoDB stores one document per record
+        text, dumps_sec = measure(lambda: json.dumps(records, ensure_ascii=False, default=str), repeat)
+        _, loads_sec = measure(lambda: json.loads(text), repeat)
+        documents, encode_sec = measure(lambda: [bson.encode(i) for i in records], repeat)
+        _, decode_sec = measure(lambda: [bson.decode(i) for i in documents], repeat)
+        sizes = {'json': len(text.encode('utf-8')), 'bson': sum(len(i) for i in documents)}
+        for fmt, op, sec, fn in [
+            ('json', 'encode', dumps_sec, lambda: json.dumps(records, ensure_ascii=False, default=str)),
+            ('json', 'decode', loads_sec, lambda: json.loads(text)),
+            ('bson', 'encode', encode_sec, lambda: [bson.encode(i) for i in records]),
+            ('bson', 'decode', decode_sec, lambda: [bson.decode(i) for i in documents])
+        ]:
+            rows.append({'dataset': name, 'format': fmt, 'op': op, 'records': len(records), 'kb': sizes[fmt] / 1024,
+                         'ms': sec * 1000, 'peak_mb': peak_memory(fn) / 1024 / 1024})
+    return rows
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_run(suite, rows, root=BENCHMARK_DIR):
+    os.makedirs(os.path.join(root, suite), exist_ok=True)
+    time_run = datetime.now(timezone.utc).strftime("%Y-%m-%d-%H-%M-%S")
+    path = os.path.join(root, suite, f'{time_run}.json')
+    meta = {'time_run': time_run, 'commit': git_commit(), 'python': sys.version.split()[0], 'machine': platform.machine(), 'node': platform.node()}
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'rows': rows}, f, ensure_ascii=False, indent=4)
+    return path
+
+def stored_runs(suite, root=BENCHMARK_DIR):
+    directory = os.path.join(root, suite)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, i) for i in os.listdir(directory) if i.endswith('.json'))
+
+def row_key(row):
+    return tuple(row.get(i) for i in BENCHMARK_KEYS)
+
+def compare(old_path, new_path, threshold=BENCHMARK_REGRESSION):
+    """Ratio new/old of every metric measured in both runs; returns the rows flagged as regressions."""
+    with open(old_path) as f:
+        old = {row_key(i): i for i in json.load(f)['rows']}
+    with open(new_path) as f:
+        new = json.load(f)['rows']
+    print(f"{os.path.basename(old_path)} -> {os.path.basename(new_path)}")
+    print(f"{'measurement':<90} {'metric':<11} {'old':>9} {'new':>9} {'ratio':>6}")
+    regressions = []
+    for row in new:
+        previous = old.get(row_key(row))
+        if previous is None:
+            continue
+        for metric in BENCHMARK_METRICS:
+            if metric not in row or not previous.get(metric):
+                continue
+            ratio = row[metric] / previous[metric]
+            floor = BENCHMARK_MIN_MB if metric == 'peak_mb' else BENCHMARK_MIN_MS
+            flag = ratio > threshold and max(row[metric], previous[metric]) >= floor
+            if flag:
+                regressions.append({**row, 'metric': metric, 'ratio': ratio})
+            label = ' '.join(str(i).split('://')[-1] for i in row_key(row) if i is not None)
+            print(f"{label[:90]:<90} {metric:<11} {previous[metric]:>9.2f} {row[metric]:>9.2f} {ratio:>6.2f}{' REGRESSION' if flag else ''}")
+    return regressions
+
+def print_rows(rows):
+    print(f"{'page':<60} {'parser':<12} {'tree':<8} {'html KB':>8} {'parse ms':>9} {'extract ms':>11} {'peak MB':>8} {'same':>5}")
+    for row in rows:
+        print(f"{row['url'].split('://')[-1][:60]:<60} {row['parser']:<12} {row['tree']:<8} {row['html_kb']:>8.0f} {row['parse_ms']:>9.1f} {row['extract_ms']:>11.1f} {row['peak_mb']:>8.1f} {'yes' if row['identical'] else 'NO':>5}")
+
+def print_extractor_rows(rows):
+    print(f"{'page':<60} {'dataset':<50} {'records':>8} {'ms':>9} {'peak MB':>8}")
+    for row in rows:
+        print(f"{row['url'].split('://')[-1][:60]:<60} {row['dataset'][:50]:<50} {'' if row['records'] is None else row['records']:>8} {row['ms']:>9.2f} {row['peak_mb']:>8.2f}")
+
+def print_serialize_rows(rows):
+    print(f"{'dataset':<50} {'format':<6} {'op':<7} {'records':>8} {'KB':>8} {'ms':>9} {'peak MB':>8}")
+    for row in rows:
+        print(f"{row['dataset'][:50]:<50} {row['format']:<6} {row['op']:<7} {row['records']:>8} {row['kb']:>8.1f} {row['ms']:>9.2f} {row['peak_mb']:>8.2f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parsers_cmd = subparsers.add_parser('parsers', help='compare HTML tree builders')
+    parsers_cmd.add_argument('--parsers', default=','.join(HTML_PARSERS), help='comma separated tree builders, the first one is the reference')
+    extractors_cmd = subparsers.add_parser('extractors', help='time and memory of every dataset extractor')
+    serialize_cmd = subparsers.add_parser('serialize', help='JSON and BSON encoding of the extracted records')
+    for cmd in (parsers_cmd, extractors_cmd, serialize_cmd):
+        cmd.add_argument('--page', action='append', default=[], help='URL=FILE, page HTML to benchmark (default: fixtures, then HTML cache)')
+        cmd.add_argument('--repeat', type=int, default=3)
+        cmd.add_argument('--no-save', action='store_true', help=f'do not store the run in {BENCHMARK_DIR}')
+    compare_cmd = subparsers.add_parser('compare', help='compare two stored runs of a suite')
+    compare_cmd.add_argument('suite', choices=['parsers', 'extractors', 'serialize'])
+    compare_cmd.add_argument('runs', nargs='*', help='OLD NEW stored run files (default: the last two)')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        runs = args.runs or stored_runs(args.suite)[-2:]
+        if len(runs) != 2:
+            parser.error(f'need two runs of {args.suite} to compare')
+        raise SystemExit(1 if compare(*runs) else 0)
+
+    extractors = page_extractors()
+    pages = load_pages(args.page, extractors)
+    if not pages:
+        parser.error('no pages to benchmark: record fixtures with FIRECRAWL_MODE=record, crawl once to fill the HTML cache or pass --page URL=FILE')
+    if args.command == 'parsers':
+        # html.parser first so the other builders are compared against the current behaviour
+        parsers = [i for i in dict.fromkeys(['html.parser'] + args.parsers.split(',')) if resolve_parser(i) == i]
+        rows = bench_parsers(pages, extractors, parsers, args.repeat)
+        print_rows(rows)
+    elif args.command == 'extractors':
+        rows = bench_extractors(pages, args.repeat)
+        print_extractor_rows(rows)
+    else:
+        rows = bench_serialize(pages, args.repeat)
+        print_serialize_rows(rows)
+    if not args.no_save:
+        previous = stored_runs(args.command)
+        path = save_run(args.command, rows)
+        print(f"Saved {path}")
+        if previous:
+            compare(previous[-1], path)
@@ -2,220 +2,172 @@
 
 import os
 import json
-import time
 import pymongo
 import asyncio
 import logging
-import aiohttp
-import requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from mcp.server.fastmcp import FastMCP
+from utils import FIRECRAWL_MODE, FireCrawl as BaseFireCrawl, RateBudget, StaleWhileRevalidate, HTTP_POOL, fetch_pages, crawl_many as crawl_pages
+from extraction import validates, forget_validated, EXTRACT_POOL
+import us_pages
+from us_pages import URL_US, US_SOURCE
+from html_cache import HTML_CACHE
+from mongo_store import MONGO_STORE
+from snapshot_store import SNAPSHOT_STORE
+from parquet_export import PARQUET_EXPORT
+from history_index import HISTORY_INDEX
+from metrics import METRICS
+from source_adapters import adapt
+from contextlib import asynccontextmanager
+from scheduler import Scheduler, Source, HeadProbe
+from mcp.server.fastmcp import FastMCP, Context
 from datetime import datetime, timezone
 
+@asynccontextmanager
+async def lifespan(server):
+    try:
+        yield
+    finally:
+        await US_EPIDATA_CACHE.aclose()
+        await HTTP_POOL.aclose()
+        EXTRACT_POOL.shutdown()
+        MONGO_STORE.close()
+        HISTORY_INDEX.close()
+
 load_dotenv()
-mcp = FastMCP("epi-crawl")
-TIME_NOW = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+mcp = FastMCP("epi-crawl", lifespan=lifespan)
 TIMEGEP_SEC = 30
+US_REQUESTS_PER_MINUTE = int(os.getenv('US_REQUESTS_PER_MINUTE', 10))
+US_MAX_IN_FLIGHT = int(os.getenv('US_MAX_IN_FLIGHT', 4))
+# CDC pages change weekly at most; an older result is still served while a new crawl runs
+US_EPIDATA_TTL_SEC = float(os.getenv('US_EPIDATA_TTL_SEC', 3600 * 24))
+# scheduler: full crawl at least every US_CADENCE_SEC, freshness probe every US_PROBE_SEC
+US_CADENCE_SEC = float(os.getenv('US_CADENCE_SEC', 3600 * 24 * 5))
+US_PROBE_SEC = float(os.getenv('US_PROBE_SEC', 3600 * 6))
 
-class FireCrawlRateLimitExceeded(Exception):
-    def __init__(self, message):
-        super().__init__(message)
-        self.message = message
-    def __str__(self):
-        return f"FireCrawlRateLimitExceeded: {self.message}"
-
-class FireCrawl:
+class FireCrawl(BaseFireCrawl):
     def __init__(self, url):
-        
+        super().__init__(url)
         self.logger = logging.getLogger(__name__)
-        self.FIRECRAWL_API_KEY = os.getenv('FIRECRAWL_API_KEY')
-        self.FIRECRAWL_ENDPOINT = os.getenv('FIRECRAWL_ENDPOINT')
-        self.url = url
+        self.timegep_sec = TIMEGEP_SEC
         self.url_snap = url.split('/')[3] + ', ' + url.split('/')[-1].split('.')[0]
-        
-        self.payload = {
-            "url": url,
-            "scrapeOptions": {
-                "formats": ["html"],
-                "waitFor": 15
-            }
-        }
-        
-        self.headers = {
-            "Authorization": f"Bearer {self.FIRECRAWL_API_KEY}",
-            "Content-Type": "application/json"
-        }
-    
-    def crawl(self) -> BeautifulSoup:
-        
-        #POST
-        response = requests.request("POST", self.FIRECRAWL_ENDPOINT, json=self.payload, headers=self.headers) # type: ignore
-        response_json = json.loads(response.text)
-        
-        while True:
-            if response_json['success']:
-                res_url = response_json['url']
-                self.logger.info(f"Submitted: {self.url_snap};")
-                break
-            elif 'Rate limit exceeded' in response_json['error']:
-                self.logger.info('⚠️ FireCrawl Rate limit exceeded, retrying in 60 seconds...')
-                raise FireCrawlRateLimitExceeded(f"{response_json['error']}")
-            else:
-                self.logger.error(f"{self.url_snap}; {response_json['error']}, retrying in {TIMEGEP_SEC} seconds...")
-                time.sleep(TIMEGEP_SEC)
-        
-        #GET
-        while True:
-            response = requests.request("GET", res_url, headers=self.headers)
-            response_json = json.loads(response.text)
-            if response_json['status'] == 'completed':
-                self.logger.info(f"Completed: {self.url_snap};")
-                break
-            elif response_json['status'] == 'scraping':
-                self.logger.info(f"Scraping: {self.url_snap};")
-                time.sleep(TIMEGEP_SEC)
-        soup = BeautifulSoup(response_json['data'][0]['html'], 'html.parser')
-        return soup
-
-    async def crawl_async(self, session) -> BeautifulSoup:
-        
-        # POST
-        async with session.post(self.FIRECRAWL_ENDPOINT, json=self.payload, headers=self.headers) as response:
-            response_json = await response.json()
-            
-            while True:
-                if response_json['success']:
-                    res_url = response_json['url'].replace("https:", self.FIRECRAWL_ENDPOINT.split('//')[0]) # type: ignore
-                    self.logger.info(f"Submitted: {self.url_snap}")
-                    break
-                elif 'Rate limit exceeded' in response_json['error']:
-                    raise Exception(f"{response_json['error']}")
-                else:
-                    self.logger.error(f"{self.url_snap}; {response_json['error']}, retrying in {TIMEGEP_SEC} seconds...")
-                    time.sleep(TIMEGEP_SEC)
-
-        # GET
-        while True:
-            async with session.get(res_url, headers=self.headers) as response:
-                response_json = await response.json()
-                if response_json['status'] == 'completed':
-                    self.logger.info(f"Completed: {self.url_snap}; {response_json['status']}")
-                    break
-                elif response_json['status'] == 'scraping':
-                    self.logger.info(f"Scraping: {self.url_snap}, retrying in {TIMEGEP_SEC} seconds...")
-                    await asyncio.sleep(TIMEGEP_SEC)
-        soup = BeautifulSoup(response_json['data'][0]['html'], 'html.parser')
-        return soup
+        self.payload['scrapeOptions']['waitFor'] = 15
+
+@mcp.tool()
+async def crawl_many(urls: list[str], max_concurrency: int = 4, formats: list[str] | None = None, ctx: Context | None = None):
+    """Crawl any number of URLs, at most `max_concurrency` at a time.
+
+    `formats` picks what each result carries: 'html' (trimmed, scripts and styles removed),
+    'text' and/or 'tables' (rows of cell texts). Each result is sent as a progress
+    notification as soon as its URL finishes; the return value lists them all in completion
+    order. A failed URL gives a result with `ok` false and its `error` and does not stop the others.
+    `formats` defaults to ['text'].
+    """
+    formats = ['text'] if formats is None else formats
+    results = []
+    async for result in crawl_pages(urls, max_concurrency, formats, crawler=FireCrawl):
+        results.append(result)
+        if ctx is not None:
+            await ctx.report_progress(len(results), len(set(urls)), message=json.dumps(result, ensure_ascii=False))
+    return results
 
 @mcp.tool()
 async def crawl_2_url(url_1, url_2):
-    async with aiohttp.ClientSession() as session:
-        tasks = [FireCrawl(url).crawl_async(session) for url in [url_1, url_2]]
-        soup_list = await asyncio.gather(*tasks)
-    return soup_list
+    """Trimmed HTML of two URLs, in argument order; crawl_many handles any number of URLs."""
+    results = {result['url']: result async for result in crawl_pages([url_1, url_2], 2, ['html'], crawler=FireCrawl)}
+    return [results[url] for url in [url_1, url_2]]
+
+# the history tools answer from the local SQLite index (history_index.py) in milliseconds,
+# with no crawl or network access; run `uv run history_index.py rebuild` once to fill it.
+# sqlite3 is blocking, the queries run off the MCP server's event loop
+HISTORY_SERIES_LIMIT = int(os.getenv('HISTORY_SERIES_LIMIT', 1000))
 
 @mcp.tool()
-async def get_us_epidata():
+async def list_history_datasets():
+    """Indexed datasets with their number of entities, points and first/last date, e.g. clinical_cov_trends or WHO_history_weekly_countries_reported_cases."""
+    return await asyncio.to_thread(HISTORY_INDEX.datasets)
+
+@mcp.tool()
+async def list_history_entities(dataset):
+    """Entities (country, WHO region, variant, age group or virus type) of an indexed dataset."""
+    return await asyncio.to_thread(HISTORY_INDEX.entities, dataset)
+
+@mcp.tool()
+async def query_history_series(dataset, entity=None, start=None, end=None, limit: int = HISTORY_SERIES_LIMIT):
+    """Stored records of a dataset in entity and date order, optionally of one entity and between two dates (YYYY-MM-DD, inclusive).
+
+    At most `limit` records are returned; when that many come back, narrow the query with an entity or dates.
+    """
+    return await asyncio.to_thread(HISTORY_INDEX.series, dataset, entity, start, end, limit)
+
+def _latest_variant_mix():
+    return {dataset: HISTORY_INDEX.latest(dataset) for dataset in ('clinical_cov_variants', 'wastewater_cov_variants', 'WHO_realtime_28d_variants_prevalence')}
+
+@mcp.tool()
+async def latest_variant_mix():
+    """Latest stored variant proportions: CDC clinical and wastewater, and the WHO 28-day prevalence."""
+    return await asyncio.to_thread(_latest_variant_mix)
+
+@mcp.tool()
+async def get_http_stats():
+    """Requests sent through the shared HTTP pool and how many reused a kept-alive connection."""
+    return HTTP_POOL.stats()
+
+@mcp.tool()
+async def get_pipeline_metrics():
+    """Time spent per crawl stage (queueing, FireCrawl submit/render, parsing, extraction, saving) and the pipeline counters."""
+    return METRICS.summary()
+
+def extract_page(url, html):
+    # an unchanged page yields the records extracted from it last time
+    time_now = datetime.now(timezone.utc)
+    with METRICS.span('extract', url=url) as span:
+        page_data = HTML_CACHE.records(url, html, us_pages, time_now)
+        span['cached'] = page_data is not None
+        if page_data is None:
+            page_data = EXTRACT_POOL.submit(US_SOURCE, url, html, time_now).result()
+            HTML_CACHE.store_records(url, html, us_pages, page_data, time_now)
+    return page_data
+
+def save_us_epidata(epi_us, epi_us_recent):
+    time_run = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+    if FIRECRAWL_MODE == 'replay':
+        # a replay re-extracts recorded pages, it is not a new run of the sources
+        logging.getLogger(__name__).info(f"Replay: run {time_run} not saved")
+        return
+    records = sum(len(i) for page in epi_us.values() for i in page.values())
+    with METRICS.span('save.snapshot', time_run=time_run):
+        SNAPSHOT_STORE.save('data_us_history', time_run, epi_us)
+        SNAPSHOT_STORE.save('data_us_recent', time_run, epi_us_recent)
+    METRICS.count('records_written_total', records, sink='snapshot', source='cdc')
+    with METRICS.span('save.parquet', time_run=time_run):
+        exported = PARQUET_EXPORT.export(epi_us, time_run)
+    METRICS.count('records_written_total', sum(exported.values()), sink='parquet', source='cdc')
+    with METRICS.span('save.index', time_run=time_run):
+        indexed = HISTORY_INDEX.index_run(epi_us, time_run)
+    METRICS.count('records_written_total', indexed, sink='index', source='cdc')
+
+async def crawl_us_epidata():
     
-    url_us = {
-        'all_respiratory_viruses': {
-            'summary': 'https://www.cdc.gov/respiratory-viruses/data/activity-levels.html',
-            'trends': 'https://www.cdc.gov/respiratory-viruses/data/activity-levels.html'
-        },
-        'clinical_cov': {
-            'trends': 'same with all_respiratory_viruses > trends > COVID-19_percent_of_tests_positive',
-            'variants': 'https://covid.cdc.gov/covid-data-tracker/#variant-proportions'
-        },
-        'wastewater_cov': {
-            'trends': 'https://www.cdc.gov/nwss/rv/COVID19-nationaltrend.html',
-            'variants': 'https://www.cdc.gov/nwss/rv/COVID19-variants.html'
-        }
-    }
+    budget = RateBudget(US_REQUESTS_PER_MINUTE, US_MAX_IN_FLIGHT)
+    tasks = {}
+    # activity-levels.html backs two entries of URL_US, fetch_pages scrapes it once
+    urls = [url for page in URL_US.values() for url in page.values() if url.startswith('https://')]
+    # datasets with a structured download selected in SOURCE_ADAPTERS skip their page
+    adapted, urls = await asyncio.to_thread(adapt, urls)
+    # static pages are served by a plain GET, FireCrawl renders only what the extractors cannot read without it
+    try:
+        async for url, html in fetch_pages(urls, budget, FireCrawl, cache=HTML_CACHE, validate=validates):
+            tasks[url] = asyncio.create_task(asyncio.to_thread(extract_page, url, html))
 
-    ## all_respiratory_viruses & clinical_cov trends
-    arv_soup = FireCrawl(url_us['all_respiratory_viruses']['summary']).crawl()
-    arv_summary_str = arv_soup.find('div', class_='update-snapshot').text.strip() # type: ignore
-    arv_summary = [
-        {
-        'date': str(datetime.strptime(''.join(arv_summary_str.split()[4:8])[:-3], '%A,%B%d,%Y').replace(tzinfo=timezone.utc)),
-        'virus_type': 'all respiratory viruses',
-        'summary': arv_summary_str
-        }
-    ]
-    arv_trends  = []
-    cc_cov_trends = []
-    for row in arv_soup.find_all('div', class_='table-container')[-1].find('tbody').find_all('tr'): # type: ignore
-        cells = row.find_all('td') # type: ignore
-        arv_trends_td = {
-            'date': str(datetime.strptime(cells[0].text.strip(), '%B %d, %Y').replace(tzinfo=timezone.utc)),
-            'virus_type': 'all respiratory viruses',
-            'COVID-19_percent_of_tests_positive': float(cells[1].text.strip()),
-            'Influenza_percent_of_tests_positive': float(cells[2].text.strip()),
-            'RSV_percent_of_tests_positive': float(cells[3].text.strip())
-        }
-        cov_td = {
-            'date': str(datetime.strptime(cells[0].text.strip(), '%B %d, %Y').replace(tzinfo=timezone.utc)),
-            'virus_type': 'COVID-19',
-            'COVID-19_percent_of_tests_positive': float(cells[1].text.strip())
-        }
-        arv_trends.append(arv_trends_td)
-        cc_cov_trends.append(cov_td)
-        
-    time.sleep(TIMEGEP_SEC)
-
-    ## clinical_cov variants
-    def filter_by_maxwidth(div_list, max_width):
-        filtered_divs = []
-        for div in div_list:
-            style_content = div['style']
-            for style in style_content.split(';'):
-                if 'max-width' in style:
-                    width = style.split(':')[1].strip()
-                    if width == max_width:
-                        filtered_divs.append(div)
-        return [i.text for i in filtered_divs]
-
-    cc_cov_variants_soup = FireCrawl(url_us['clinical_cov']['variants']).crawl()
-    cc_cov_raw_soup = cc_cov_variants_soup.select('#circulatingVariants')[0]
-    cc_cov_variants_list = cc_cov_raw_soup.find_all('div', class_ = 'tab-vizHeaderWrapper')
-    cc_cov_variant_name = filter_by_maxwidth([i.select('.tab-vizHeader')[0] for i in cc_cov_variants_list], '88px')
-    cc_cov_variant_ratio = filter_by_maxwidth([i.select('.tab-vizHeader')[0] for i in cc_cov_variants_list], '64px')[1:]
-    cc_cov_variants = [
-        {
-        'date': str(datetime.strptime(cc_cov_variants_list[-1].text, '%m/%d/%y').replace(tzinfo=timezone.utc)),
-        'virus_type': 'COVID-19',
-        'percentage': ';'.join([f"{voc}:{float(ratio[:-1])/100:.2f}" for voc, ratio in zip(cc_cov_variant_name, cc_cov_variant_ratio)]) + ';'
-        }
-    ]
-    time.sleep(TIMEGEP_SEC)
-
-    ## wastewater_cov
-    ww_cov_soup_list = await crawl_2_url(url_us['wastewater_cov']['trends'], url_us['wastewater_cov']['variants'])
-    ww_cov_trends = []
-    for row in ww_cov_soup_list[0].find('div', class_='table-container').find('tbody').find_all('tr'):
-        cov_td = {
-            'date': str(datetime.strptime(row.find('td').text.strip(), '%m/%d/%y').replace(tzinfo=timezone.utc)),
-            'virus_type': 'COVID-19',
-            'COVID-19_NWSS_wastewater_viral_activity_levels': float(row.find_all('td')[1].text.strip())
-        }
-        ww_cov_trends.append(cov_td)
-    time.sleep(TIMEGEP_SEC)
-
-    ww_cov_variants = []
-    ww_cov_variants_soup = ww_cov_soup_list[1].find('div', class_='table-container')
-    ww_cov_variants_name = [i.text.split('Press')[0].strip() for i in ww_cov_variants_soup.find('thead').find_all('th')]
-    ww_cov_variants_name[0] = 'Date'
-    for row in ww_cov_variants_soup.find('tbody').find_all('tr'):
-        cells = row.find_all('td')
-        ww_cov_var = dict(zip(ww_cov_variants_name, [i.text.strip() for i in cells]))
-        ww_cov_td = {
-            'date': str(datetime.strptime(ww_cov_var['Date'], '%Y-%m-%d').replace(tzinfo=timezone.utc)),
-            'virus_type': 'COVID-19',
-            'percentage': ';'.join([f"{voc}:{float(partio[:-1]) / 100:.2f}" for voc, partio in ww_cov_var.items() if voc != 'Date' and partio != 'N/A'])
-        }
-        ww_cov_variants.append(ww_cov_td)
-    time.sleep(TIMEGEP_SEC)
+        datasets = {}
+        for task in tasks.values():
+            datasets.update(await task)
+    finally:
+        # validation records of pages whose records came from the cache
+        forget_validated(urls)
+    datasets.update(adapted)
+    arv_summary, arv_trends, cc_cov_trends = datasets['arv_summary'], datasets['arv_trends'], datasets['cc_cov_trends']
+    cc_cov_variants, ww_cov_trends, ww_cov_variants = datasets['cc_cov_variants'], datasets['ww_cov_trends'], datasets['ww_cov_variants']
 
     epi_us = {
         'all_respiratory_viruses': {
@@ -231,10 +183,6 @@ async def get_us_epidata():
             'variants': ww_cov_variants
         }
     }
-    os.makedirs('history') if not os.path.exists('history') else None
-    with open(f'history/data_us_history_{TIME_NOW}.json', 'w') as f:
-        json.dump(epi_us, f, indent=4)
-
     epi_us_recent = {
         'all_respiratory_viruses': {
             'summary': arv_summary,
@@ -249,88 +197,111 @@ async def get_us_epidata():
             'variants': ww_cov_variants[0:10]
         }
     }
-    os.makedirs('recent') if not os.path.exists('recent') else None
-    with open(f'recent/data_us_recent_{TIME_NOW}.json', 'w') as f:
-        json.dump(epi_us_recent, f, indent=4)
+    await asyncio.to_thread(save_us_epidata, epi_us, epi_us_recent)
     
     return epi_us, epi_us_recent
 
+def last_us_epidata():
+    """The last saved (epi_us, epi_us_recent) and when it was crawled, None before the first run."""
+    runs = SNAPSHOT_STORE.runs('data_us_history')
+    if not runs or runs[-1] not in SNAPSHOT_STORE.runs('data_us_recent'):
+        return None
+    fetched_at = datetime.strptime(runs[-1], "%Y-%m-%d-%H-%M-%S").timestamp()
+    return (SNAPSHOT_STORE.load('data_us_history', runs[-1]), SNAPSHOT_STORE.load('data_us_recent', runs[-1])), fetched_at
+
+US_EPIDATA_CACHE = StaleWhileRevalidate(crawl_us_epidata, US_EPIDATA_TTL_SEC, load=last_us_epidata)
+
+@mcp.tool()
+async def get_us_epidata():
+    """US respiratory virus data from the last good crawl, with its age; a stale result starts a new crawl in the background.
+
+    Returns {'epi_us', 'epi_us_recent', 'age_sec', 'stale'}. Before the result cache this tool
+    returned the pair [epi_us, epi_us_recent]; clients reading it by position read the two keys instead.
+    """
+    (epi_us, epi_us_recent), age_sec = await US_EPIDATA_CACHE.get()
+    return {
+        'epi_us': epi_us,
+        'epi_us_recent': epi_us_recent,
+        'age_sec': age_sec,
+        'stale': age_sec >= US_EPIDATA_CACHE.ttl_sec
+    }
+
 @mcp.tool()
-def update_db(epi_us, epi_us_recent):
+async def get_us_epidata_cache_stats():
+    """Hits, stale hits, misses, refreshes and age of the get_us_epidata result cache."""
+    return US_EPIDATA_CACHE.stats()
+
+US_DB = 'epi-crawl'
+# collection -> the latest record of epi_us it is updated with
+US_DB_COLLECTIONS = {
+    'all_respiratory_viruses_summary': lambda epi_us: epi_us['all_respiratory_viruses']['summary'][0],
+    'all_respiratory_viruses_trends': lambda epi_us: epi_us['all_respiratory_viruses']['trends'][0],
+    'clinical_cov_trends': lambda epi_us: epi_us['clinical_cov']['trends'][0],
+    'clinical_cov_variants': lambda epi_us: epi_us['clinical_cov']['variants'][0],
+    'wastewater_cov_trends': lambda epi_us: epi_us['wastewater_cov']['trends'][0],
+    'wastewater_cov_variants': lambda epi_us: epi_us['wastewater_cov']['variants'][0]
+}
+US_DB_INDEXES = {
+    **{collection: [[('virus_type', pymongo.ASCENDING), ('date', pymongo.DESCENDING)], [('date', pymongo.DESCENDING)]] for collection in US_DB_COLLECTIONS},
+    'recent_shortcasts': [[('date', pymongo.DESCENDING)]]
+}
+
+def _update_db(epi_us, epi_us_recent):
     
-    update_record_list = []
     logger = logging.getLogger(__name__)
-    MONGO_CLIENT = pymongo.MongoClient("mongodb://localhost:27017/")
-    MONGO_DB = MONGO_CLIENT["epi-crawl"]
-    
-    def update(head, db):
+    if FIRECRAWL_MODE == 'replay':
+        logger.info('🏖️ replay, no update')
+        return
+    MONGO_STORE.ensure_indexes(US_DB, US_DB_INDEXES)
+    latest = MONGO_STORE.latest_dates(US_DB, list(US_DB_COLLECTIONS))
+
+    upserts = {}
+    for collection, head_of in US_DB_COLLECTIONS.items():
+        head = head_of(epi_us)
         d_head = datetime.strptime(str(head['date']), '%Y-%m-%d %H:%M:%S%z')
-        for i in db.find().sort('date', pymongo.DESCENDING).limit(1):
-            d_db = i['date'].replace(tzinfo=timezone.utc)
-        if d_head > d_db:
-            document = head
-            document['date'] = d_head
-            db.insert_one(document)
-            logger.info(f'🌟 update {db.name}: {str(d_db)[:10]} -> {str(d_head)[:10]}')
-            return document
+        d_db = latest[collection]
+        if d_db is None or d_head > d_db:
+            document = {**head, 'date': d_head}
+            upserts[collection] = [({'virus_type': document['virus_type'], 'date': d_head}, document)]
+            logger.info(f'🌟 update {collection}: {str(d_db)[:10]} -> {str(d_head)[:10]}')
         else:
-            logger.info(f'🏖️ no update {db.name}: {str(d_db)[:10]} -> {str(d_head)[:10]}')
-            return None
-    
-    for head, db in zip(
-        [
-            epi_us['all_respiratory_viruses']['summary'][0],
-            epi_us['all_respiratory_viruses']['trends'][0],
-            epi_us['clinical_cov']['trends'][0],
-            epi_us['clinical_cov']['variants'][0],
-            epi_us['wastewater_cov']['trends'][0],
-            epi_us['wastewater_cov']['variants'][0],
-        ],
-        [
-            MONGO_DB.all_respiratory_viruses_summary,
-            MONGO_DB.all_respiratory_viruses_trends,
-            MONGO_DB.clinical_cov_trends,
-            MONGO_DB.clinical_cov_variants,
-            MONGO_DB.wastewater_cov_trends,
-            MONGO_DB.wastewater_cov_variants
-        ]
-    ):
-        update_record = update(head, db)
-        if update_record is not None:
-            update_record_list.append(update_record)
-    if len(update_record_list) == 0:
+            logger.info(f'🏖️ no update {collection}: {str(d_db)[:10]} -> {str(d_head)[:10]}')
+
+    if len(upserts) == 0:
         logger.info('🏖️ no update')
         return
-    else:
-        MONGO_DB.recent_shortcasts.insert_one({
-            "date": datetime.strptime(str(epi_us_recent["all_respiratory_viruses"]["summary"][0]["date"]), '%Y-%m-%d %H:%M:%S%z').replace(tzinfo=timezone.utc),
-            "recent": epi_us_recent
-        })
-        logger.info(f'🌟 update recent_shortcasts: {str(epi_us_recent["all_respiratory_viruses"]["summary"][0]["date"])[:10]}')
-
-    MONGO_CLIENT.close()
-    logger.info(f"Total Updated {len(update_record_list)} items.")
+
+    d_recent = datetime.strptime(str(epi_us_recent["all_respiratory_viruses"]["summary"][0]["date"]), '%Y-%m-%d %H:%M:%S%z').replace(tzinfo=timezone.utc)
+    upserts['recent_shortcasts'] = [({'date': d_recent}, {"date": d_recent, "recent": epi_us_recent})]
+    with METRICS.span('save.mongo', collections=len(upserts)):
+        MONGO_STORE.write(US_DB, upserts)
+    METRICS.count('records_written_total', sum(len(i) for i in upserts.values()), sink='mongo', source='cdc')
+    logger.info(f'🌟 update recent_shortcasts: {str(d_recent)[:10]}')
+
+    logger.info(f"Total Updated {len(upserts) - 1} items.")
     logger.info(f"✅ epi-crawl updated successfully, next update in 5 days...")
     
     return
 
+@mcp.tool()
+async def update_db(epi_us, epi_us_recent):
+    # pymongo is blocking, keep it off the MCP server's event loop
+    return await asyncio.to_thread(_update_db, epi_us, epi_us_recent)
+
+async def run_us_update():
+    epi_us, epi_us_recent = await crawl_us_epidata()
+    await update_db(epi_us, epi_us_recent)
+    logging.getLogger(__name__).info(f"HTTP connections: {HTTP_POOL.stats()}")
+
+def us_source():
+    # activity-levels.html is a static page updated with the weekly data; covid.cdc.gov pages are script shells
+    return Source('cdc', run_us_update, US_CADENCE_SEC, probe=HeadProbe([URL_US['all_respiratory_viruses']['summary']]), probe_sec=US_PROBE_SEC)
+
 if __name__ == "__main__":
     
     ## if using MCP, uncomment the following line, and comment the rest line, and run: uv run epi-crawl.py
     # mcp.run(transport='stdio')
 
     ## if not using MCP, uncomment the following line, and comment the above line, and run: python epi-crawl.py or uv run epi-crawl.py
-    async def main():
-        while True:
-            try:
-                epi_us, epi_us_recent = await get_us_epidata()
-                update_db(epi_us, epi_us_recent)
-                time.sleep(3600 * 24 * 5)
-            except FireCrawlRateLimitExceeded as e:
-                time.sleep(600)
-            except Exception as e:
-                print(e)
-                print('⚠️ An error occurred, retrying in 3 hours...')
-                time.sleep(60*60*3)
-
-    asyncio.run(main())
+    ## scheduler.py runs this and the WHO pipeline in one process
+    asyncio.run(Scheduler([us_source()]).run())
@@ -0,0 +1,233 @@
+import os
+import atexit
+import asyncio
+import hashlib
+import importlib
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timezone
+from utils import ElementIndex, make_soup
+from metrics import METRICS
+
+# worker processes for parsing and extraction; 0 extracts in the calling process, the default on a single core
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', os.cpu_count() if (os.cpu_count() or 1) > 1 else 0))
+
+class per_group:
+    """Marks a `Dataset` field computed once per group instead of once per row."""
+    def __init__(self, mapper):
+        self.mapper = mapper
+
+def sha256(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def run_stamp(time_now):
+    """`time_now` as RUN_TIME fields and parse functions write it into records."""
+    return str(time_now.replace(tzinfo=timezone.utc))
+
+# a `Dataset` field set to the run's time_now, the same for every record of a run
+RUN_TIME = object()
+
+class Dataset:
+    """One dataset of a page, declared instead of hand-written.
+
+    `container` is a page-level (name, attrs) lookup; `select` picks which match to read
+    (None reads every match). Inside it `rows` selects the records, either a (name, attrs)
+    find_all with the first `skip` matches dropped or a callable of the container; without
+    `rows` the container itself is the one record. With `group`, rows are selected inside each
+    group match and `per_group` fields are computed from the group. `fields` maps every
+    record key to a function of the row, or RUN_TIME for the run's time_now.
+
+    Datasets that do not fit rows and fields give `parse(index, time_now)` returning the
+    records, and list the `containers` it reads so they survive subtree parsing; without
+    them the whole page is parsed.
+    """
+    def __init__(self, name, container=None, rows=None, fields=None, group=None, skip=0, select=0, parse=None, containers=None):
+        self.name = name
+        self.container = container
+        self.rows = rows
+        self.fields = fields or {}
+        self.group = group
+        self.skip = skip
+        self.select = select
+        self.parse = parse
+        if container is None and parse is None:
+            raise ValueError(f"dataset {name} needs a container or a parse function")
+        # None: the whole page
+        self.containers = containers or ([container] if container is not None else None)
+
+    def _rows(self, container):
+        if self.rows is None:
+            return [container]
+        if callable(self.rows):
+            return self.rows(container)
+        name, attrs = self.rows
+        return container.find_all(name, attrs)[self.skip:]
+
+    def _records(self, container, time_now):
+        run_time = run_stamp(time_now)
+        def value(mapper, row):
+            return run_time if mapper is RUN_TIME else mapper(row)
+        if self.group is None:
+            return [{key: value(mapper, row) for key, mapper in self.fields.items()} for row in self._rows(container)]
+        records = []
+        for group in container.find_all(*self.group):
+            group_values = {key: mapper.mapper(group) for key, mapper in self.fields.items() if isinstance(mapper, per_group)}
+            for row in self._rows(group):
+                records.append({key: group_values[key] if key in group_values else value(mapper, row) for key, mapper in self.fields.items()})
+        return records
+
+    def extract(self, index, time_now):
+        if self.parse is not None:
+            return self.parse(index, time_now)
+        containers = index.find_all(*self.container)
+        if self.select is not None:
+            containers = [containers[self.select]]
+        return [record for container in containers for record in self._records(container, time_now)]
+
+# page url -> datasets, filled by the source modules when they are imported
+REGISTRY = {}
+
+def register(page, datasets):
+    """Declare the datasets extracted from `page`; registering a page again replaces them."""
+    REGISTRY[page] = datasets
+
+def page_containers(page):
+    """The containers the datasets of `page` read, None when one of them needs the whole page."""
+    containers = []
+    for dataset in REGISTRY[page]:
+        if dataset.containers is None:
+            return None
+        containers.extend(i for i in dataset.containers if i not in containers)
+    return containers
+
+def extract_index(page, index, time_now):
+    """Records of every dataset registered for `page`, by dataset name, from its `ElementIndex`."""
+    records = {}
+    for dataset in REGISTRY[page]:
+        with METRICS.span('extract.dataset', url=page, dataset=dataset.name) as span:
+            # several datasets with one name are concatenated in registration order
+            extracted = dataset.extract(index, time_now)
+            span['records'] = len(extracted)
+        records.setdefault(dataset.name, []).extend(extracted)
+    return records
+
+def extract_html(page, html, time_now, parser=None):
+    """`extract_index` of the raw HTML, parsing only the containers its datasets read."""
+    with METRICS.span('parse', url=page, bytes=len(html)):
+        index = ElementIndex(make_soup(html, parser, page_containers(page)))
+    return extract_index(page, index, time_now)
+
+def restamp(records, stamp, time_now):
+    """`records` by dataset with every value equal to the run stamp `stamp` replaced by `time_now`'s."""
+    run_time = run_stamp(time_now)
+    return {
+        dataset: [{key: run_time if value == stamp else value for key, value in record.items()} for record in items]
+        for dataset, items in records.items()
+    }
+
+# (page, content hash) -> (run stamp, records) of pages `validates` accepted, taken by the next
+# extraction of that HTML; a run `forget_validated`s its pages when it ends
+VALIDATED = {}
+
+def validates(page, html):
+    """Whether every dataset registered for `page` finds records in `html`, i.e. the page did not need rendering.
+
+    The records are kept for `ExtractPool`, so an accepted page is not extracted a second time.
+    """
+    if page not in REGISTRY:
+        return False
+    time_now = datetime.now(timezone.utc)
+    try:
+        records = extract_html(page, html, time_now)
+    except Exception:
+        return False
+    if not all(records.get(dataset.name) for dataset in REGISTRY[page]):
+        return False
+    VALIDATED[(page, sha256(html))] = (run_stamp(time_now), records)
+    return True
+
+def validated(page, html, time_now):
+    """The records `validates` extracted from this HTML, stamped with `time_now`, or None."""
+    kept = VALIDATED.pop((page, sha256(html)), None)
+    return None if kept is None else restamp(kept[1], kept[0], time_now)
+
+def forget_validated(pages):
+    """Drop what `validates` kept for `pages`, such as pages then served from the records cache."""
+    for key in list(VALIDATED):
+        if key[0] in pages:
+            VALIDATED.pop(key, None)
+
+def run_extract(source, page, html, time_now, parent=None):
+    """Process pool entry point: import the module that registers `page` and extract it.
+
+    Returns the records and the metrics collected meanwhile, for the parent to replay;
+    `parent` is the parent's `METRICS.context()`, so the spans join its trace.
+    """
+    importlib.import_module(source)
+    with METRICS.collect(parent) as collected:
+        records = extract_html(page, html, time_now)
+    return records, collected
+
+def replayed(future):
+    """A Future of the records of a `run_extract` future, its metrics replayed into METRICS."""
+    records = Future()
+    def done(future):
+        try:
+            result, collected = future.result()
+        except BaseException as e:
+            records.set_exception(e)
+            return
+        METRICS.replay(collected)
+        records.set_result(result)
+    future.add_done_callback(done)
+    return records
+
+class ExtractPool:
+    """Process pool running `run_extract`, so parsing and extraction use every core.
+
+    Workers receive the raw HTML and return plain records, no soup crosses a process
+    boundary. They are spawned rather than forked since the parent runs threads (HTTP pool,
+    asyncio.to_thread) and started on first use.
+    """
+    def __init__(self, workers=EXTRACT_WORKERS):
+        self.workers = workers
+        self.executor = None
+
+    def _executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    def submit(self, source, page, html, time_now):
+        """A concurrent.futures.Future of the page's records."""
+        records = validated(page, html, time_now)
+        if records is not None:
+            future = Future()
+            future.set_result(records)
+            return future
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(run_extract(source, page, html, time_now, METRICS.context()))
+            except Exception as e:
+                future.set_exception(e)
+            return replayed(future)
+        return replayed(self._executor().submit(run_extract, source, page, html, time_now, METRICS.context()))
+
+    async def extract(self, source, page, html, time_now):
+        records = validated(page, html, time_now)
+        if records is not None:
+            return records
+        if self.workers <= 0:
+            records, collected = await asyncio.to_thread(run_extract, source, page, html, time_now, METRICS.context())
+            METRICS.replay(collected)
+            return records
+        return await asyncio.wrap_future(self.submit(source, page, html, time_now))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+EXTRACT_POOL = ExtractPool()
+atexit.register(EXTRACT_POOL.shutdown)
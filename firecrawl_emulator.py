@@ -0,0 +1,305 @@
+"""Local stand-in for the FireCrawl job API, for load and concurrency tests without an API key.
+
+    uv run firecrawl_emulator.py serve --render-sec 5 --failure-rate 0.05 --requests-per-minute 20
+    FIRECRAWL_ENDPOINT=http://127.0.0.1:3002/v1/crawl uv run epi-crawl.py
+
+    uv run firecrawl_emulator.py loadtest --pages 40 --concurrency 1,4,8,16
+
+It implements what `FireCrawl` uses: POST /v1/crawl and /v1/batch/scrape answer
+{success, id, url}; GET on that url answers {status: scraping|completed|failed, total,
+completed, data: [{html, metadata.sourceURL}], next}. Pages are the recorded FireCrawl
+fixtures (FIRECRAWL_FIXTURES), or a generated page for any other URL. Each page takes a
+random render time on a pool of `workers` renderers, a fraction of jobs fail, and submissions
+over `requests_per_minute` get FireCrawl's 429 "Rate limit exceeded ... retry after Ns".
+"""
+import os
+import sys
+import time
+import heapq
+import shutil
+import random
+import asyncio
+import argparse
+import tempfile
+import itertools
+from collections import deque
+from aiohttp import web
+from loguru import logger
+
+EMULATOR_HOST = os.getenv('EMULATOR_HOST', '127.0.0.1')
+EMULATOR_PORT = int(os.getenv('EMULATOR_PORT', 3002))
+# mean render time of a page and its relative spread
+EMULATOR_RENDER_SEC = float(os.getenv('EMULATOR_RENDER_SEC', 5))
+EMULATOR_RENDER_JITTER = float(os.getenv('EMULATOR_RENDER_JITTER', 0.5))
+# fraction of pages rendering `EMULATOR_SLOW_FACTOR` times slower, the tail a real renderer has
+EMULATOR_SLOW_RATE = float(os.getenv('EMULATOR_SLOW_RATE', 0.05))
+EMULATOR_SLOW_FACTOR = float(os.getenv('EMULATOR_SLOW_FACTOR', 5))
+EMULATOR_FAILURE_RATE = float(os.getenv('EMULATOR_FAILURE_RATE', 0))
+# submissions accepted per minute, 0 for no limit
+EMULATOR_REQUESTS_PER_MINUTE = float(os.getenv('EMULATOR_REQUESTS_PER_MINUTE', 0))
+# pages rendered at once, later ones wait for a free renderer; 0 for no limit
+EMULATOR_WORKERS = int(os.getenv('EMULATOR_WORKERS', 0))
+EMULATOR_BATCH_PAGE_SIZE = int(os.getenv('EMULATOR_BATCH_PAGE_SIZE', 10))
+EMULATOR_PAGE_KB = int(os.getenv('EMULATOR_PAGE_KB', 200))
+
+def generated_page(url, kb=EMULATOR_PAGE_KB):
+    row = f'<tr><td>{url}</td><td>0.00</td></tr>'
+    return f'<html><head><title>{url}</title></head><body><table>{row * max(1, kb * 1024 // len(row))}</table></body></html>'
+
+class FirecrawlEmulator:
+    """The emulated API; `pages` maps URL to HTML, other URLs get `generated_page`."""
+    def __init__(self, pages=None, render_sec=EMULATOR_RENDER_SEC, jitter=EMULATOR_RENDER_JITTER, slow_rate=EMULATOR_SLOW_RATE,
+                 slow_factor=EMULATOR_SLOW_FACTOR, failure_rate=EMULATOR_FAILURE_RATE, requests_per_minute=EMULATOR_REQUESTS_PER_MINUTE,
+                 workers=EMULATOR_WORKERS, batch_page_size=EMULATOR_BATCH_PAGE_SIZE, seed=None):
+        self.pages = pages or {}
+        self.render_sec = render_sec
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.failure_rate = failure_rate
+        self.requests_per_minute = requests_per_minute
+        self.workers = workers
+        self.batch_page_size = batch_page_size
+        self.random = random.Random(seed)
+        self.ids = itertools.count(1)
+        # job id -> {'kind', 'pages': [{'url', 'ready_at', 'failed'}]}
+        self.jobs = {}
+        self.submitted = deque()
+        self.free_at = []
+        self.stats = {'submitted': 0, 'pages': 0, 'polls': 0, 'rate_limited': 0, 'failed': 0}
+
+    def _render(self, now):
+        """When a page submitted `now` is rendered, on the first free renderer."""
+        seconds = self.render_sec * self.random.uniform(1 - self.jitter, 1 + self.jitter)
+        if self.random.random() < self.slow_rate:
+            seconds *= self.slow_factor
+        if not self.workers:
+            return now + seconds
+        start = now
+        if len(self.free_at) >= self.workers:
+            start = max(now, heapq.heappop(self.free_at))
+        heapq.heappush(self.free_at, start + seconds)
+        return start + seconds
+
+    def _rate_limited(self, now):
+        """Seconds until a submission is allowed again, or None when this one is."""
+        if not self.requests_per_minute:
+            return None
+        while self.submitted and now - self.submitted[0] >= 60:
+            self.submitted.popleft()
+        if len(self.submitted) >= self.requests_per_minute:
+            return 60 - (now - self.submitted[0])
+        self.submitted.append(now)
+        return None
+
+    def _submit(self, request, kind, urls):
+        now = time.monotonic()
+        wait = self._rate_limited(now)
+        if wait is not None:
+            self.stats['rate_limited'] += 1
+            seconds = max(1, round(wait))
+            return web.json_response({
+                'success': False,
+                'error': f"Rate limit exceeded. Consumed (req/min): {len(self.submitted)}, Remaining (req/min): 0. "
+                         f"Upgrade your plan at https://firecrawl.dev/pricing for increased rate limits or please retry after {seconds}s"
+            }, status=429, headers={'Retry-After': str(seconds)})
+        job_id = f'{kind}-{next(self.ids)}'
+        self.jobs[job_id] = {'kind': kind, 'pages': [
+            {'url': url, 'ready_at': self._render(now), 'failed': self.random.random() < self.failure_rate} for url in urls
+        ]}
+        self.stats['submitted'] += 1
+        self.stats['pages'] += len(urls)
+        path = 'crawl' if kind == 'crawl' else 'batch/scrape'
+        # FireCrawl answers with an https status url, the client swaps in its endpoint's scheme
+        return web.json_response({'success': True, 'id': job_id, 'url': f'https://{request.host}/v1/{path}/{job_id}'})
+
+    def _document(self, url):
+        return {'html': self.pages.get(url) or generated_page(url), 'metadata': {'sourceURL': url, 'statusCode': 200}}
+
+    async def post_crawl(self, request):
+        body = await request.json()
+        return self._submit(request, 'crawl', [body['url']])
+
+    async def post_batch(self, request):
+        body = await request.json()
+        return self._submit(request, 'batch', list(dict.fromkeys(body['urls'])))
+
+    async def get_status(self, request):
+        job = self.jobs.get(request.match_info['id'])
+        if job is None:
+            return web.json_response({'success': False, 'error': 'Job not found'}, status=404)
+        self.stats['polls'] += 1
+        now = time.monotonic()
+        done = [i for i in job['pages'] if i['ready_at'] <= now]
+        failed = [i for i in done if i['failed']]
+        if failed and job['kind'] == 'crawl':
+            if not job.get('finished'):
+                self.stats['failed'] += 1
+                job['finished'] = True
+            return web.json_response({'success': True, 'status': 'failed', 'total': 1, 'completed': 0, 'data': []})
+        completed = [i for i in done if not i['failed']]
+        if len(done) < len(job['pages']):
+            status = 'scraping'
+        else:
+            status = 'completed'
+            if not job.get('finished'):
+                # a batch completes with its failed pages missing from data, as FireCrawl's does
+                self.stats['failed'] += len(failed)
+                job['finished'] = True
+        skip = int(request.query.get('skip', 0))
+        page = completed[skip:skip + self.batch_page_size]
+        response = {'success': True, 'status': status, 'total': len(job['pages']), 'completed': len(completed), 'data': [self._document(i['url']) for i in page]}
+        if skip + self.batch_page_size < len(completed):
+            response['next'] = f'https://{request.host}{request.path}?skip={skip + self.batch_page_size}'
+        return web.json_response(response)
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/v1/crawl', self.post_crawl)
+        app.router.add_get('/v1/crawl/{id}', self.get_status)
+        app.router.add_post('/v1/batch/scrape', self.post_batch)
+        app.router.add_get('/v1/batch/scrape/{id}', self.get_status)
+        app.router.add_get('/stats', self.get_stats)
+        return app
+
+    async def start(self, host=EMULATOR_HOST, port=EMULATOR_PORT):
+        """Serve in the running event loop; returns the runner to `cleanup()`."""
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"FireCrawl emulator on http://{host}:{port}/v1/crawl with {len(self.pages)} recorded pages")
+        return runner
+
+def recorded_pages():
+    from utils import FIXTURES
+    return dict(FIXTURES.pages())
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+async def load_test(emulator, urls, concurrencies, requests_per_minute, batch=False, host=EMULATOR_HOST, port=EMULATOR_PORT):
+    """Crawl `urls` through `FireCrawl` against `emulator` once per concurrency; returns a row per run.
+
+    Each run submits every URL at once behind a `RateBudget` of that many jobs in flight, as
+    `fetch_pages` does, or as one batch job with `batch`. Latency is from submission to page,
+    end to end is from the start of the run, so it includes the queueing behind the budget.
+    Every run starts afresh: the poll schedules learned by `POLLER` are forgotten and it
+    submits under its own API key, so no ledger tokens or 429 breaker carry over.
+    """
+    from utils import FireCrawl, RateBudget, FireCrawlRateLimitExceeded, HTTP_POOL, POLLER
+    runner = await emulator.start(host, port)
+    api_key = os.environ.get('FIRECRAWL_API_KEY')
+    rows = []
+    try:
+        for concurrency in concurrencies:
+            POLLER.completions.clear()
+            os.environ['FIRECRAWL_API_KEY'] = f"{api_key}-{'batch' if batch else concurrency}"
+            before = dict(emulator.stats)
+            latencies, end_to_end, errors, rate_limited = [], [], 0, 0
+            start = time.perf_counter()
+            if batch:
+                async for url, html in FireCrawl.batch_async(urls):
+                    end_to_end.append(time.perf_counter() - start)
+                latencies = list(end_to_end)
+            else:
+                budget = RateBudget(requests_per_minute, concurrency)
+                async def crawl(url):
+                    async with budget:
+                        submitted = time.perf_counter()
+                        await FireCrawl(url).fetch_async()
+                        done = time.perf_counter()
+                    return done - submitted, done - start
+                for result in await asyncio.gather(*[crawl(url) for url in urls], return_exceptions=True):
+                    if isinstance(result, FireCrawlRateLimitExceeded):
+                        rate_limited += 1
+                    elif isinstance(result, BaseException):
+                        errors += 1
+                    else:
+                        latencies.append(result[0])
+                        end_to_end.append(result[1])
+            elapsed = time.perf_counter() - start
+            rows.append({
+                'concurrency': 'batch' if batch else concurrency,
+                'pages': len(latencies),
+                'errors': errors,
+                'rate_limited': rate_limited,
+                'elapsed_sec': elapsed,
+                'pages_per_min': len(latencies) / elapsed * 60,
+                'latency_p50': percentile(latencies, 0.5),
+                'latency_p95': percentile(latencies, 0.95),
+                'latency_p99': percentile(latencies, 0.99),
+                'end_to_end_p95': percentile(end_to_end, 0.95),
+                'polls': emulator.stats['polls'] - before['polls'],
+                '429s': emulator.stats['rate_limited'] - before['rate_limited']
+            })
+            if batch:
+                break
+    finally:
+        if api_key is None:
+            os.environ.pop('FIRECRAWL_API_KEY', None)
+        else:
+            os.environ['FIRECRAWL_API_KEY'] = api_key
+        await runner.cleanup()
+        await HTTP_POOL.aclose()
+    return rows
+
+def print_rows(rows):
+    print(f"{'concurrency':>11} {'pages':>6} {'errors':>6} {'limited':>7} {'429':>5} {'elapsed s':>10} {'pages/min':>10} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'e2e p95 s':>10} {'polls':>6}")
+    for row in rows:
+        print(f"{row['concurrency']:>11} {row['pages']:>6} {row['errors']:>6} {row['rate_limited']:>7} {row['429s']:>5} {row['elapsed_sec']:>10.1f} {row['pages_per_min']:>10.1f} "
+              f"{row['latency_p50']:>7.2f} {row['latency_p95']:>7.2f} {row['latency_p99']:>7.2f} {row['end_to_end_p95']:>10.2f} {row['polls']:>6}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_cmd = subparsers.add_parser('serve', help='run the emulator')
+    loadtest_cmd = subparsers.add_parser('loadtest', help='measure crawl throughput and latency against the emulator')
+    for cmd in (serve_cmd, loadtest_cmd):
+        cmd.add_argument('--host', default=EMULATOR_HOST)
+        cmd.add_argument('--port', type=int, default=EMULATOR_PORT)
+        cmd.add_argument('--render-sec', type=float, default=EMULATOR_RENDER_SEC)
+        cmd.add_argument('--jitter', type=float, default=EMULATOR_RENDER_JITTER)
+        cmd.add_argument('--slow-rate', type=float, default=EMULATOR_SLOW_RATE)
+        cmd.add_argument('--slow-factor', type=float, default=EMULATOR_SLOW_FACTOR)
+        cmd.add_argument('--failure-rate', type=float, default=EMULATOR_FAILURE_RATE)
+        cmd.add_argument('--requests-per-minute', type=float, default=EMULATOR_REQUESTS_PER_MINUTE, help='emulated quota, 0 for none')
+        cmd.add_argument('--workers', type=int, default=EMULATOR_WORKERS, help='pages rendered at once, 0 for no limit')
+        cmd.add_argument('--seed', type=int)
+    loadtest_cmd.add_argument('--pages', type=int, default=40, help='URLs to crawl per run, cycling through the recorded pages')
+    loadtest_cmd.add_argument('--concurrency', default='1,4,8,16', help='comma separated jobs in flight, one run each')
+    loadtest_cmd.add_argument('--client-requests-per-minute', type=float, default=600, help="the client's RateBudget and ledger quota")
+    loadtest_cmd.add_argument('--batch', action='store_true', help='submit all pages as one batch job instead')
+    args = parser.parse_args()
+
+    if args.command == 'loadtest':
+        # the client talks to the emulator, with its own ledger so the real API key's bucket is untouched
+        os.environ['FIRECRAWL_ENDPOINT'] = f'http://{args.host}:{args.port}/v1/crawl'
+        os.environ.pop('FIRECRAWL_BATCH_ENDPOINT', None)
+        os.environ['FIRECRAWL_API_KEY'] = 'emulator'
+        ledger_dir = tempfile.mkdtemp(prefix='emulator_ledger_')
+        os.environ['FIRECRAWL_LEDGER'] = os.path.join(ledger_dir, 'ledger.sqlite3')
+        os.environ['FIRECRAWL_REQUESTS_PER_MINUTE'] = str(args.client_requests_per_minute)
+        os.environ['FIRECRAWL_MODE'] = 'live'
+        # nor the crawl's metrics sinks
+        os.environ['METRICS_SPANS'] = ''
+        os.environ['METRICS_TEXTFILE'] = ''
+        # a line per poll of every job would drown the table
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+    pages = recorded_pages()
+    emulator = FirecrawlEmulator(pages, args.render_sec, args.jitter, args.slow_rate, args.slow_factor, args.failure_rate, args.requests_per_minute, args.workers, seed=args.seed)
+
+    if args.command == 'serve':
+        web.run_app(emulator.app(), host=args.host, port=args.port, access_log=None)
+        sys.exit(0)
+
+    urls = [url for url, _ in zip(itertools.cycle(pages or [f'https://emulated.example/page/{i}' for i in range(args.pages)]), range(args.pages))]
+    try:
+        rows = asyncio.run(load_test(emulator, urls, [int(i) for i in args.concurrency.split(',')], args.client_requests_per_minute, args.batch, args.host, args.port))
+    finally:
+        shutil.rmtree(ledger_dir, ignore_errors=True)
+    print_rows(rows)
@@ -1,366 +1,235 @@
-import re
 import os
+import sys
 import time
+import gzip
 import json
+import hashlib
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
-from utils import FireCrawl
-from pymongo import MongoClient
-from datetime import datetime, timezone
+from utils import FireCrawl, RateBudget, HTTP_POOL, FETCH_TIERS, fetch_pages, fetch_direct, FIRECRAWL_MODE
+from extraction import validates, forget_validated, EXTRACT_POOL
+import who_pages
+from who_pages import WHO_URL_LIST, WHO_SOURCE
+from html_cache import HTML_CACHE
+from pymongo import ASCENDING, DeleteMany, InsertOne, UpdateOne
+from bson import Binary
+from mongo_store import MONGO_STORE
+from snapshot_store import SNAPSHOT_STORE
+from parquet_export import PARQUET_EXPORT
+from history_index import HISTORY_INDEX
+from metrics import METRICS
+from source_adapters import adapt
+from scheduler import Source, HeadProbe
+from datetime import datetime, timedelta, timezone
 
-def get_who_covid19():
-    TIME_SLEEP = 60
-    TIME_RUN = datetime.now(timezone.utc).strftime('%Y-%m-%d-%H-%M-%S')
-    TIME_NOW = datetime.now(timezone.utc)
-    WHO_URL_LIST = [
-        'https://data.who.int/dashboards/covid19/summary',
-        'https://data.who.int/dashboards/covid19/circulation',
-        'https://data.who.int/dashboards/covid19/cases',
-        'https://data.who.int/dashboards/covid19/deaths',
-        'https://data.who.int/dashboards/covid19/hospitalizations',
-        'https://data.who.int/dashboards/covid19/vaccines',
-        'https://data.who.int/dashboards/covid19/variants'
-    ]
-    
-    # 0. summary
-    # 0.1 实时：新冠疫情概况
-    who_summary_soup = FireCrawl(WHO_URL_LIST[0]).crawl()
-    time.sleep(TIME_SLEEP)
-    p1_soup = who_summary_soup.find_all('div', attrs={'id': 'PageContent_C493_Col00', 'class': 'sf_colsIn col-md-12'})[0]
-    p2_soup = who_summary_soup.find_all('div', attrs={'id': 'PageContent_C629_Col00', 'class': 'sf_colsIn col-md-9'})[0]
-    WHO_realtime_summary = [
-        {
-            'date': str(TIME_NOW.replace(tzinfo=timezone.utc)),
-            'summary_circulation': p1_soup.find_all('p')[0].text,
-            'summary_cases': p1_soup.find_all('p')[10].text,
-            'summary_variant': p1_soup.find_all('div', class_ = 'sfContentBlock sf-Long-text')[9].text,
-            'summary_severity': p2_soup.find_all('p')[0].text,
-            'summary_death': p2_soup.find_all('p')[10].text
-        }
-    ]
-    
+TIME_SLEEP = 60
+WHO_REQUESTS_PER_MINUTE = int(os.getenv('WHO_REQUESTS_PER_MINUTE', 10))
+WHO_MAX_IN_FLIGHT = int(os.getenv('WHO_MAX_IN_FLIGHT', 7))
+# fields telling the series of a history collection apart, see save_history_series
+WHO_SERIES_FIELDS = ('country', 'WHO_region', 'variant', 'age_group')
+# WHO backfills revise recent points; older stored points keep no digest and are not compared
+WHO_REVISION_DAYS = float(os.getenv('WHO_REVISION_DAYS', 180))
+# replacing a revised point deletes from a time-series collection by date and series fields,
+# which MongoDB only allows from 7.0 on (before, deletes may only filter on the metaField)
+WHO_MONGO_MIN_VERSION = (7, 0)
+SNAPSHOT_CHUNK_BYTES = int(os.getenv('SNAPSHOT_CHUNK_BYTES', 4 * 1024 * 1024))
+# scheduler: full crawl at least every WHO_CADENCE_SEC, freshness probe every WHO_PROBE_SEC
+WHO_CADENCE_SEC = float(os.getenv('WHO_CADENCE_SEC', 3600 * 24 * 7))
+WHO_PROBE_SEC = float(os.getenv('WHO_PROBE_SEC', 3600 * 6))
+# the dashboards are script shells; the global CSV behind them is republished with each data release
+WHO_PROBE_URL = os.getenv('WHO_PROBE_URL', 'https://srhdpeuwpubsa.blob.core.windows.net/whdh/COVID/WHO-COVID-19-global-data.csv')
 
-    # 1. circulation
-    # 1.1 实时：上周各国新冠阳性率
-    who_cirulation_soup = FireCrawl(WHO_URL_LIST[1]).crawl()
-    time.sleep(TIME_SLEEP)
-    WHO_realtime_7d_countries_positivity_rate = [
-        {
-            'date': str(datetime.now(timezone.utc)),
-            'country': i['aria-label'].split(':')[0].strip(),
-            'covid19_positivity_rate': float(i['aria-label'].split(':')[1].strip()[:-1])
-        }
-        for i in who_cirulation_soup
-        .find_all(attrs={"data-testid": "dataDotViz-choroplethMap-borders"})[0]
-        .find_all(attrs={"role": "button"})
-    ]
+def extract_page(url, html, time_now):
+    # an unchanged page yields the records extracted from it last time
+    with METRICS.span('extract', url=url) as span:
+        page_data = HTML_CACHE.records(url, html, who_pages, time_now)
+        span['cached'] = page_data is not None
+        if page_data is None:
+            page_data = EXTRACT_POOL.submit(WHO_SOURCE, url, html, time_now).result()
+            HTML_CACHE.store_records(url, html, who_pages, page_data, time_now)
+        else:
+            logger.info(f"Unchanged: {url}, reusing extracted records")
+    return page_data
 
-    # 1.2 历史：每周全球新冠阳性率变化
-    tmp_history_rawlist = [
-        [re.sub(r'[:,]', '', j.strip()) for j in i.text.split('\n')]
-        for i in who_cirulation_soup.find_all(attrs={"id": "PageContent_C481_Col00"})[0].find_all(attrs={"role": "listitem"})
-    ]
-    x = int(len(tmp_history_rawlist) / 3)
-    WHO_weekly_positivity_rate_world_history = [
-        {
-            'date': str(datetime.strptime(tmp_history_rawlist[0][0], '%d %b %Y').replace(tzinfo=timezone.utc)),
-            'Number_of_specimens_tested_for_SARS-CoV-2': int(tmp_history_rawlist[0][1]),
-            'Number_of_specimens_tested_Positive_for_SARS-CoV-2': int(tmp_history_rawlist[x][1]),
-            'Percentage_of_samples_testing_positive_for_SARS-CoV-2': float(tmp_history_rawlist[2*x][1])
-        }
-        for n_specimens, n_positive, n_percentage in zip(tmp_history_rawlist[:x], tmp_history_rawlist[x:2*x], tmp_history_rawlist[2*x:])
-    ]
+def get_who_covid19():
+    time_now = datetime.now(timezone.utc)
+    adapted, urls = adapt(WHO_URL_LIST)
+    # pages are extracted on EXTRACT_POOL while the next one is scraped
+    try:
+        with ThreadPoolExecutor(len(WHO_URL_LIST)) as threads:
+            futures = {}
+            for url in urls:
+                if FIRECRAWL_MODE == 'replay':
+                    html = FireCrawl(url).fetch()
+                elif FIRECRAWL_MODE == 'record':
+                    # every page is scraped so that it gets recorded
+                    html = None
+                else:
+                    html = HTML_CACHE.lookup(url)
+                if html is None:
+                    html = fetch_direct(url, validates)
+                    if html is None:
+                        html = FireCrawl(url).fetch()
+                        FETCH_TIERS.rendered(url)
+                        time.sleep(TIME_SLEEP)
+                    HTML_CACHE.store(url, html)
+                futures[url] = threads.submit(extract_page, url, html, time_now)
+            result_data = {}
+            for url in WHO_URL_LIST:
+                if url in futures:
+                    result_data.update(futures[url].result())
+    finally:
+        forget_validated(urls)
+    # adapted datasets replace those scraped from a page that was still needed for its other datasets
+    result_data.update(adapted)
+    return result_data
 
-    # 1.3 实时：上月新冠突变株占比情况
-    WHO_realtime_28d_variants_prevalence = [
-        {
-            'date': str(datetime.now(timezone.utc)),
-            'variant': v_line.find_all('td', class_ = 'inline-border value-column svelte-1hj6lq3')[0].text,
-            'prevalence': float(v_line.find_all('td', class_ = 'value-column align-end svelte-1hj6lq3')[0].text[:-1]),
-            'change': v_line.find_all('td', class_ = 'value-column align-end svelte-1hj6lq3')[1].text
-        }
-        for v_line in who_cirulation_soup
-        .find_all('table', class_ = 'data-table svelte-1hj6lq3')[0]
-        .find_all('tr', class_ = 'svelte-1hj6lq3')[1:]
-    ]
+async def get_who_covid19_async(requests_per_minute=WHO_REQUESTS_PER_MINUTE, max_in_flight=WHO_MAX_IN_FLIGHT):
+    """Crawl all WHO pages concurrently within a FireCrawl rate budget.
 
-    # 1.4  实时：上月提交GISAID新冠突变株序列条数
-    WHO_realtime_28d_GISAID_variants_submitted = [
-        {
-            'date': str(datetime.now(timezone.utc)),
-            'variant': v_line.find_all('td', class_ = 'inline-border value-column svelte-szsgy')[0].text,
-            'countries': int(v_line.find_all('td', class_ = 'inline-border value-column align-end svelte-szsgy')[0].text),
-            'sequences_submitted_to_GISAID': int(v_line.find_all('td', class_ = 'value-column align-end svelte-szsgy')[0].text.replace(',', ''))
-        }
-        for v_line in who_cirulation_soup
-        .find_all('table', class_ = 'data-table svelte-szsgy')[0]
-        .find_all('tr', class_ = 'svelte-szsgy')[1:]
-    ]
+    Each page is extracted as soon as its HTML arrives, so the run takes roughly
+    as long as the slowest single scrape instead of the sum of all of them.
+    """
+    time_now = datetime.now(timezone.utc)
+    budget = RateBudget(requests_per_minute, max_in_flight)
 
-    # 1.5 历史：每周主要新冠突变株占比变化
-    WHO_history_weekly_variants_prevalence = []
-    for x in range(len(['VOIs', 'VUMs'])):
-        flag = False
-        for i in who_cirulation_soup.find_all('svg', class_ = 'touch-action-pan-y svelte-4havvh dataDotViz-chart')[x].find_all('text', role = 'cell'):
-            if i['data-testid'] == 'dataDotViz-line-summary':
-                variant = i.text.split('In')[1].split(',')[0].strip()
-                time_start = i.text.split('week')[1].split('to')[0].strip()
-                time_end = i.text.split('week')[2].split('.')[0].strip()
-            try:
-                if i['data-test-time-dim'] == time_start:
-                    flag = True
-                if i['data-test-time-dim'] == time_end:
-                    prevalence, flag = float(i.text), False
-                    WHO_history_weekly_variants_prevalence.append({
-                        'date': str(datetime.strptime(i['data-test-time-dim'], '%Y-%m-%d').replace(tzinfo=timezone.utc)),
-                        'variant': variant,
-                        'prevalence': prevalence
-                    })
-                if flag:
-                    prevalence = float(i.text)
-                    WHO_history_weekly_variants_prevalence.append({
-                        'date': str(datetime.strptime(i['data-test-time-dim'], '%Y-%m-%d').replace(tzinfo=timezone.utc)),
-                        'variant': variant,
-                        'prevalence': prevalence
-                    })
-                continue
-            except:
-                pass
-    
-    # 2. cases
-    # 2.1 实时：上月全球总的新冠病例数量
-    who_cases_soup = FireCrawl(WHO_URL_LIST[2]).crawl()
-    time.sleep(TIME_SLEEP)
-    WHO_realtime_28d_world_reported_cases = [
-        {
-            'date': str(datetime.strptime(who_cases_soup.find_all('span', class_ = 'end-date svelte-aejddw')[0].text, 'World, 28 days to %d %B %Y').replace(tzinfo=timezone.utc)),
-            'Number_of_cases_reported_to_WHO_in_the_past_28_days': int(who_cases_soup.find_all('strong', class_ = 'value svelte-aejddw')[0].text.replace(',', '')),
-            'Number_of_cases_reported_to_WHO_in_the_past_28_days_change': who_cases_soup.find_all('strong', class_ = 'change-value svelte-aejddw')[0].text[1:].replace(',', '')
-        }
-    ]
+    adapted, urls = await asyncio.to_thread(adapt, WHO_URL_LIST)
+    tasks = {}
+    try:
+        async for url, html in fetch_pages(urls, budget, cache=HTML_CACHE, validate=validates):
+            logger.info(f"Extracting: {url}")
+            tasks[url] = asyncio.create_task(asyncio.to_thread(extract_page, url, html, time_now))
 
-    # 2.2 历史：全球总的新冠病例数量
-    WHO_history_weekly_world_reported_cases = [
-        {
-            'date': str(datetime.strptime(i.text.split(':')[0], '%d %b %Y').replace(tzinfo=timezone.utc)),
-            'Number_of_cases_reported_to_WHO': int(i.text.split(':')[1].replace(',', ''))
-        }
-        for i in who_cases_soup.find_all('div', attrs={'id': 'PageContent_C014_Col01', 'class': 'sf_colsIn col-md-6'})[0].find_all('text', attrs={'role': 'listitem'})
-    ]
+        # keep the dataset order of the sequential crawl
+        result_data = {}
+        for url in urls:
+            result_data.update(await tasks[url])
+    finally:
+        forget_validated(urls)
+    result_data.update(adapted)
+    return result_data
 
-    # 2.3 历史：全球各洲上报的病例数量
-    WHO_history_weekly_region_reported_cases = [
-            {
-                'date': str(datetime.strptime(j.text.split(':')[0], '%d %b %Y').replace(tzinfo=timezone.utc)),
-                'WHO_region': i.find_all('h3', attrs={'data-testid': 'dataDotViz-covid19-groups-spatialDimName'})[0].text,
-                'Number_of_cases_reported_to_WHO': int(j.text.split(':')[1].replace(',', ''))
-            }
-            for i in who_cases_soup.find_all('div', attrs={'id': 'PageContent_C033_Col00', 'class': 'sf_colsIn col-md-12'})[0].find_all('section', class_ = 'covid19-groups-row svelte-sfsmwu')
-            for j in i.find_all('text', role = 'listitem')
-    ]
+def is_history_series(collection_name):
+    return 'history' in collection_name
 
-    # 2.4 历史：全球各国上报的病例数量
-    WHO_history_weekly_countries_reported_cases = [
-            {
-                'date': str(datetime.strptime(j['data-test-time-dim'], '%Y-%m-%d').replace(tzinfo=timezone.utc)),
-                'country': i.text.split('Reported')[0].strip(),
-                'Number_of_cases_reported_to_WHO': j.text
-            }
-        for i in who_cases_soup.find_all('div', attrs={'id': 'PageContent_C040_Col00', 'class': 'sf_colsIn col-md-12'})[0].find_all('div', attrs={'data-testid': 'dataDotViz-small-multiple'})
-        for j in i.find_all('text', role = 'cell')[1:]
-    ]
+def series_key(item):
+    """The series a history point belongs to: its country, region, variant or age group, '' for world series."""
+    return next((str(item[i]) for i in WHO_SERIES_FIELDS if i in item), '')
 
-    # 3. deaths
-    # 3.1 实时：上月全球总的新冠死亡数量
-    who_deaths_soup = FireCrawl(WHO_URL_LIST[3]).crawl()
-    time.sleep(TIME_SLEEP)
-    WHO_realtime_28d_world_reported_deaths = [
-        {
-            'date': str(datetime.strptime(who_deaths_soup.find_all('span', class_ = 'end-date svelte-aejddw')[0].text, 'World, 28 days to %d %B %Y').replace(tzinfo=timezone.utc)),
-            'Number_of_deaths_reported_to_WHO_in_the_past_28_days': int(who_deaths_soup.find_all('strong', class_ = 'value svelte-aejddw')[0].text.replace(',', '')),
-            'Number_of_deaths_reported_to_WHO_in_the_past_28_days_change': who_deaths_soup.find_all('strong', class_ = 'change-value svelte-aejddw')[0].text[1:].replace(',', '')
-        }
-    ]
+def point_digest(item):
+    return hashlib.sha256(json.dumps({k: v for k, v in item.items() if k != 'date'}, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
 
-    # 3.2 历史：全球总的新冠死亡案例数量
-    WHO_history_weekly_world_reported_deaths = [
-        {
-            'date': str(datetime.strptime(i.text.split(':')[0], '%d %b %Y').replace(tzinfo=timezone.utc)),
-            'Number_of_deaths_reported_to_WHO': int(i.text.split(':')[1].replace(',', ''))
-        }
-        for i in who_deaths_soup.find_all('div', attrs={'id': 'PageContent_C014_Col01', 'class': 'sf_colsIn col-md-6'})[0].find_all('text', attrs={'role': 'listitem'})
-    ]
+def save_history_series(db, collection_name, collection_data):
+    """Write only the points of a history collection that are newer than, or revise, what is stored.
 
-    # 3.3 历史：全球各洲上报的死亡案例数量
-    WHO_history_weekly_region_reported_deaths = [
-        {
-            'date': str(datetime.strptime(j.text.split(':')[0], '%d %b %Y').replace(tzinfo=timezone.utc)),
-            'WHO_region': i.find_all('h3', attrs={'data-testid': 'dataDotViz-covid19-groups-spatialDimName'})[0].text,
-            'Number_of_deaths_reported_to_WHO': j.text.split(':')[1].replace(',', '').strip()
-        }
-        for i in who_deaths_soup.find_all('div', attrs={'id': 'PageContent_C033_Col00', 'class': 'sf_colsIn col-md-12'})[0].find_all('section', class_ = 'covid19-groups-row svelte-sfsmwu')
-        for j in i.find_all('text', role = 'listitem')
-    ]
-
-    # 3.4 历史：全球各国上报的死亡案例数量
-    WHO_history_weekly_countries_reported_deaths = [
-        {
-            'date': str(datetime.strptime(j['data-test-time-dim'], '%Y-%m-%d').replace(tzinfo=timezone.utc)),
-            'country': i.text.split('Reported')[0].strip(),
-            'Number_of_deaths_reported_to_WHO': j.text
-        }
-        for i in who_deaths_soup.find_all('div', attrs={'id': 'PageContent_C040_Col00', 'class': 'sf_colsIn col-md-12'})[0].find_all('div', attrs={'data-testid': 'dataDotViz-small-multiple'})
-        for j in i.find_all('text', role = 'cell')[1:]
-    ]
+    Each series keeps a watermark document in `watermarks`: the latest stored date and a digest of
+    every stored point of the last WHO_REVISION_DAYS by date. Points after the watermark are
+    inserted; a point in the window whose digest changed (a WHO backfill) or that was never stored
+    replaces the stored one. Unchanged points, and points older than the window, are skipped.
+    """
+    collection = db[collection_name]
+    watermarks = {i['series']: i for i in db['watermarks'].find({'collection': collection_name})}
 
-    # 3.5 历史：死亡案例年龄占比
-    WHO_history_weekly_age_distribution_reported_deaths = [
-        {
-            'date': str(datetime.strptime(j['data-test-time-dim'], '%Y-%m-%d').replace(tzinfo=timezone.utc)),
-            'age_group': i.find_all('h3', class_ = 'headline svelte-1g6zpbj')[0].text,
-            'Percentage_of_deaths_reported_to_WHO': float(j.text[:-1])
-        }
-        for i in who_deaths_soup.find_all('div', attrs={'class': 'dataDotViz-jsonChartConfig dataDotViz-theme dataDotViz-reset dataDotViz-dynamic dataDotViz-chartConfig dataDotViz-ChartRenderer dataDotViz-chartMode-l'})[0].find_all('div', attrs = {'data-testid': 'dataDotViz-small-multiple'})
-        for j in i.find_all('text', role = 'cell')[1:]
-    ]
+    # a collection written before watermarks existed holds every run's copy: rewrite each point once
+    legacy = not watermarks and collection.estimated_document_count() > 0
 
-    # 4. hospitalizations
-    # 4.1 实时：上月全球总的新冠住院数量
-    who_hospitalizations_soup = FireCrawl(WHO_URL_LIST[4]).crawl()
-    time.sleep(TIME_SLEEP)
-    WHO_realtime_28d_world_reported_hospitalizations = [
-        {
-            'date': str(datetime.strptime(who_hospitalizations_soup.find_all('span', class_ = 'end-date svelte-aejddw')[0].text, 'World, 28 days to %d %B %Y').replace(tzinfo=timezone.utc)),
-            'Number_of_hospitalizations_reported_to_WHO_in_the_past_28_days': int(who_hospitalizations_soup.find_all('strong', class_ = 'value svelte-aejddw')[0].text.replace(',', '')),
-            'Number_of_hospitalizations_reported_to_WHO_in_the_past_28_days_change': who_hospitalizations_soup.find_all('strong', class_ = 'change-value svelte-aejddw')[0].text[1:].replace(',', '')
-        }
-    ]
+    # the last point of a series on a date wins, as a reload of the page would
+    points = {}
+    for item in collection_data:
+        points[(series_key(item), item['date'])] = item
 
-    # 4.2 历史：全球每月新冠住院人数
-    WHO_history_monthly_world_reported_hospitalizations = [
-        {
-            'date': str(datetime.strptime(i.text.split(':')[0], '%d %b %Y').replace(tzinfo=timezone.utc)),
-            'Number_of_hospitalizations_reported_to_WHO': int(i.text.split(':')[1].replace(',', ''))
-        }
-        for i in who_hospitalizations_soup.find_all('div', attrs={'id': 'PageContent_C014_Col01', 'class': 'sf_colsIn col-md-6'})[0].find_all('text', attrs={'role': 'listitem'})
-    ]
+    # digests are kept for the points of the last WHO_REVISION_DAYS before a series' latest date
+    latest = {series: watermark['date'].replace(tzinfo=None) for series, watermark in watermarks.items()}
+    for series, date in points:
+        latest[series] = max(date.replace(tzinfo=None), latest.get(series, date.replace(tzinfo=None)))
+    cutoffs = {series: date - timedelta(days=WHO_REVISION_DAYS) for series, date in latest.items()}
 
-    # 4.3 实时：上月全球总的由新冠导致的ICU住院数量
-    WHO_realtime_28d_world_reported_ICU = [
-        {
-            'date': str(datetime.strptime(who_hospitalizations_soup.find_all('span', class_ = 'end-date svelte-aejddw')[0].text, 'World, 28 days to %d %B %Y').replace(tzinfo=timezone.utc)),
-            'Number_of_ICU_hospitalizations_reported_to_WHO_in_the_past_28_days': int(who_hospitalizations_soup.find_all('strong', class_ = 'value svelte-aejddw')[1].text.replace(',', '')),
-            'Number_of_ICU_hospitalizations_reported_to_WHO_in_the_past_28_days_change': who_hospitalizations_soup.find_all('strong', class_ = 'change-value svelte-aejddw')[1].text[1:].replace(',', '')
-        }
-    ]
+    requests, updates = [], {}
+    inserted = revised = 0
+    for (series, date), item in points.items():
+        watermark = watermarks.get(series, {'date': None, 'points': {}})
+        point, digest = date.strftime('%Y%m%dT%H%M%S'), point_digest(item)
+        stored = watermark['points'].get(point)
+        newer = watermark['date'] is None or date.replace(tzinfo=None) > watermark['date'].replace(tzinfo=None)
+        in_window = date.replace(tzinfo=None) >= cutoffs[series]
+        if stored == digest or (not legacy and not newer and not in_window):
+            continue
+        if not legacy and newer:
+            inserted += 1
+        else:
+            # backfill: drop the stored point of this series on this date before writing the new one
+            point_filter = {'date': date, **{i: item[i] for i in WHO_SERIES_FIELDS if i in item}}
+            requests.append(DeleteMany(point_filter))
+            revised += 1
+        requests.append(InsertOne(item))
+        update = updates.setdefault(series, {'$max': {'date': date}, '$set': {'collection': collection_name, 'series': series}})
+        update['$max']['date'] = max(update['$max']['date'], date)
+        if in_window:
+            update['$set'][f'points.{point}'] = digest
 
-    # 4.4 历史：全球每月新冠ICU住院人数
-    WHO_history_monthly_world_reported_ICU = [
-        {
-            'date': str(datetime.strptime(i.text.split(':')[0], '%d %b %Y').replace(tzinfo=timezone.utc)),
-            'Number_of_ICU_hospitalizations_reported_to_WHO': int(i.text.split(':')[1].replace(',', ''))
-        }
-        for i in who_hospitalizations_soup.find_all('div', attrs={'id': 'PageContent_C181_Col01', 'class': 'sf_colsIn col-md-6', 'data-sf-element': 'Column 2'})[0].find_all('text', attrs={'role': 'listitem'})
-    ]
+    # digests that fell out of the window
+    for series, watermark in watermarks.items():
+        expired = [i for i in watermark['points'] if i < cutoffs[series].strftime('%Y%m%dT%H%M%S')]
+        if expired:
+            update = updates.setdefault(series, {'$set': {'collection': collection_name, 'series': series}})
+            update['$unset'] = {f'points.{i}': '' for i in expired}
 
-    # 4.5 历史：全球每月新冠重症人数
-    WHO_history_monthly_world_reported_severity = [
-        {
-            'date': str(datetime.strptime(i.text.split(':')[0], '%d %b %Y').replace(tzinfo=timezone.utc)),
-            'Number_of_ICU_admissions_per_1000_hospitalizations_reported_to_WHO': int(i.text.split(':')[1].replace(',', '')),
-            'Number_of_death_per_1000_hospitalizations_reported_to_WHO': int(j.text.split(':')[1].replace(',', ''))
-        }
-        for i, j in zip(
-            who_hospitalizations_soup.find_all('div', attrs={'id': 'PageContent_C190_Col00', 'class': 'sf_colsIn col-md-6', 'data-sf-element': 'Column 1'})[0].find_all('text', attrs={'role': 'listitem'}),
-            who_hospitalizations_soup.find_all('div', attrs={'id': 'PageContent_C190_Col01', 'class': 'sf_colsIn col-md-6', 'data-sf-element': 'Column 2'})[0].find_all('text', attrs={'role': 'listitem'})
-        )
-    ]
+    if requests:
+        with METRICS.span('save.mongo.series', dataset=collection_name, requests=len(requests)):
+            collection.bulk_write(requests, ordered=True)
+    if updates:
+        db['watermarks'].bulk_write([
+            UpdateOne({'_id': f'{collection_name}|{series}'}, update, upsert=True)
+            for series, update in updates.items()
+        ], ordered=False)
+    logger.info(f"{collection_name}: {inserted} new, {revised} revised, {len(points) - inserted - revised} unchanged points")
+    METRICS.count('records_written_total', inserted + revised, sink='mongo', source='who', dataset=collection_name)
+    return inserted, revised
 
-    # 5. vaccines
-    # 5.1 实时：全球接种新冠疫苗总剂数、第一针和加强针覆盖率
-    who_vaccines_soup = FireCrawl(WHO_URL_LIST[5]).crawl()
-    time.sleep(TIME_SLEEP)
-    sub_soup = who_vaccines_soup.find_all('div', attrs={'id': 'PageContent_C001_Col00', 'class': 'sf_colsIn container--contrast'})[0]
-    WHO_realtime_total_world_vaccines = [
-        {
-            'date': str(TIME_NOW.replace(tzinfo=timezone.utc)),
-            'Total_COVID-19_vaccine_doses_administered': sub_soup.find_all('strong', class_ = 'data-value svelte-phjb1n')[0].text,
-            'Date_of_first_COVID-19_vaccine_product_introduction': sub_soup.find_all('strong', class_ = 'data-value svelte-phjb1n')[1].text,
-            'Percentage_of_total_population_vaccinated_with_a_complete_primary_series_of_a_COVID-19_vaccine': float(sub_soup.find_all('span', class_ = 'value svelte-1jx75w7')[0].text[:-1]),
-            'Percentage_of_total_population_vaccinated_with_at_least_one_booster_dose_of_a_COVID-19_vaccine': float(sub_soup.find_all('span', class_ = 'value svelte-1jx75w7')[1].text[:-1])
-        }
-    ]
+def save_snapshot(db, data, time_run):
+    """Store the whole run as gzipped JSON chunks in `history_chunks` and a manifest in `history`.
 
-    # 5.2 实时：各国新冠疫苗覆盖率
-    WHO_realtime_vaccine_coverage = [
-        {
-            'date': str(datetime.now(timezone.utc)),
-            'country': i['aria-label'].split(':')[0].strip(),
-            'Percentage_of_total_population_vaccinated_with_at_least_one_dose_of_a_COVID-19_vaccine': float(i['aria-label'].split(':')[1].strip()[:-1]) if i['aria-label'].split(':')[1].strip() != 'No data' else None
-        }
-        for i in who_vaccines_soup
-        .find_all('div', attrs={'id': 'PageContent_C013_Col00', 'class': 'sf_colsIn container'})[0]
-        .find_all('use', attrs={"role": "button"})
-    ]
+    One document per run grew towards MongoDB's 16 MB limit; chunks of at most
+    SNAPSHOT_CHUNK_BYTES keep any run storable. All chunks go in one insert_many, the manifest
+    is written last so a run without one is incomplete and ignored by `load_snapshot`.
+    """
+    manifest, chunks = {}, []
+    for dataset, records in data.items():
+        blob = gzip.compress(json.dumps(records, ensure_ascii=False, default=str).encode('utf-8'))
+        parts = [blob[i:i + SNAPSHOT_CHUNK_BYTES] for i in range(0, len(blob), SNAPSHOT_CHUNK_BYTES)] or [b'']
+        chunks.extend({'time_run': time_run, 'dataset': dataset, 'n': n, 'data': Binary(part)} for n, part in enumerate(parts))
+        manifest[dataset] = {'records': len(records), 'bytes': len(blob), 'chunks': len(parts), 'sha256': hashlib.sha256(blob).hexdigest()}
+    db['history_chunks'].create_index([('time_run', ASCENDING), ('dataset', ASCENDING), ('n', ASCENDING)])
+    if chunks:
+        db['history_chunks'].insert_many(chunks, ordered=False)
+    db['history'].insert_one({'time_run': time_run, 'datasets': manifest})
+    logger.info(f"Snapshot {time_run}: {len(manifest)} datasets, {sum(i['bytes'] for i in manifest.values())} bytes compressed in {len(chunks)} chunks")
 
-    # 6. variants
-    # 6.1 历史：VOI & VUM 相关信息
-    who_variants_soup = FireCrawl(WHO_URL_LIST[6]).crawl()
-    time.sleep(TIME_SLEEP)
-    voi_information = [
-        {
-            'pango_lineage': i.find_all('th')[0].text.split('Pango lineage')[1].split('Excludes')[0].strip(),
-            'nextstrain_clade': i.find_all('p')[0].text.split('Nextstrain clade')[1].strip(),
-            'genetic_features': i.find_all('p')[1].text.split('Genetic features')[1].strip(),
-            'earliest_documented_samples': i.find_all('p')[2].text.split('Earliest documented samples')[1].strip(),
-            'date_of_designation': i.find_all('p')[3].text.split('Date of designation')[1].strip(),
-            'risk_assessments_reports': [j['href'] for j in i.find_all('a')]
-        }
-        for i in who_variants_soup.find_all('div', attrs={'id': 'PageContent_C085_Col00', 'class': 'table-container table--contrast sf_colsIn', 'data-sf-element': 'Table'})
-    ]
-    vum_information = [
-        {
-            'pango_lineage': i.find_all('th')[0].text.split('Pango lineage')[1].split('Excludes')[0].strip(),
-            'nextstrain_clade': i.find_all('p')[0].text.split('Nextstrain clade')[1].strip(),
-            'genetic_features': i.find_all('p')[1].text.split('Genetic features')[1].strip(),
-            'earliest_documented_samples': i.find_all('p')[2].text.split('Earliest documented samples')[1].strip(),
-            'date_of_designation': i.find_all('p')[3].text.split('Date of designation')[1].strip(),
-            'risk_assessments_reports': [j['href'] for j in i.find_all('a')]
-        }
-        for i in who_variants_soup.find_all('div', attrs={'id': 'PageContent_C095_Col00', 'class': 'table-container table--contrast sf_colsIn', 'data-sf-element': 'Table'})[0].find_all('tr')
-    ]
-    WHO_variants_information = voi_information + vum_information
-
-    result_data = {
-        'WHO_realtime_summary': WHO_realtime_summary,
-        'WHO_realtime_7d_countries_positivity_rate': WHO_realtime_7d_countries_positivity_rate,
-        'WHO_weekly_positivity_rate_world_history': WHO_weekly_positivity_rate_world_history,
-        'WHO_realtime_28d_variants_prevalence': WHO_realtime_28d_variants_prevalence,
-        'WHO_realtime_28d_GISAID_variants_submitted': WHO_realtime_28d_GISAID_variants_submitted,
-        'WHO_history_weekly_variants_prevalence': WHO_history_weekly_variants_prevalence,
-        'WHO_realtime_28d_world_reported_cases': WHO_realtime_28d_world_reported_cases,
-        'WHO_history_weekly_world_reported_cases': WHO_history_weekly_world_reported_cases,
-        'WHO_history_weekly_region_reported_cases': WHO_history_weekly_region_reported_cases,
-        'WHO_history_weekly_countries_reported_cases': WHO_history_weekly_countries_reported_cases,
-        'WHO_realtime_28d_world_reported_deaths': WHO_realtime_28d_world_reported_deaths,
-        'WHO_history_weekly_world_reported_deaths': WHO_history_weekly_world_reported_deaths,
-        'WHO_history_weekly_region_reported_deaths': WHO_history_weekly_region_reported_deaths,
-        'WHO_history_weekly_countries_reported_deaths': WHO_history_weekly_countries_reported_deaths,
-        'WHO_history_weekly_age_distribution_reported_deaths': WHO_history_weekly_age_distribution_reported_deaths,
-        'WHO_realtime_28d_world_reported_hospitalizations': WHO_realtime_28d_world_reported_hospitalizations,
-        'WHO_history_monthly_world_reported_hospitalizations': WHO_history_monthly_world_reported_hospitalizations,
-        'WHO_realtime_28d_world_reported_ICU': WHO_realtime_28d_world_reported_ICU,
-        'WHO_history_monthly_world_reported_ICU': WHO_history_monthly_world_reported_ICU,
-        'WHO_history_monthly_world_reported_severity': WHO_history_monthly_world_reported_severity,
-        'WHO_realtime_total_world_vaccines': WHO_realtime_total_world_vaccines,
-        'WHO_realtime_vaccine_coverage': WHO_realtime_vaccine_coverage,
-        'WHO_variants_information': WHO_variants_information
-    }
-
-    return result_data
+def load_snapshot(db, time_run, datasets=None):
+    """The data of a run saved by `save_snapshot`, or only `datasets` of it; runs saved as one document are read as is."""
+    manifest = db['history'].find_one({'time_run': time_run})
+    if manifest is None:
+        return None
+    if 'data' in manifest:
+        return {k: v for k, v in manifest['data'].items() if datasets is None or k in datasets}
+    wanted = [i for i in manifest['datasets'] if datasets is None or i in datasets]
+    parts = {i: [] for i in wanted}
+    for chunk in db['history_chunks'].find({'time_run': time_run, 'dataset': {'$in': wanted}}).sort([('dataset', ASCENDING), ('n', ASCENDING)]):
+        parts[chunk['dataset']].append(chunk['data'])
+    data = {}
+    for dataset in wanted:
+        blob = b''.join(parts[dataset])
+        if hashlib.sha256(blob).hexdigest() != manifest['datasets'][dataset]['sha256']:
+            raise ValueError(f"snapshot {time_run} dataset {dataset} is incomplete or corrupt")
+        data[dataset] = json.loads(gzip.decompress(blob))
+    return data
 
 def save_to_mongodb(data, time_run):
     """Save data to MongoDB with time series collections"""
-    client = MongoClient('mongodb://localhost:27017')
+    if any(collection_data and is_history_series(collection_name) for collection_name, collection_data in data.items()):
+        MONGO_STORE.require_version(WHO_MONGO_MIN_VERSION, 'replacing revised points of the WHO history time series')
+    client = MONGO_STORE.client()
     
     # Create database if not exists
     db = client['covid19_WHO']
@@ -407,6 +276,7 @@ def save_to_mongodb(data, time_run):
                         item['date'] = datetime.now(timezone.utc)
     
     # Save each data set to its own collection
+    existing_collections = set(db.list_collection_names())
     for collection_name, collection_data in data.items():
         if not collection_data:
             continue
@@ -414,7 +284,7 @@ def save_to_mongodb(data, time_run):
         # Create time series collection if needed
         if collection_name in time_series_collections:
             # Check if collection exists
-            if collection_name not in db.list_collection_names():
+            if collection_name not in existing_collections:
                 # Create time series collection
                 db.create_collection(
                     collection_name,
@@ -424,50 +294,84 @@ def save_to_mongodb(data, time_run):
                         'granularity': 'hours'
                     }
                 )
+                existing_collections.add(collection_name)
         
         # Insert data
         collection = db[collection_name]
-        if isinstance(collection_data, list) and collection_data:
-            collection.insert_many(collection_data)
+        if isinstance(collection_data, list) and collection_data and is_history_series(collection_name):
+            save_history_series(db, collection_name, collection_data)
+        elif isinstance(collection_data, list) and collection_data:
+            with METRICS.span('save.mongo.insert', dataset=collection_name, records=len(collection_data)):
+                collection.insert_many(collection_data)
+            METRICS.count('records_written_total', len(collection_data), sink='mongo', source='who', dataset=collection_name)
         elif isinstance(collection_data, dict):
             collection.insert_one(collection_data)
+            METRICS.count('records_written_total', sink='mongo', source='who', dataset=collection_name)
     
     # Also save a historical record of the entire dataset
-    history_collection = db['history']
-    history_collection.insert_one({
-        'time_run': time_run,
-        'data': data
-    })
+    with METRICS.span('save.mongo.snapshot', time_run=time_run):
+        save_snapshot(db, data, time_run)
     
     return True
 
-def save_to_json(data, time_run):
-    """Save data as JSON file"""
-    # Create history directory if it doesn't exist
-    if not os.path.exists('history'):
-        os.makedirs('history')
-    
-    # Create filename
-    filename = f"history/covid19_WHO_{time_run}.json"
-    
-    # Save data as JSON
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-    
-    return filename
+def save_to_store(data, time_run):
+    """Save data to the snapshot store, returns the run's manifest path"""
+    return SNAPSHOT_STORE.save('covid19_WHO', time_run, data)
+
+def save_who_covid19(who_data, time_run):
+    """Save a run to the snapshot store, Parquet, the history index and MongoDB"""
+    if FIRECRAWL_MODE == 'replay':
+        # a replay re-extracts recorded pages, it is not a new run of the sources
+        logger.info(f"Replay: run {time_run} not saved")
+        return
+    # Save to the snapshot store
+    with METRICS.span('save.snapshot', time_run=time_run):
+        manifest = save_to_store(who_data, time_run)
+    METRICS.count('records_written_total', sum(len(i) for i in who_data.values()), sink='snapshot', source='who')
+    logger.info(f"Data saved to snapshot store: {manifest}")
+
+    # Append new rows to the Parquet datasets
+    with METRICS.span('save.parquet', time_run=time_run):
+        exported = PARQUET_EXPORT.export(who_data, time_run)
+    METRICS.count('records_written_total', sum(exported.values()), sink='parquet', source='who')
+    logger.info(f"Rows exported to Parquet: {sum(exported.values())}")
+
+    # Update the local history index behind the MCP query tools
+    with METRICS.span('save.index', time_run=time_run):
+        indexed = HISTORY_INDEX.index_run(who_data, time_run)
+    METRICS.count('records_written_total', indexed, sink='index', source='who')
+    logger.info(f"Points indexed: {indexed}")
+
+    # Save to MongoDB
+    with METRICS.span('save.mongo', time_run=time_run):
+        mongodb_saved = save_to_mongodb(who_data, time_run)
+    logger.info(f"Data saved to MongoDB: {mongodb_saved}")
+
+async def update_who_covid19():
+    """Crawl all pages concurrently and save the run"""
+    time_run = datetime.now(timezone.utc).strftime('%Y-%m-%d-%H-%M-%S')
+    who_data = await get_who_covid19_async()
+    # the stores are blocking, keep them off the event loop
+    await asyncio.to_thread(save_who_covid19, who_data, time_run)
+
+def who_source():
+    return Source('who', update_who_covid19, WHO_CADENCE_SEC, probe=HeadProbe([WHO_PROBE_URL]), probe_sec=WHO_PROBE_SEC)
 
 if __name__ == '__main__':
     # try:
     # Get WHO COVID-19 data
     time_run = datetime.now(timezone.utc).strftime('%Y-%m-%d-%H-%M-%S')
-    who_data = get_who_covid19()
-    
-    # Save to JSON file
-    json_file = save_to_json(who_data, time_run)
-    print(f"Data saved to JSON file: {json_file}")
-    
-    # Save to MongoDB
-    mongodb_saved = save_to_mongodb(who_data, time_run)
-    print(f"Data saved to MongoDB: {mongodb_saved}")
+    if '--async' in sys.argv:
+        async def main():
+            try:
+                return await get_who_covid19_async()
+            finally:
+                await HTTP_POOL.aclose()
+        who_data = asyncio.run(main())
+    else:
+        who_data = get_who_covid19()
+    logger.info(f"HTTP connections: {HTTP_POOL.stats()}")
+    save_who_covid19(who_data, time_run)
+    METRICS.report('who')
     # except Exception as e:
-    #     print(f"Error: {e}")
\ No newline at end of file
+    #     print(f"Error: {e}")
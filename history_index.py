@@ -0,0 +1,172 @@
+import os
+import json
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+from loguru import logger
+from snapshot_store import SNAPSHOT_STORE, leaves
+from parquet_export import dataset_name
+
+HISTORY_INDEX_DB = os.getenv('HISTORY_INDEX_DB', 'history_index.sqlite3')
+HISTORY_INDEX_CACHE_SIZE = int(os.getenv('HISTORY_INDEX_CACHE_SIZE', 256))
+# record fields naming the entity of a row; a row without any belongs to the entity '' (world, national)
+HISTORY_INDEX_ENTITY_FIELDS = ('country', 'WHO_region', 'variant', 'age_group', 'virus_type')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+    dataset TEXT NOT NULL,
+    entity TEXT NOT NULL,
+    date TEXT NOT NULL,
+    time_run TEXT NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (dataset, entity, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS points_dataset_date ON points (dataset, date);
+"""
+
+def entity_of(record):
+    return '|'.join(str(record[i]) for i in HISTORY_INDEX_ENTITY_FIELDS if record.get(i) is not None)
+
+class HistoryIndex:
+    """Local SQLite index of every stored data point, keyed by (dataset, entity, date).
+
+    Each run is upserted after it is saved, so a revised point replaces the older value and
+    the index holds the latest known value of every point. Dates are kept as the text of
+    the UTC datetime ('2025-05-09 00:00:00+00:00'), which sorts chronologically; undated
+    datasets use the run time. Query answers are kept in an LRU cache that every write
+    clears, so repeated questions cost a dictionary lookup.
+    """
+    def __init__(self, path=HISTORY_INDEX_DB, cache_size=HISTORY_INDEX_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self._db = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _conn(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def index_run(self, data, time_run):
+        """Upsert every data point of a run's nested data; returns how many were indexed."""
+        rows = []
+        for path, records in leaves(data):
+            if not isinstance(records, list):
+                continue
+            for record in records:
+                if not isinstance(record, dict):
+                    continue
+                date = str(record['date']) if record.get('date') is not None else time_run
+                rows.append((dataset_name(path), entity_of(record), date, time_run, json.dumps(record, ensure_ascii=False, default=str)))
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.executemany(
+                    "INSERT INTO points VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (dataset, entity, date) DO UPDATE SET time_run = excluded.time_run, record = excluded.record "
+                    "WHERE excluded.time_run >= points.time_run",
+                    rows
+                )
+            self._cache.clear()
+        logger.info(f"Indexed {len(rows)} points of run {time_run} in {self.path}")
+        return len(rows)
+
+    def rebuild(self, names=('covid19_WHO', 'data_us_history')):
+        """Index every run of the snapshot store, oldest first."""
+        total = 0
+        for name in names:
+            for time_run in SNAPSHOT_STORE.runs(name):
+                total += self.index_run(SNAPSHOT_STORE.load(name, time_run), time_run)
+        return total
+
+    def _query(self, sql, params):
+        key = (sql, params)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+            rows = self._conn().execute(sql, params).fetchall()
+            self._cache[key] = rows
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return rows
+
+    def datasets(self):
+        """Every indexed dataset with its number of entities, points and date range."""
+        rows = self._query("SELECT dataset, COUNT(DISTINCT entity), COUNT(*), MIN(date), MAX(date) FROM points GROUP BY dataset", ())
+        return [{'dataset': i[0], 'entities': i[1], 'points': i[2], 'first_date': i[3], 'last_date': i[4]} for i in rows]
+
+    def entities(self, dataset):
+        return [i[0] for i in self._query("SELECT DISTINCT entity FROM points WHERE dataset = ? ORDER BY entity", (dataset,))]
+
+    def series(self, dataset, entity=None, start=None, end=None, limit=None):
+        """Records of `dataset` in date order, of one entity if given, between `start` and `end` inclusive, at most `limit`."""
+        sql, params = "SELECT record FROM points WHERE dataset = ?", [dataset]
+        if entity is not None:
+            sql, params = sql + " AND entity = ?", params + [entity]
+        if start is not None:
+            sql, params = sql + " AND date >= ?", params + [start]
+        if end is not None:
+            # '~' sorts after every date character, so '2024-12-31' includes that whole day
+            sql, params = sql + " AND date <= ?", params + [end + '~']
+        sql += " ORDER BY entity, date"
+        if limit is not None:
+            sql, params = sql + " LIMIT ?", params + [int(limit)]
+        return [json.loads(i[0]) for i in self._query(sql, tuple(params))]
+
+    def latest(self, dataset, entity=None):
+        """Records of `dataset` at its latest date, of one entity if given.
+
+        Without an entity, the records the latest run wrote on the latest day it has. A day
+        rather than the exact date, since older runs stamped each realtime row with its own
+        extraction time, so one run's variant mix spans several microseconds.
+        """
+        if entity is None:
+            sql, params = (
+                "WITH run AS (SELECT MAX(time_run) AS time_run FROM points WHERE dataset = ?), "
+                "day AS (SELECT substr(MAX(date), 1, 10) AS day FROM points WHERE dataset = ? AND time_run = (SELECT time_run FROM run)) "
+                "SELECT record FROM points WHERE dataset = ? AND time_run = (SELECT time_run FROM run) AND substr(date, 1, 10) = (SELECT day FROM day) "
+                "ORDER BY entity, date"
+            ), (dataset, dataset, dataset)
+        else:
+            sql, params = "SELECT record FROM points WHERE dataset = ? AND entity = ? ORDER BY date DESC LIMIT 1", (dataset, entity)
+        return [json.loads(i[0]) for i in self._query(sql, params)]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'cached': len(self._cache)}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+            self._cache.clear()
+
+HISTORY_INDEX = HistoryIndex()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query the local history index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('rebuild', help='index every run of the snapshot store')
+    subparsers.add_parser('datasets', help='list indexed datasets')
+    series_cmd = subparsers.add_parser('series', help='print a series')
+    series_cmd.add_argument('dataset')
+    series_cmd.add_argument('--entity')
+    series_cmd.add_argument('--start')
+    series_cmd.add_argument('--end')
+    series_cmd.add_argument('--limit', type=int)
+    args = parser.parse_args()
+
+    if args.command == 'rebuild':
+        print(f"Indexed {HISTORY_INDEX.rebuild()} points into {HISTORY_INDEX.path}")
+    elif args.command == 'datasets':
+        print(json.dumps(HISTORY_INDEX.datasets(), ensure_ascii=False, indent=4))
+    else:
+        print(json.dumps(HISTORY_INDEX.series(args.dataset, args.entity, args.start, args.end, args.limit), ensure_ascii=False, indent=4))
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import hashlib
+import inspect
+from loguru import logger
+from urllib.parse import urlparse
+from utils import HTTP_POOL
+from metrics import METRICS
+from extraction import run_stamp, restamp
+
+HTML_CACHE_DIR = os.getenv('HTML_CACHE_DIR', '.cache/html')
+HTML_CACHE_TTL_SEC = float(os.getenv('HTML_CACHE_TTL_SEC', 3600))
+HTML_CACHE_MAX_BYTES = int(os.getenv('HTML_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+# pages whose HTML is a shell filled in by scripts: an unchanged document says nothing about the data
+HTML_CACHE_NO_PROBE = [i for i in os.getenv('HTML_CACHE_NO_PROBE', 'covid.cdc.gov,data.who.int').split(',') if i]
+
+def sha256(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class HtmlCache:
+    """On-disk cache of scraped HTML keyed by URL and content hash.
+
+    Layout under `root`:
+      entries/<url key>.json          url, content hash, fetch/access times, ETag/Last-Modified
+      blobs/<content hash>.html       raw HTML
+      records/<url key>-<hash>.json   records extracted from that HTML
+
+    An entry younger than `ttl` is served as is. An older one is revalidated with a
+    conditional HEAD against the origin and only re-scraped when the origin reports a change
+    or cannot tell; the validators that HEAD returns are kept with the re-scraped page, so
+    storing a page sends no request of its own. The least recently used entries are evicted
+    above `max_bytes`.
+    """
+    def __init__(self, root=HTML_CACHE_DIR, ttl=HTML_CACHE_TTL_SEC, max_bytes=HTML_CACHE_MAX_BYTES, no_probe=HTML_CACHE_NO_PROBE):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.no_probe = no_probe
+        self.hits = 0
+        self.misses = 0
+        # url -> validators of the last probe, for the `store` of the page scraped after it
+        self._probed = {}
+        # extractor -> hash of its source, records of an edited extractor are stale
+        self._extractors = {}
+
+    def _path(self, *parts):
+        path = os.path.join(self.root, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _entry_path(self, url):
+        return self._path('entries', f"{sha256(url)[:32]}.json")
+
+    def _records_path(self, url, content_hash):
+        return self._path('records', f"{sha256(url)[:32]}-{content_hash}.json")
+
+    def _read_entry(self, url):
+        try:
+            with open(self._entry_path(url)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _entries(self):
+        """(file name, entry) of every cached URL."""
+        entries = []
+        for name in [i for i in os.listdir(self._path('entries', '')) if i.endswith('.json')]:
+            try:
+                with open(os.path.join(self.root, 'entries', name)) as f:
+                    entries.append((name, json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return entries
+
+    def _referenced(self, content_hash, url):
+        """Whether a URL other than `url` still points at the blob `content_hash`."""
+        return any(entry['hash'] == content_hash and entry['url'] != url for _, entry in self._entries())
+
+    def _write_entry(self, entry):
+        path = self._entry_path(entry['url'])
+        with open(path + '.tmp', 'w') as f:
+            json.dump(entry, f)
+        os.replace(path + '.tmp', path)
+
+    def _validators(self, url, entry=None):
+        """HEAD `url`, conditionally if `entry` has validators; returns (status, validators) or (None, {})."""
+        headers = {}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = HTTP_POOL.client().head(url, headers=headers, follow_redirects=True)
+        except Exception as e:
+            logger.warning(f"⚠️ freshness probe failed: {url}; {e}")
+            return None, {}
+        return response.status_code, {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        }
+
+    def probe(self, url, entry):
+        """Whether the origin confirms `url` unchanged since `entry` was cached."""
+        if urlparse(url).netloc in self.no_probe:
+            return False
+        status, validators = self._validators(url, entry)
+        if status == 200:
+            self._probed[url] = validators
+        if status == 304:
+            return True
+        if status == 200:
+            if entry.get('etag') and validators['etag'] == entry['etag']:
+                return True
+            if not entry.get('etag') and entry.get('last_modified') and validators['last_modified'] == entry['last_modified']:
+                return True
+        return False
+
+    def lookup(self, url):
+        """Cached HTML for `url` if it is within TTL or the origin confirms it unchanged, else None."""
+        entry = self._read_entry(url)
+        blob = os.path.join(self.root, 'blobs', f"{entry['hash']}.html") if entry else None
+        if entry is None or not os.path.exists(blob): # type: ignore
+            self.misses += 1
+            METRICS.count('cache_requests_total', cache='html', result='miss')
+            return None
+        now = time.time()
+        if now - entry['fetched_at'] > self.ttl:
+            if not self.probe(url, entry):
+                self.misses += 1
+                METRICS.count('cache_requests_total', cache='html', result='changed')
+                return None
+            logger.info(f"Not modified: {url}")
+            entry['fetched_at'] = now
+        entry['last_access'] = now
+        self._write_entry(entry)
+        self.hits += 1
+        METRICS.count('cache_requests_total', cache='html', result='hit')
+        with open(blob, encoding='utf-8') as f: # type: ignore
+            return f.read()
+
+    def peek(self, url):
+        """Cached HTML for `url` regardless of age, without touching the entry."""
+        entry = self._read_entry(url)
+        try:
+            with open(os.path.join(self.root, 'blobs', f"{entry['hash']}.html"), encoding='utf-8') as f: # type: ignore
+                return f.read()
+        except (OSError, TypeError):
+            return None
+
+    def store(self, url, html):
+        """Cache freshly scraped HTML for `url` and return its content hash."""
+        content_hash = sha256(html)
+        previous = self._read_entry(url)
+        if previous is not None and previous['hash'] != content_hash:
+            stale = [self._records_path(url, previous['hash'])]
+            # blobs are shared by every URL that served the same HTML
+            if not self._referenced(previous['hash'], url):
+                stale.append(os.path.join(self.root, 'blobs', f"{previous['hash']}.html"))
+            for path in stale:
+                if os.path.exists(path):
+                    os.remove(path)
+        blob = self._path('blobs', f"{content_hash}.html")
+        if not os.path.exists(blob):
+            with open(blob + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(html)
+            os.replace(blob + '.tmp', blob)
+        validators = self._probed.pop(url, {})
+        now = time.time()
+        self._write_entry({'url': url, 'hash': content_hash, 'fetched_at': now, 'last_access': now, **validators})
+        self.evict()
+        return content_hash
+
+    def _extractor(self, extract):
+        if extract not in self._extractors:
+            self._extractors[extract] = sha256(inspect.getsource(extract))
+        return self._extractors[extract]
+
+    def records(self, url, html, extract, time_now):
+        """Records `extract` produced earlier from exactly this HTML, or None.
+
+        Values stamped with the earlier run's time (realtime datasets, see extraction.RUN_TIME)
+        are re-stamped with `time_now`, so reused records date from the run that reuses them.
+        """
+        try:
+            with open(self._records_path(url, sha256(html))) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            METRICS.count('cache_requests_total', cache='records', result='miss')
+            return None
+        # records from an extractor that has since been edited are stale, and so are those
+        # cached before the run time was kept with them
+        if cached['extractor'] != self._extractor(extract) or 'time_now' not in cached:
+            METRICS.count('cache_requests_total', cache='records', result='changed')
+            return None
+        METRICS.count('cache_requests_total', cache='records', result='hit')
+        return restamp(cached['records'], cached['time_now'], time_now)
+
+    def store_records(self, url, html, extract, records, time_now):
+        path = self._records_path(url, sha256(html))
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'extractor': self._extractor(extract), 'time_now': run_stamp(time_now), 'records': records}, f)
+        os.replace(path + '.tmp', path)
+
+    def evict(self):
+        """Drop least recently used entries, with their HTML and records, until under `max_bytes`."""
+        entries = self._entries()
+        # record files by the url key they start with, listed once
+        records_dir = os.path.join(self.root, 'records')
+        records = {}
+        for i in os.listdir(records_dir) if os.path.isdir(records_dir) else []:
+            records.setdefault(i.split('-', 1)[0], []).append(os.path.join(records_dir, i))
+        def files(name, entry):
+            blob = os.path.join(self.root, 'blobs', f"{entry['hash']}.html")
+            return [i for i in [blob] + records.get(name[:-5], []) if os.path.exists(i)]
+        sizes = {name: sum(os.path.getsize(i) for i in files(name, entry)) for name, entry in entries}
+        total = sum(sizes.values())
+        remaining = dict(entries)
+        for name, entry in sorted(entries, key=lambda i: i[1]['last_access']):
+            if total <= self.max_bytes:
+                break
+            del remaining[name]
+            # a blob another entry still points at stays
+            shared = any(i['hash'] == entry['hash'] for i in remaining.values())
+            for path in files(name, entry) + [os.path.join(self.root, 'entries', name)]:
+                if not (shared and path.endswith(f"{entry['hash']}.html")):
+                    os.remove(path)
+            total -= sizes[name]
+            logger.info(f"Evicted: {entry['url']}")
+
+HTML_CACHE = HtmlCache()
@@ -0,0 +1,280 @@
+"""Stage spans, counters and histograms of the crawl pipelines.
+
+    with METRICS.span('firecrawl.render', url=url): ...
+    METRICS.count('firecrawl_polls_total', site=site)
+    METRICS.report('who')   # end-of-run summary table, and the Prometheus textfile
+
+Every finished span is appended to METRICS_SPANS as one JSON line with OTLP span fields
+(trace_id, span_id, parent_span_id, name, start/end_time_unix_nano, attributes, status), and
+its duration observed in the `stage_seconds` histogram. The lines are written in batches by a
+background thread, and the file is rotated to METRICS_SPANS + '.1' above METRICS_SPANS_MAX_BYTES.
+Worker processes `collect` their metrics and the parent `replay`s them. Counters and histograms are written
+in Prometheus text format to METRICS_TEXTFILE, for node_exporter's textfile collector.
+"""
+import os
+import json
+import time
+import atexit
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from loguru import logger
+
+METRICS_TEXTFILE = os.getenv('METRICS_TEXTFILE', '.cache/metrics/epi_crawl.prom')
+# JSON lines sink of finished spans, '' to keep spans in memory only
+METRICS_SPANS = os.getenv('METRICS_SPANS', '.cache/metrics/spans.jsonl')
+METRICS_SPANS_MAX_BYTES = int(os.getenv('METRICS_SPANS_MAX_BYTES', 50 * 1024 * 1024))
+METRICS_PREFIX = 'epi_crawl_'
+# spans kept for the summary of a process that never reports, such as the MCP server
+METRICS_MAX_SPANS = int(os.getenv('METRICS_MAX_SPANS', 10000))
+METRICS_BUCKETS = tuple(float(i) for i in os.getenv('METRICS_BUCKETS', '0.005,0.01,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,120,300,600').split(','))
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+# events of a `collect` block, recorded by `replay` instead of here
+_collected = contextvars.ContextVar('collected', default=None)
+
+def site_of(url):
+    return urlparse(url).netloc if url else ''
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def label_text(labels):
+    return ','.join(f'{k}="{escape(v)}"' for k, v in labels)
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """Process-wide registry of counters, histograms and spans; thread-safe, spans nest across awaits."""
+    def __init__(self, textfile=METRICS_TEXTFILE, spans_path=METRICS_SPANS, buckets=METRICS_BUCKETS, max_spans=METRICS_MAX_SPANS, spans_max_bytes=METRICS_SPANS_MAX_BYTES):
+        self.textfile = textfile
+        self.spans_path = spans_path
+        self.spans_max_bytes = spans_max_bytes
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        # spans finished since the last report
+        self.spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        # span lines not yet written, and the thread writing them
+        self._pending = []
+        self._flushing = threading.Lock()
+        self._wake = threading.Event()
+        self._writer = None
+
+    def count(self, name, value=1, **labels):
+        collected = _collected.get()
+        if collected is not None:
+            collected.append(('count', name, value, labels))
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        collected = _collected.get()
+        if collected is not None:
+            collected.append(('observe', name, value, labels))
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+            self.histograms[key].observe(value)
+
+    def start(self, stage, url=None, dataset=None, **attributes):
+        """A span started now, child of the current one; finish it with `end`.
+
+        For stages that cannot be wrapped in `span`, such as a page of a batch job that completes
+        while its async generator is suspended.
+        """
+        parent = _current_span.get()
+        return {
+            # a root span, such as a scheduled run, starts its own trace
+            'trace_id': parent['trace_id'] if parent else os.urandom(16).hex(),
+            'span_id': os.urandom(8).hex(),
+            'parent_span_id': parent['span_id'] if parent else None,
+            'name': stage,
+            'start_time_unix_nano': time.time_ns(),
+            'attributes': {k: v for k, v in {'url': url, 'dataset': dataset, **attributes}.items() if v is not None},
+            '_start': time.perf_counter()
+        }
+
+    def end(self, span, error=None):
+        seconds = time.perf_counter() - span.pop('_start')
+        span['end_time_unix_nano'] = span['start_time_unix_nano'] + int(seconds * 1e9)
+        span['status'] = 'error' if error is not None else 'ok'
+        if error is not None:
+            span['attributes']['error'] = repr(error)
+        collected = _collected.get()
+        if collected is not None:
+            collected.append(('span', span))
+            return seconds
+        self._record(span, seconds)
+        return seconds
+
+    def _record(self, span, seconds):
+        self.observe('stage_seconds', seconds, stage=span['name'], site=site_of(span['attributes'].get('url')))
+        line = json.dumps(span, ensure_ascii=False, default=str)
+        with self._lock:
+            self.spans.append(span)
+            if not self.spans_path:
+                return
+            self._pending.append(line + '\n')
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='metrics-spans', daemon=True)
+                self._writer.start()
+        # the file is written off the calling thread, which may be the event loop
+        self._wake.set()
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning(f"⚠️ spans not written: {e}")
+
+    def flush(self):
+        """Write the pending span lines to `spans_path`, rotating it first when it is full."""
+        with self._flushing:
+            with self._lock:
+                lines, self._pending = self._pending, []
+            if not lines or not self.spans_path:
+                return
+            os.makedirs(os.path.dirname(self.spans_path) or '.', exist_ok=True)
+            try:
+                if os.path.getsize(self.spans_path) >= self.spans_max_bytes:
+                    os.replace(self.spans_path, self.spans_path + '.1')
+            except OSError:
+                pass
+            # one write per batch, so processes appending to the same sink do not interleave
+            with open(self.spans_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+
+    def context(self):
+        """(trace_id, span_id) of the current span, for spans started in another process; None outside a span."""
+        span = _current_span.get()
+        return (span['trace_id'], span['span_id']) if span else None
+
+    @contextmanager
+    def collect(self, parent=None):
+        """Collect the spans, counts and observations of the enclosed block instead of recording them.
+
+        Yields the list of events to hand to `replay` in the process that records them; spans
+        started in the block are children of `parent`, a `context()` of that process.
+        """
+        collected = []
+        collecting = _collected.set(collected)
+        current = _current_span.set({'trace_id': parent[0], 'span_id': parent[1]} if parent else None)
+        try:
+            yield collected
+        finally:
+            _current_span.reset(current)
+            _collected.reset(collecting)
+
+    def replay(self, collected):
+        """Record the events of a `collect` block as if they happened here."""
+        for event in collected:
+            if event[0] == 'span':
+                span = event[1]
+                self._record(span, (span['end_time_unix_nano'] - span['start_time_unix_nano']) / 1e9)
+            elif event[0] == 'count':
+                self.count(event[1], event[2], **event[3])
+            else:
+                self.observe(event[1], event[2], **event[3])
+
+    @contextmanager
+    def span(self, stage, url=None, dataset=None, **attributes):
+        """Time the enclosed stage; the span is yielded so attributes can be added as they are known."""
+        span = self.start(stage, url, dataset, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span['attributes']
+        except BaseException as e:
+            _current_span.reset(token)
+            self.end(span, e)
+            raise
+        _current_span.reset(token)
+        self.end(span)
+
+    def textfile_lines(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda i: i[0])
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {METRICS_PREFIX}{name} counter')
+                typed.add(name)
+            lines.append(f'{METRICS_PREFIX}{name}{{{label_text(labels)}}} {value}')
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f'# TYPE {METRICS_PREFIX}{name} histogram')
+                typed.add(name)
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{METRICS_PREFIX}{name}_bucket{{{label_text(labels + (("le", bound),))}}} {count}')
+            lines.append(f'{METRICS_PREFIX}{name}_bucket{{{label_text(labels + (("le", "+Inf"),))}}} {histogram.count}')
+            lines.append(f'{METRICS_PREFIX}{name}_sum{{{label_text(labels)}}} {histogram.sum}')
+            lines.append(f'{METRICS_PREFIX}{name}_count{{{label_text(labels)}}} {histogram.count}')
+        return lines
+
+    def write_textfile(self):
+        if not self.textfile:
+            return
+        os.makedirs(os.path.dirname(self.textfile) or '.', exist_ok=True)
+        # the collector may read at any moment: write aside and rename
+        with open(self.textfile + '.tmp', 'w') as f:
+            f.write('\n'.join(self.textfile_lines()) + '\n')
+        os.replace(self.textfile + '.tmp', self.textfile)
+
+    def summary(self):
+        """Table of the spans finished since the last report by stage, and the counters since the start."""
+        with self._lock:
+            spans = list(self.spans)
+            counters = sorted(self.counters.items())
+        stages = {}
+        for span in spans:
+            seconds = (span['end_time_unix_nano'] - span['start_time_unix_nano']) / 1e9
+            stages.setdefault(span['name'], []).append((seconds, span['status'] == 'error'))
+        rows = [f"{'stage':<24} {'count':>6} {'errors':>6} {'total s':>9} {'mean s':>8} {'p50 s':>8} {'p95 s':>8} {'max s':>8}"]
+        for stage, items in sorted(stages.items(), key=lambda i: -sum(j[0] for j in i[1])):
+            seconds = [i[0] for i in items]
+            rows.append(f"{stage:<24} {len(items):>6} {sum(i[1] for i in items):>6} {sum(seconds):>9.2f} {sum(seconds) / len(seconds):>8.3f} "
+                        f"{percentile(seconds, 0.5):>8.3f} {percentile(seconds, 0.95):>8.3f} {max(seconds):>8.3f}")
+        for (name, labels), value in counters:
+            rows.append(f"{name}{{{label_text(labels)}}} {value:g}")
+        return '\n'.join(rows)
+
+    def report(self, title='run'):
+        """Log the end-of-run summary, write the textfile and start collecting the next run's spans."""
+        table = self.summary()
+        logger.info(f"📊 {title} summary\n{table}")
+        self.write_textfile()
+        with self._lock:
+            self.spans.clear()
+        return table
+
+METRICS = Metrics()
+atexit.register(METRICS.write_textfile)
+atexit.register(METRICS.flush)
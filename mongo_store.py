@@ -0,0 +1,103 @@
+import os
+import atexit
+import pymongo
+from loguru import logger
+from datetime import timezone
+
+MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 10))
+
+class MongoStore:
+    """One pooled MongoClient per process, with indexes created once and latest dates cached.
+
+    `latest_dates` answers the "newest stored date" check of several collections with a single
+    aggregation ($group per collection joined by $unionWith) and remembers the answers, which
+    `write` keeps current, so later runs in the same process need no query at all. `write`
+    sends upserts for several collections in one client-level bulkWrite on MongoDB 8.0+, and
+    one bulk_write per collection before that.
+    """
+    def __init__(self, uri=MONGO_URI, max_pool_size=MONGO_MAX_POOL_SIZE):
+        self.uri = uri
+        self.max_pool_size = max_pool_size
+        self._client = None
+        self._indexed = set()
+        self._latest = {}
+        self._client_bulk_write = None
+        self._version = None
+
+    def client(self):
+        if self._client is None:
+            self._client = pymongo.MongoClient(self.uri, maxPoolSize=self.max_pool_size, tz_aware=True)
+        return self._client
+
+    def ensure_indexes(self, db_name, indexes):
+        """Create `indexes`, {collection: [keys, ...]}, the first time they are asked for in this process."""
+        db = self.client()[db_name]
+        for collection, keys_list in indexes.items():
+            for keys in keys_list:
+                if (db_name, collection, tuple(keys)) in self._indexed:
+                    continue
+                db[collection].create_index(keys)
+                self._indexed.add((db_name, collection, tuple(keys)))
+
+    def latest_dates(self, db_name, collections):
+        """Newest `date` stored in each of `collections`, None for an empty one."""
+        missing = [i for i in collections if (db_name, i) not in self._latest]
+        if missing:
+            def newest(collection):
+                return [{'$group': {'_id': None, 'date': {'$max': '$date'}}}, {'$set': {'_id': collection}}]
+            pipeline = newest(missing[0]) + [{'$unionWith': {'coll': i, 'pipeline': newest(i)}} for i in missing[1:]]
+            found = {i['_id']: i['date'] for i in self.client()[db_name][missing[0]].aggregate(pipeline)}
+            for collection in missing:
+                date = found.get(collection)
+                self._latest[(db_name, collection)] = date.astimezone(timezone.utc) if date is not None else None
+        return {i: self._latest[(db_name, i)] for i in collections}
+
+    def server_version(self):
+        """(major, minor) of the MongoDB server, asked once per connection."""
+        if self._version is None:
+            self._version = tuple(self.client().server_info()['versionArray'][:2])
+        return self._version
+
+    def require_version(self, minimum, feature):
+        """Raise RuntimeError before writing anything when the server is older than `minimum` (major, minor)."""
+        if self.server_version() < minimum:
+            raise RuntimeError(f"{feature} needs MongoDB {'.'.join(map(str, minimum))} or later, the server is {'.'.join(map(str, self.server_version()))}")
+
+    def _supports_client_bulk_write(self):
+        if self._client_bulk_write is None:
+            self._client_bulk_write = hasattr(self.client(), 'bulk_write') and self.server_version()[0] >= 8
+        return self._client_bulk_write
+
+    def write(self, db_name, upserts):
+        """Upsert documents, {collection: [(filter, document), ...]}, in as few round trips as possible."""
+        upserts = {collection: requests for collection, requests in upserts.items() if requests}
+        if not upserts:
+            return
+        db = self.client()[db_name]
+        if self._supports_client_bulk_write():
+            self.client().bulk_write([
+                pymongo.ReplaceOne(key, document, upsert=True, namespace=f'{db_name}.{collection}')
+                for collection, requests in upserts.items()
+                for key, document in requests
+            ], ordered=False)
+        else:
+            for collection, requests in upserts.items():
+                db[collection].bulk_write([pymongo.ReplaceOne(key, document, upsert=True) for key, document in requests], ordered=False)
+        for collection, requests in upserts.items():
+            dates = [document['date'] for _, document in requests if document.get('date') is not None]
+            latest = self._latest.get((db_name, collection))
+            if dates:
+                self._latest[(db_name, collection)] = max(dates + ([latest] if latest is not None else []))
+        logger.info(f"Upserted {sum(len(i) for i in upserts.values())} documents into {len(upserts)} collections of {db_name}")
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+            self._latest.clear()
+            self._client_bulk_write = None
+            self._version = None
+
+MONGO_STORE = MongoStore()
+atexit.register(MONGO_STORE.close)
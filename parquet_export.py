@@ -0,0 +1,146 @@
+import os
+import json
+import hashlib
+import pandas as pd
+from loguru import logger
+from snapshot_store import leaves
+
+PARQUET_DIR = os.getenv('PARQUET_DIR', 'parquet')
+# record fields naming the series a row belongs to; each series keeps its own watermark
+PARQUET_SERIES_FIELDS = ('virus_type', 'country', 'WHO_region', 'variant', 'age_group')
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# WHO dashboard cells that mean "no value" in an otherwise numeric column
+PARQUET_MISSING = ('', 'No data', 'N/A', '-')
+
+def to_number(values):
+    """Numbers of dashboard strings such as '1,234', '14.8k' or '2.1M'; NaN where there is none."""
+    text = values.astype('string').str.strip().str.replace(',', '')
+    scale = text.str[-1].map({'k': 1e3, 'K': 1e3, 'M': 1e6}).astype('float64').fillna(1.0)
+    text = text.where(scale == 1.0, text.str[:-1])
+    return pd.to_numeric(text, errors='coerce').astype('float64') * scale
+
+def dataset_name(path):
+    """'WHO_realtime_summary' for a WHO dataset, 'clinical_cov_trends' for epi_us['clinical_cov']['trends']."""
+    return '_'.join(path)
+
+class ParquetExport:
+    """Appends every dataset of a run to typed Parquet files under `root`.
+
+    Layout (hive partitioning, readable with pandas.read_parquet or pyarrow.dataset):
+      <dataset>/year=<YYYY>/month=<M>/<time_run>.parquet
+      <dataset>/_state.json    column types and per-series watermarks
+
+    Rows are partitioned by their `date`, or by the run time when a dataset has none. Only
+    rows newer than the watermark of their series are written, so each run appends what is
+    new; a dataset without dates is appended when its content changes. Column types are
+    inferred on the first export (dates as UTC timestamps, numeric strings as numbers) and
+    kept afterwards so every file of a dataset has the same schema.
+
+    A country-year slice with column pruning:
+      pd.read_parquet('parquet/WHO_history_weekly_countries_reported_cases',
+                      columns=['date', 'Number_of_cases_reported_to_WHO'],
+                      filters=[('year', '=', 2024), ('country', '=', 'China')])
+    """
+    def __init__(self, root=PARQUET_DIR):
+        self.root = root
+
+    def _state_path(self, name):
+        return os.path.join(self.root, name, '_state.json')
+
+    def _state(self, name):
+        if not os.path.exists(self._state_path(name)):
+            return {'dtypes': {}, 'watermarks': {}, 'digest': None}
+        with open(self._state_path(name)) as f:
+            return json.load(f)
+
+    def _save_state(self, name, state):
+        path = self._state_path(name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f, ensure_ascii=False, indent=4)
+        os.replace(path + '.tmp', path)
+
+    def _typed(self, frame, dtypes):
+        """Cast columns to the dataset's recorded types, inferring and recording new columns."""
+        for column in frame.columns:
+            if column not in dtypes:
+                values = frame[column].dropna()
+                if column == 'date':
+                    dtypes[column] = 'timestamp'
+                elif len(values) and values.map(lambda i: isinstance(i, (list, dict))).any():
+                    dtypes[column] = 'json'
+                elif len(values) and (to_number(values).notna() | values.isin(PARQUET_MISSING)).all() and not values.isin(PARQUET_MISSING).all():
+                    dtypes[column] = 'number'
+                else:
+                    dtypes[column] = 'string'
+            dtype = dtypes[column]
+            if dtype == 'timestamp':
+                frame[column] = pd.to_datetime(frame[column].astype('string'), utc=True, errors='coerce', format='mixed')
+            elif dtype == 'number':
+                frame[column] = to_number(frame[column])
+            elif dtype == 'json':
+                frame[column] = frame[column].map(lambda i: None if i is None else json.dumps(i, ensure_ascii=False, default=str))
+            else:
+                frame[column] = frame[column].astype('string')
+        return frame
+
+    def _write(self, name, frame, time_run):
+        written = 0
+        for (year, month), part in frame.groupby(['year', 'month']):
+            directory = os.path.join(self.root, name, f'year={year}', f'month={month}')
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'{time_run}.parquet')
+            part.drop(columns=['year', 'month']).to_parquet(path + '.tmp', index=False, engine='pyarrow')
+            os.replace(path + '.tmp', path)
+            written += len(part)
+        return written
+
+    def export_dataset(self, name, records, time_run):
+        """Append the new rows of one dataset; returns how many were written."""
+        if not records:
+            return 0
+        os.makedirs(os.path.join(self.root, name), exist_ok=True)
+        state = self._state(name)
+        frame = self._typed(pd.DataFrame.from_records(records), state['dtypes'])
+        run_time = pd.Timestamp(pd.to_datetime(time_run, format='%Y-%m-%d-%H-%M-%S'), tz='UTC')
+        frame['time_run'] = run_time
+
+        if 'date' in frame.columns and frame['date'].notna().any():
+            frame = frame[frame['date'].notna()]
+            series_fields = [i for i in PARQUET_SERIES_FIELDS if i in frame.columns]
+            series = frame[series_fields].astype('string').fillna('').agg('|'.join, axis=1) if series_fields else pd.Series('', index=frame.index)
+            watermark = pd.to_datetime(series.map(state['watermarks']), utc=True)
+            fresh = watermark.isna() | (frame['date'] > watermark)
+            frame, series = frame[fresh], series[fresh]
+            for key, date in frame['date'].groupby(series).max().items():
+                state['watermarks'][key] = date.isoformat()
+            partition_date = frame['date']
+        else:
+            digest = hashlib.sha256(json.dumps(records, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+            if digest == state['digest']:
+                frame = frame.iloc[0:0]
+            state['digest'] = digest
+            partition_date = frame['time_run']
+
+        frame = frame.assign(year=partition_date.dt.year, month=partition_date.dt.month)
+        written = self._write(name, frame, time_run) if len(frame) else 0
+        self._save_state(name, state)
+        return written
+
+    def export(self, data, time_run):
+        """Export every dataset of a run's nested data; returns rows written per dataset."""
+        if pyarrow is None:
+            logger.warning("⚠️ pyarrow is not installed, skipping the Parquet export (uv pip install -e .[parquet])")
+            return {}
+        written = {}
+        for path, records in leaves(data):
+            if isinstance(records, list):
+                written[dataset_name(path)] = self.export_dataset(dataset_name(path), records, time_run)
+        logger.info(f"Exported {sum(written.values())} new rows of {len(written)} datasets to {self.root}")
+        return written
+
+PARQUET_EXPORT = ParquetExport()
@@ -0,0 +1,130 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import asyncio
+import threading
+
+FIRECRAWL_LEDGER = os.getenv('FIRECRAWL_LEDGER', '.cache/firecrawl_ledger.sqlite3')
+# the API key's submission quota, shared by every process using it
+FIRECRAWL_REQUESTS_PER_MINUTE = float(os.getenv('FIRECRAWL_REQUESTS_PER_MINUTE', 10))
+# fraction of the quota the ledger hands out, so clock skew and retries stay under it
+FIRECRAWL_QUOTA_HEADROOM = float(os.getenv('FIRECRAWL_QUOTA_HEADROOM', 0.95))
+# breaker open time after a 429 that does not say when to retry, doubled on each consecutive one
+FIRECRAWL_BREAKER_SEC = float(os.getenv('FIRECRAWL_BREAKER_SEC', 60))
+FIRECRAWL_BREAKER_MAX_SEC = float(os.getenv('FIRECRAWL_BREAKER_MAX_SEC', 900))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    open_until REAL NOT NULL DEFAULT 0,
+    trips INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+class RateLimitOpen(Exception):
+    """The breaker of `key` is open; nothing may be submitted for `retry_after` seconds."""
+    def __init__(self, key, retry_after):
+        super().__init__(f"rate limit breaker open, retry after {retry_after:.1f} seconds")
+        self.key = key
+        self.retry_after = retry_after
+
+def ledger_key(api_key):
+    """Bucket of an API key; the key itself is not written to disk."""
+    return hashlib.sha256(str(api_key).encode('utf-8')).hexdigest()[:16]
+
+def retry_after_of(response):
+    """Seconds a 429 response asks to wait, from its Retry-After header or FireCrawl's error text, else None."""
+    header = response.headers.get('Retry-After') if response is not None else None
+    if header is not None and header.strip().isdigit():
+        return float(header)
+    try:
+        message = str(response.json().get('error', ''))
+    except Exception:
+        return None
+    match = re.search(r'retry after (\d+(?:\.\d+)?)\s*s', message, re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+class RateLedger:
+    """Token bucket and circuit breaker shared through SQLite by every process using an API key.
+
+    `acquire(key)` waits for a submission token; the bucket refills at the quota times
+    FIRECRAWL_QUOTA_HEADROOM, so the combined rate of all processes stays just under it.
+    `trip(key, retry_after)` opens the breaker after a 429: until it closes, `acquire`
+    raises `RateLimitOpen` with the exact remaining wait instead of submitting. Each
+    read-modify-write is one IMMEDIATE transaction, so processes never hand out the same token.
+    """
+    def __init__(self, path=FIRECRAWL_LEDGER, requests_per_minute=FIRECRAWL_REQUESTS_PER_MINUTE, headroom=FIRECRAWL_QUOTA_HEADROOM):
+        self.path = path
+        self.rate = requests_per_minute * headroom / 60
+        self.capacity = max(1.0, requests_per_minute * headroom)
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, key, update):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated, open_until, trips FROM buckets WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            tokens, updated, open_until, trips = row if row is not None else (self.capacity, now, 0.0, 0)
+            tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+            state, result = update(now, tokens, open_until, trips)
+            conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?)", (key, state[0], now, state[1], state[2]))
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def try_acquire(self, key):
+        """Take a token if one is free: returns 0, or the seconds until one will be. Raises RateLimitOpen."""
+        def take(now, tokens, open_until, trips):
+            if open_until > now:
+                return (tokens, open_until, trips), -(open_until - now)
+            if tokens >= 1:
+                return (tokens - 1, open_until, trips), 0.0
+            return (tokens, open_until, trips), (1 - tokens) / self.rate
+        wait = self._transaction(key, take)
+        if wait < 0:
+            raise RateLimitOpen(key, -wait)
+        return wait
+
+    def acquire(self, key):
+        while (wait := self.try_acquire(key)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, key):
+        while (wait := await asyncio.to_thread(self.try_acquire, key)) > 0:
+            await asyncio.sleep(wait)
+
+    def trip(self, key, retry_after=None):
+        """Open the breaker after a 429, for `retry_after` seconds or an escalating default; returns the wait."""
+        def open_breaker(now, tokens, open_until, trips):
+            wait = retry_after if retry_after is not None else min(FIRECRAWL_BREAKER_SEC * 2 ** trips, FIRECRAWL_BREAKER_MAX_SEC)
+            return (0.0, max(open_until, now + wait), trips + 1), max(open_until, now + wait) - now
+        return self._transaction(key, open_breaker)
+
+    def succeeded(self, key):
+        """A submission went through: consecutive 429s start over."""
+        def reset(now, tokens, open_until, trips):
+            return (tokens, open_until, 0), None
+        self._transaction(key, reset)
+
+    def status(self, key):
+        def read(now, tokens, open_until, trips):
+            return (tokens, open_until, trips), {'tokens': round(tokens, 2), 'open_for_sec': round(max(0.0, open_until - now), 1), 'trips': trips}
+        return self._transaction(key, read)
+
+RATE_LEDGER = RateLedger()
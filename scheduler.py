@@ -0,0 +1,150 @@
+"""One async daemon keeping every source fresh: uv run scheduler.py"""
+import os
+import json
+import time
+import random
+import asyncio
+from loguru import logger
+from utils import HTTP_POOL, EventLoopStallMonitor
+from metrics import METRICS
+
+SCHEDULER_STATE = os.getenv('SCHEDULER_STATE', '.cache/scheduler.json')
+# spread of every delay, as a fraction of it, so restarts and sources do not line up
+SCHEDULER_JITTER = float(os.getenv('SCHEDULER_JITTER', 0.1))
+SCHEDULER_BACKOFF_SEC = float(os.getenv('SCHEDULER_BACKOFF_SEC', 600))
+SCHEDULER_MAX_BACKOFF_SEC = float(os.getenv('SCHEDULER_MAX_BACKOFF_SEC', 3600 * 6))
+
+class HeadProbe:
+    """Cheap freshness check: HEAD `urls` and compare ETag/Last-Modified with those seen at the last run.
+
+    `changed()` is True when a validator moved, False when all are unchanged and None when
+    the origin gives no validators to compare.
+    """
+    def __init__(self, urls):
+        self.urls = urls
+
+    async def validators(self):
+        found = {}
+        for url in self.urls:
+            try:
+                response = await HTTP_POOL.async_client().head(url, follow_redirects=True)
+            except Exception as e:
+                logger.warning(f"⚠️ freshness probe failed: {url}; {e}")
+                return None
+            tag = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            if response.status_code != 200 or tag is None:
+                return None
+            found[url] = tag
+        return found
+
+    async def changed(self, seen):
+        current = await self.validators()
+        if current is None or not seen:
+            return None
+        return current != seen
+
+class Source:
+    """A pipeline run by the scheduler.
+
+    `run` is a coroutine function doing a full crawl and save. It is due `cadence_sec` after
+    the last success. With a `probe` it is also checked every `probe_sec` and run early when
+    the probe reports new data. Failures back off exponentially from `backoff_sec` up to
+    `max_backoff_sec`, except a rate-limited failure, retried when the FireCrawl breaker closes.
+    """
+    def __init__(self, name, run, cadence_sec, probe=None, probe_sec=None, backoff_sec=SCHEDULER_BACKOFF_SEC, max_backoff_sec=SCHEDULER_MAX_BACKOFF_SEC, jitter=SCHEDULER_JITTER):
+        self.name = name
+        self.run = run
+        self.cadence_sec = cadence_sec
+        self.probe = probe
+        self.probe_sec = probe_sec or cadence_sec
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.jitter = jitter
+        self.state = {'last_success': None, 'failures': 0, 'retry_at': None, 'validators': None, 'runs': 0, 'probes': 0, 'skipped': 0}
+
+    def due(self, now):
+        return self.state['last_success'] is None or now - self.state['last_success'] >= self.cadence_sec
+
+    def next_delay(self, now):
+        if self.state['failures'] and self.state.get('retry_at') is not None:
+            return max(0.0, self.state['retry_at'] - now)
+        if self.state['failures']:
+            delay = min(self.backoff_sec * 2 ** (self.state['failures'] - 1), self.max_backoff_sec)
+        elif self.due(now):
+            return 0.0
+        else:
+            delay = self.state['last_success'] + self.cadence_sec - now
+            if self.probe is not None:
+                delay = min(delay, self.probe_sec)
+        return max(0.0, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def tick(self):
+        """Run the source if it is due or its probe reports new data."""
+        if not self.due(time.time()) and not self.state['failures']:
+            if self.probe is None:
+                return
+            self.state['probes'] += 1
+            if not await self.probe.changed(self.state['validators']):
+                self.state['skipped'] += 1
+                logger.info(f"🏖️ {self.name}: no new data")
+                return
+            logger.info(f"🌟 {self.name}: new data published")
+        try:
+            async with EventLoopStallMonitor() as monitor:
+                with METRICS.span('run', source=self.name):
+                    await self.run()
+        except Exception as e:
+            self.state['failures'] += 1
+            # a rate-limited run knows exactly when the FireCrawl breaker closes
+            retry_after = getattr(e, 'retry_after', None)
+            self.state['retry_at'] = time.time() + retry_after if retry_after is not None else None
+            logger.error(f"⚠️ {self.name} failed ({self.state['failures']} in a row): {e!r}")
+            return
+        finally:
+            METRICS.report(self.name)
+        self.state.update(last_success=time.time(), failures=0, retry_at=None, runs=self.state['runs'] + 1)
+        if self.probe is not None:
+            self.state['validators'] = await self.probe.validators()
+        logger.info(f"✅ {self.name} updated; event loop max stall: {monitor.max_stall:.2f} seconds")
+
+class Scheduler:
+    """Runs every source on its own cadence in one event loop, keeping their state across restarts."""
+    def __init__(self, sources, state_path=SCHEDULER_STATE):
+        self.sources = sources
+        self.state_path = state_path
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for source in self.sources:
+            source.state.update(saved.get(source.name, {}))
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump({source.name: source.state for source in self.sources}, f, indent=4)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    async def _loop(self, source):
+        while True:
+            delay = source.next_delay(time.time())
+            logger.info(f"{source.name}: next check in {delay / 3600:.2f} hours")
+            await asyncio.sleep(delay)
+            await source.tick()
+            self.save_state()
+
+    async def run(self):
+        self.load_state()
+        try:
+            await asyncio.gather(*[self._loop(source) for source in self.sources])
+        finally:
+            self.save_state()
+            await HTTP_POOL.aclose()
+
+if __name__ == '__main__':
+    import importlib
+    sources = [importlib.import_module('epi-crawl').us_source(), importlib.import_module('getdata_covid19_who').who_source()]
+    asyncio.run(Scheduler(sources).run())
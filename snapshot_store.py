@@ -0,0 +1,234 @@
+"""Deduplicated, compressed store for run snapshots, replacing the history/ and recent/ JSON dumps.
+
+    uv run snapshot_store.py migrate history recent [--delete]   # import existing dumps
+    uv run snapshot_store.py runs data_us_history                # list stored runs
+    uv run snapshot_store.py show data_us_history [TIME_RUN]     # print a run as JSON
+
+Each leaf dataset of a run (a list of records, or any other value) is stored once per content
+hash as compressed JSON lines, either in full or as a delta against the same dataset of the
+previous run. A run is a small manifest listing the hashes of its datasets.
+"""
+import io
+import os
+import re
+import json
+import gzip
+import hashlib
+import difflib
+import argparse
+from loguru import logger
+
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'snapshots')
+SNAPSHOT_CODEC = os.getenv('SNAPSHOT_CODEC', 'gzip')
+# longest chain of deltas a read has to replay before reaching a full blob
+SNAPSHOT_MAX_CHAIN = int(os.getenv('SNAPSHOT_MAX_CHAIN', 8))
+SNAPSHOT_CODECS = {'gzip': '.gz', 'zstd': '.zst'}
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def resolve_codec(codec):
+    if codec not in SNAPSHOT_CODECS:
+        raise ValueError(f"unknown SNAPSHOT_CODEC {codec}, expected one of {list(SNAPSHOT_CODECS)}")
+    if codec == 'zstd' and zstandard is None:
+        logger.warning("⚠️ zstandard is not installed, falling back to gzip")
+        return 'gzip'
+    return codec
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data) # type: ignore
+    return gzip.compress(data, mtime=0)
+
+def open_lines(path):
+    """The lines of a compressed blob, decompressed as they are read."""
+    if path.endswith('.zst'):
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True), encoding='utf-8') # type: ignore
+    return gzip.open(path, 'rt', encoding='utf-8')
+
+def leaves(data, path=()):
+    """(path, value) of every non-dict value of a nested dict, in order."""
+    if isinstance(data, dict) and data:
+        for key, value in data.items():
+            yield from leaves(value, path + (key,))
+    else:
+        yield path, data
+
+class SnapshotStore:
+    """Content-addressed snapshots under `root`.
+
+    Layout:
+      blobs/<hash[:2]>/<hash>.full.jsonl<.gz|.zst>    one JSON value per line
+      blobs/<hash[:2]>/<hash>.delta.jsonl<.gz|.zst>   header {"base", "depth"} then ["copy", i, j] / ["add", line] ops
+      runs/<name>/<time_run>.json                     manifest: path, hash and size of every dataset
+
+    `hash` is the sha256 of the dataset's uncompressed JSON lines, so an unchanged dataset
+    costs nothing but its manifest entry. A changed one is stored as a delta against the
+    previous run when that is smaller and the chain stays within SNAPSHOT_MAX_CHAIN.
+    """
+    def __init__(self, root=SNAPSHOT_DIR, codec=SNAPSHOT_CODEC, max_chain=SNAPSHOT_MAX_CHAIN):
+        self.root = root
+        self.codec = resolve_codec(codec)
+        self.max_chain = max_chain
+
+    def _path(self, *parts):
+        path = os.path.join(self.root, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _write(self, path, data):
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def _blob(self, content_hash):
+        """Path of the stored blob of `content_hash`, None if it is not stored."""
+        directory = os.path.join(self.root, 'blobs', content_hash[:2])
+        if not os.path.isdir(directory):
+            return None
+        for name in os.listdir(directory):
+            if name.startswith(content_hash + '.') and not name.endswith('.tmp'):
+                return os.path.join(directory, name)
+        return None
+
+    def _depth(self, content_hash):
+        blob = self._blob(content_hash)
+        if blob is None or '.delta.' not in blob:
+            return 0
+        with open_lines(blob) as f:
+            return json.loads(f.readline())['depth']
+
+    def iter_lines(self, content_hash):
+        """The JSON lines of a stored dataset, streamed through its delta chain."""
+        blob = self._blob(content_hash)
+        if blob is None:
+            raise KeyError(f"snapshot blob {content_hash} is missing")
+        with open_lines(blob) as f:
+            if '.delta.' not in blob:
+                for line in f:
+                    yield line.rstrip('\n')
+                return
+            header = json.loads(f.readline())
+            base, cursor = self.iter_lines(header['base']), 0
+            for op in map(json.loads, f):
+                if op[0] == 'add':
+                    yield op[1]
+                    continue
+                # copies run forward through the base, so it is read once from start to end
+                for _ in range(op[1] - cursor):
+                    next(base)
+                for _ in range(op[2] - op[1]):
+                    yield next(base)
+                cursor = op[2]
+
+    def _store(self, lines, base):
+        """Store a dataset's JSON lines unless already stored; returns its hash."""
+        text = ''.join(line + '\n' for line in lines)
+        content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        if self._blob(content_hash) is not None:
+            return content_hash
+        suffix = SNAPSHOT_CODECS[self.codec]
+        full = compress(text.encode('utf-8'), self.codec)
+        blob, data = f"{content_hash}.full.jsonl{suffix}", full
+        if base is not None and self._blob(base) is not None and (depth := self._depth(base)) < self.max_chain:
+            ops = [json.dumps({'base': base, 'depth': depth + 1})]
+            matcher = difflib.SequenceMatcher(None, list(self.iter_lines(base)), lines, autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag == 'equal':
+                    ops.append(json.dumps(['copy', i1, i2]))
+                else:
+                    ops.extend(json.dumps(['add', line], ensure_ascii=False) for line in lines[j1:j2])
+            delta = compress(''.join(op + '\n' for op in ops).encode('utf-8'), self.codec)
+            if len(delta) < len(full):
+                blob, data = f"{content_hash}.delta.jsonl{suffix}", delta
+        self._write(self._path('blobs', content_hash[:2], blob), data)
+        return content_hash
+
+    def runs(self, name):
+        directory = os.path.join(self.root, 'runs', name)
+        return sorted(i[:-5] for i in os.listdir(directory) if i.endswith('.json')) if os.path.isdir(directory) else []
+
+    def manifest(self, name, time_run):
+        with open(os.path.join(self.root, 'runs', name, f"{time_run}.json")) as f:
+            return json.load(f)
+
+    def save(self, name, time_run, data):
+        """Store run `time_run` of `name`; returns the manifest path."""
+        previous = [i for i in self.runs(name) if i < time_run]
+        bases = {tuple(i['path']): i['hash'] for i in self.manifest(name, previous[-1])['datasets']} if previous else {}
+        datasets = []
+        for path, value in leaves(data):
+            records = value if isinstance(value, list) else [value]
+            lines = [json.dumps(i, ensure_ascii=False, default=str) for i in records]
+            datasets.append({
+                'path': list(path),
+                'hash': self._store(lines, bases.get(path)),
+                'list': isinstance(value, list),
+                'records': len(records)
+            })
+        manifest = self._path('runs', name, f"{time_run}.json")
+        self._write(manifest, json.dumps({'name': name, 'time_run': time_run, 'datasets': datasets}, ensure_ascii=False).encode('utf-8'))
+        return manifest
+
+    def iter_records(self, name, time_run, path):
+        """Stream the records of one dataset of a run, e.g. path ('clinical_cov', 'trends')."""
+        entry = next(i for i in self.manifest(name, time_run)['datasets'] if tuple(i['path']) == tuple(path))
+        return map(json.loads, self.iter_lines(entry['hash']))
+
+    def load(self, name, time_run=None):
+        """A stored run as it was saved, the latest one if `time_run` is None."""
+        time_run = time_run or self.runs(name)[-1]
+        data = {}
+        for entry in self.manifest(name, time_run)['datasets']:
+            records = list(map(json.loads, self.iter_lines(entry['hash'])))
+            value = records if entry['list'] else records[0]
+            if not entry['path']:
+                return value
+            node = data
+            for key in entry['path'][:-1]:
+                node = node.setdefault(key, {})
+            node[entry['path'][-1]] = value
+        return data
+
+    def migrate(self, directories, delete=False):
+        """Import `<name>_<%Y-%m-%d-%H-%M-%S>.json` dumps, oldest first so deltas follow run order."""
+        dumps = []
+        for directory in directories:
+            for filename in os.listdir(directory):
+                match = re.fullmatch(r'(.+)_(\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})\.json', filename)
+                if match:
+                    dumps.append((match.group(2), match.group(1), os.path.join(directory, filename)))
+        for time_run, name, path in sorted(dumps):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.save(name, time_run, data)
+            if self.load(name, time_run) != data:
+                raise ValueError(f"{path} does not read back identically, keeping it")
+            logger.info(f"Imported {path} as {name} {time_run}")
+            if delete:
+                os.remove(path)
+        return len(dumps)
+
+SNAPSHOT_STORE = SnapshotStore()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_cmd = subparsers.add_parser('migrate', help='import existing JSON dumps')
+    migrate_cmd.add_argument('directories', nargs='+')
+    migrate_cmd.add_argument('--delete', action='store_true', help='remove each dump once it reads back identically')
+    runs_cmd = subparsers.add_parser('runs', help='list the stored runs of a snapshot name')
+    runs_cmd.add_argument('name')
+    show_cmd = subparsers.add_parser('show', help='print a stored run')
+    show_cmd.add_argument('name')
+    show_cmd.add_argument('time_run', nargs='?')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        print(f"Imported {SNAPSHOT_STORE.migrate(args.directories, args.delete)} dumps into {SNAPSHOT_STORE.root}")
+    elif args.command == 'runs':
+        print('\n'.join(SNAPSHOT_STORE.runs(args.name)))
+    else:
+        print(json.dumps(SNAPSHOT_STORE.load(args.name, args.time_run), ensure_ascii=False, indent=4))
@@ -0,0 +1,222 @@
+import os
+import csv
+import json
+import argparse
+from collections import defaultdict
+from datetime import datetime, timezone
+from loguru import logger
+from utils import HTTP_POOL
+from extraction import REGISTRY
+
+# datasets read from structured downloads instead of scraped pages: comma-separated names, 'all', or empty for none
+SOURCE_ADAPTERS = [i.strip() for i in os.getenv('SOURCE_ADAPTERS', '').split(',') if i.strip()]
+# downloads, or local files (fixtures); an unset CDC source leaves its datasets to the page scrape
+WHO_GLOBAL_CSV = os.getenv('WHO_GLOBAL_CSV', 'https://srhdpeuwpubsa.blob.core.windows.net/whdh/COVID/WHO-COVID-19-global-data.csv')
+CDC_ACTIVITY_LEVELS_CSV = os.getenv('CDC_ACTIVITY_LEVELS_CSV')
+CDC_WW_TRENDS_CSV = os.getenv('CDC_WW_TRENDS_CSV')
+CDC_WW_VARIANTS_CSV = os.getenv('CDC_WW_VARIANTS_CSV')
+# recorded downloads, <adapter>.csv, with the records expected from them, <adapter>.json
+SOURCE_ADAPTER_FIXTURES = os.getenv('SOURCE_ADAPTER_FIXTURES', 'fixtures/source_adapters')
+
+WHO_REGIONS = {
+    'AFRO': 'Africa',
+    'AMRO': 'Americas',
+    'EMRO': 'Eastern Mediterranean',
+    'EURO': 'Europe',
+    'SEARO': 'South-East Asia',
+    'WPRO': 'Western Pacific'
+}
+CDC_DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%B %d, %Y', '%Y-%m-%dT%H:%M:%S.%f')
+
+def stream_lines(source):
+    """Lines of a download or a local file, read as they arrive so memory stays constant."""
+    if source.startswith(('http://', 'https://')):
+        with HTTP_POOL.client().stream('GET', source, follow_redirects=True) as response:
+            response.raise_for_status()
+            for number, line in enumerate(response.iter_lines()):
+                yield line.lstrip('﻿') if number == 0 else line
+    else:
+        with open(source, encoding='utf-8-sig', newline='') as f:
+            yield from f
+
+def stream_csv(source):
+    return csv.DictReader(stream_lines(source))
+
+def cdc_date(text):
+    for fmt in CDC_DATE_FORMATS:
+        try:
+            return str(datetime.strptime(text.strip(), fmt).replace(tzinfo=timezone.utc))
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognised CDC date {text!r}")
+
+def column(header, *keywords):
+    """The first column whose name contains every keyword, case-insensitively."""
+    for name in header:
+        if all(keyword.lower() in name.lower() for keyword in keywords):
+            return name
+    raise KeyError(f"no column with {keywords} in {header}")
+
+def share(text):
+    """A variant share as a fraction, from '55%' or '0.55'."""
+    text = text.strip()
+    return float(text.rstrip('%')) / 100 if text.endswith('%') else float(text)
+
+def number(text):
+    text = (text or '').strip().replace(',', '')
+    return int(text) if text.lstrip('-').isdigit() else None
+
+class Adapter:
+    """Reads `datasets` from the structured download at `source` with `read(source)`, returning {dataset: records}
+    in the record shapes the page extractors produce."""
+    def __init__(self, source, datasets, read):
+        self.name = read.__name__.removeprefix('read_')
+        self.source = source
+        self.datasets = datasets
+        self.read = read
+
+ADAPTERS = []
+
+def adapter(source, datasets):
+    def decorator(read):
+        ADAPTERS.append(Adapter(source, datasets, read))
+        return read
+    return decorator
+
+def selected(dataset):
+    return 'all' in SOURCE_ADAPTERS or dataset in SOURCE_ADAPTERS
+
+def read_adapters(datasets):
+    """Records of each of `datasets` that is selected and has a configured source, by dataset name.
+
+    A source that cannot be read, or no longer has the expected columns, is logged and its
+    datasets are left out, so they are scraped from their pages instead.
+    """
+    records = {}
+    for item in ADAPTERS:
+        wanted = [i for i in item.datasets if i in datasets and selected(i)]
+        if not wanted or not item.source:
+            continue
+        try:
+            read = item.read(item.source)
+        except Exception as e:
+            logger.warning(f"⚠️ {item.name} failed to read {item.source}, scraping {', '.join(wanted)} instead: {e!r}")
+            continue
+        records.update({i: read[i] for i in wanted})
+        logger.info(f"Read {', '.join(wanted)} from {item.source}")
+    return records
+
+def adapt(pages):
+    """Read the selected adapters of the datasets registered for `pages`.
+
+    Returns the adapted records and the pages still to scrape: those with a dataset no adapter covers.
+    """
+    records = read_adapters({dataset.name for page in pages for dataset in REGISTRY.get(page, [])})
+    remaining = [page for page in pages if page not in REGISTRY or not all(dataset.name in records for dataset in REGISTRY[page])]
+    return records, remaining
+
+## WHO: one weekly row per country, summed into the world and region series
+@adapter(WHO_GLOBAL_CSV, [
+    'WHO_history_weekly_world_reported_cases', 'WHO_history_weekly_region_reported_cases', 'WHO_history_weekly_countries_reported_cases',
+    'WHO_history_weekly_world_reported_deaths', 'WHO_history_weekly_region_reported_deaths', 'WHO_history_weekly_countries_reported_deaths'
+])
+def read_who_global(source):
+    values = {'cases': 'Number_of_cases_reported_to_WHO', 'deaths': 'Number_of_deaths_reported_to_WHO'}
+    world = {kind: defaultdict(int) for kind in values}
+    region = {kind: defaultdict(int) for kind in values}
+    countries = {kind: [] for kind in values}
+    for row in stream_csv(source):
+        date = str(datetime.strptime(row['Date_reported'], '%Y-%m-%d').replace(tzinfo=timezone.utc))
+        for kind, value_key in values.items():
+            value = number(row[f'New_{kind}'])
+            # the dashboard labels country points as text, 'No data' when missing
+            countries[kind].append({'date': date, 'country': row['Country'], value_key: 'No data' if value is None else str(value)})
+            if value is None:
+                continue
+            world[kind][date] += value
+            if row['WHO_region'] in WHO_REGIONS:
+                region[kind][(WHO_REGIONS[row['WHO_region']], date)] += value
+    records = {}
+    for kind, value_key in values.items():
+        records[f'WHO_history_weekly_world_reported_{kind}'] = [{'date': date, value_key: value} for date, value in sorted(world[kind].items())]
+        # and region deaths as text too
+        region_value = str if kind == 'deaths' else int
+        records[f'WHO_history_weekly_region_reported_{kind}'] = [{'date': date, 'WHO_region': name, value_key: region_value(value)} for (name, date), value in sorted(region[kind].items())]
+        records[f'WHO_history_weekly_countries_reported_{kind}'] = sorted(countries[kind], key=lambda i: (i['country'], i['date']))
+    return records
+
+## CDC: the downloads behind the activity-levels and NWSS tables
+@adapter(CDC_ACTIVITY_LEVELS_CSV, ['arv_trends', 'cc_cov_trends'])
+def read_cdc_activity_levels(source):
+    arv_trends, cc_cov_trends = [], []
+    reader = stream_csv(source)
+    header = reader.fieldnames or []
+    covid, flu, rsv = column(header, 'covid'), column(header, 'influenza'), column(header, 'rsv')
+    for row in reader:
+        date = cdc_date(row[header[0]])
+        arv_trends.append({
+            'date': date,
+            'virus_type': 'all respiratory viruses',
+            'COVID-19_percent_of_tests_positive': float(row[covid]),
+            'Influenza_percent_of_tests_positive': float(row[flu]),
+            'RSV_percent_of_tests_positive': float(row[rsv])
+        })
+        cc_cov_trends.append({'date': date, 'virus_type': 'COVID-19', 'COVID-19_percent_of_tests_positive': float(row[covid])})
+    # newest first, as on the page
+    arv_trends.sort(key=lambda i: i['date'], reverse=True)
+    cc_cov_trends.sort(key=lambda i: i['date'], reverse=True)
+    return {'arv_trends': arv_trends, 'cc_cov_trends': cc_cov_trends}
+
+@adapter(CDC_WW_TRENDS_CSV, ['ww_cov_trends'])
+def read_cdc_wastewater_trends(source):
+    reader = stream_csv(source)
+    header = reader.fieldnames or []
+    try:
+        value = column(header, 'national')
+    except KeyError:
+        value = header[1]
+    records = [
+        {'date': cdc_date(row[header[0]]), 'virus_type': 'COVID-19', 'COVID-19_NWSS_wastewater_viral_activity_levels': float(row[value])}
+        for row in reader if row[value].strip()
+    ]
+    return {'ww_cov_trends': sorted(records, key=lambda i: i['date'], reverse=True)}
+
+@adapter(CDC_WW_VARIANTS_CSV, ['ww_cov_variants'])
+def read_cdc_wastewater_variants(source):
+    reader = stream_csv(source)
+    header = reader.fieldnames or []
+    records = []
+    for row in reader:
+        records.append({
+            'date': cdc_date(row[header[0]]),
+            'virus_type': 'COVID-19',
+            'percentage': ';'.join(f"{voc}:{share(row[voc]):.2f}" for voc in header[1:] if row[voc].strip() not in ('', 'N/A'))
+        })
+    return {'ww_cov_variants': sorted(records, key=lambda i: i['date'], reverse=True)}
+
+def check(fixtures=SOURCE_ADAPTER_FIXTURES, record=False):
+    """Run every adapter on its recorded download and compare with the recorded records; returns the adapters that differ."""
+    failed = []
+    for item in ADAPTERS:
+        records = item.read(os.path.join(fixtures, f'{item.name}.csv'))
+        expected_path = os.path.join(fixtures, f'{item.name}.json')
+        if record:
+            with open(expected_path, 'w') as f:
+                json.dump(records, f, ensure_ascii=False, indent=4)
+            logger.info(f"Recorded {item.name}: {', '.join(f'{k} ({len(v)})' for k, v in records.items())}")
+            continue
+        with open(expected_path) as f:
+            expected = json.load(f)
+        if records != expected:
+            failed.append(item.name)
+            logger.error(f"{item.name} differs from {expected_path}")
+        else:
+            logger.info(f"{item.name} matches {expected_path}")
+    return failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the source adapters against recorded downloads')
+    parser.add_argument('--fixtures', default=SOURCE_ADAPTER_FIXTURES)
+    parser.add_argument('--record', action='store_true', help='write the expected records from the current adapters')
+    args = parser.parse_args()
+    raise SystemExit(1 if check(args.fixtures, args.record) else 0)
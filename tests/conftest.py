@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import importlib.util
+
+# caches, ledgers and stores of the modules under test live in a scratch directory,
+# set before anything reads its configuration at import
+SCRATCH = tempfile.mkdtemp(prefix='epi_crawl_tests_')
+os.environ.update({
+    'FIRECRAWL_API_KEY': 'test',
+    'FIRECRAWL_MODE': 'live',
+    'FIRECRAWL_LEDGER': os.path.join(SCRATCH, 'ledger.sqlite3'),
+    'FIRECRAWL_REQUESTS_PER_MINUTE': '600',
+    'FIRECRAWL_FIXTURES': os.path.join(SCRATCH, 'firecrawl'),
+    'FETCH_TIERS_PATH': os.path.join(SCRATCH, 'fetch_tiers.json'),
+    'HTML_CACHE_DIR': os.path.join(SCRATCH, 'html'),
+    'SNAPSHOT_DIR': os.path.join(SCRATCH, 'snapshots'),
+    'PARQUET_DIR': os.path.join(SCRATCH, 'parquet'),
+    'HISTORY_INDEX_DB': os.path.join(SCRATCH, 'history_index.sqlite3'),
+    'SCHEDULER_STATE': os.path.join(SCRATCH, 'scheduler.json'),
+    'METRICS_SPANS': '',
+    'METRICS_TEXTFILE': '',
+    'POLL_MIN_SEC': '0.1',
+    'SOURCE_ADAPTERS': '',
+    'EXTRACT_WORKERS': '0'
+})
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'tests', 'fixtures')
+sys.path.insert(0, ROOT)
+
+# CDC pages of epi-crawl.py, one small table each
+CDC_PAGES = {
+    'https://www.cdc.gov/respiratory-viruses/data/activity-levels.html': 'activity-levels.html',
+    'https://covid.cdc.gov/covid-data-tracker/#variant-proportions': 'variant-proportions.html',
+    'https://www.cdc.gov/nwss/rv/COVID19-nationaltrend.html': 'COVID19-nationaltrend.html',
+    'https://www.cdc.gov/nwss/rv/COVID19-variants.html': 'COVID19-variants.html'
+}
+
+def cdc_pages():
+    pages = {}
+    for url, name in CDC_PAGES.items():
+        with open(os.path.join(FIXTURES, 'pages', name), encoding='utf-8') as f:
+            pages[url] = f.read()
+    return pages
+
+def load_script(name):
+    """A top-level script whose file name is not a module name, such as epi-crawl.py."""
+    # registered under its file name, the name the extraction workers import it by
+    module = sys.modules.get(name)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, f'{name}.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,52 @@
+import json
+import asyncio
+import pytest
+from mcp.shared.memory import create_connected_server_and_client_session
+from utils import crawl_many
+from conftest import load_script
+
+class Crawler:
+    crawled = []
+    def __init__(self, url):
+        self.url = url
+    async def fetch_async(self):
+        Crawler.crawled.append(self.url)
+        return f'<p>{self.url}</p>'
+
+def crawl(**kwargs):
+    async def main():
+        return [result async for result in crawl_many(['https://example.org/a', 'https://example.org/b'], crawler=Crawler, **kwargs)]
+    return asyncio.run(main())
+
+def test_results_in_the_requested_formats():
+    results = crawl(max_concurrency=2, formats=['text'])
+    assert sorted(i['text'] for i in results) == ['https://example.org/a', 'https://example.org/b']
+
+@pytest.mark.parametrize('kwargs', [{'max_concurrency': 0}, {'formats': ['markdown']}])
+def test_bad_arguments_fail_before_crawling(kwargs):
+    Crawler.crawled.clear()
+    with pytest.raises(ValueError):
+        crawl(**kwargs)
+    assert not Crawler.crawled
+
+def test_the_mcp_tool_streams_each_result_as_progress(monkeypatch):
+    epi_crawl = load_script('epi-crawl')
+    async def crawl_pages(urls, max_concurrency, formats, crawler):
+        for url in urls:
+            yield {'url': url, 'ok': True, 'formats': formats}
+    monkeypatch.setattr(epi_crawl, 'crawl_pages', crawl_pages)
+
+    async def call():
+        progress = []
+        async def on_progress(progress_value, total, message):
+            progress.append((progress_value, total, json.loads(message)))
+        async with create_connected_server_and_client_session(epi_crawl.mcp._mcp_server) as client:
+            tools = {tool.name: tool for tool in (await client.list_tools()).tools}
+            result = await client.call_tool('crawl_many', {'urls': ['https://example.org/a', 'https://example.org/b']}, progress_callback=on_progress)
+        return tools, result, progress
+
+    tools, result, progress = asyncio.run(call())
+    # the context is injected, not a parameter of the tool
+    assert 'ctx' not in tools['crawl_many'].inputSchema['properties']
+    assert not result.isError
+    assert progress == [(1, 2, {'url': 'https://example.org/a', 'ok': True, 'formats': ['text']}), (2, 2, {'url': 'https://example.org/b', 'ok': True, 'formats': ['text']})]
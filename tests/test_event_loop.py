@@ -0,0 +1,34 @@
+import os
+import asyncio
+from conftest import cdc_pages, load_script
+from firecrawl_emulator import FirecrawlEmulator
+from utils import EventLoopStallMonitor, FETCH_TIERS, HTTP_POOL
+
+# longest the loop may be blocked during a crawl; a synchronous parse or disk write on it takes longer
+STALL_THRESHOLD = 0.2
+PORT = 8931
+
+def test_crawl_does_not_stall_event_loop(monkeypatch):
+    epi_crawl = load_script('epi-crawl')
+    pages = cdc_pages()
+    monkeypatch.setenv('FIRECRAWL_ENDPOINT', f'http://127.0.0.1:{PORT}/v1/crawl')
+    monkeypatch.setattr(epi_crawl, 'save_us_epidata', lambda epi_us, epi_us_recent: None)
+    # the pages are not on the network: every one goes through the emulated FireCrawl
+    for url in pages:
+        FETCH_TIERS.record(url, 'firecrawl')
+    emulator = FirecrawlEmulator(pages, render_sec=0.3, slow_rate=0, seed=1)
+
+    async def crawl():
+        runner = await emulator.start('127.0.0.1', PORT)
+        try:
+            async with EventLoopStallMonitor(threshold=STALL_THRESHOLD, interval=0.01) as monitor:
+                epi_us, _ = await epi_crawl.crawl_us_epidata()
+        finally:
+            await runner.cleanup()
+            await HTTP_POOL.aclose()
+        return epi_us, monitor
+
+    epi_us, monitor = asyncio.run(crawl())
+    assert epi_us['wastewater_cov']['trends'] and epi_us['clinical_cov']['variants']
+    assert emulator.stats['pages'] == len(pages)
+    assert monitor.max_stall < STALL_THRESHOLD, f"event loop blocked for {monitor.max_stall:.3f} seconds"
@@ -0,0 +1,33 @@
+import sys
+import subprocess
+import pytest
+from datetime import datetime, timezone
+from extraction import Dataset, register, extract_html, page_containers
+from conftest import ROOT
+
+PAGE = 'https://example.org/extraction'
+HTML = '<html><body><p class="value">12</p><div id="table"><span>3</span></div></body></html>'
+
+def test_parse_without_containers_reads_the_whole_page():
+    def parse_values(index, time_now):
+        return [{'value': int(i.text)} for i in index.find_all('p', {'class': 'value'})]
+    register(PAGE, [
+        Dataset('spans', ('div', {'id': 'table'}), rows=('span', {}), fields={'value': lambda i: int(i.text)}),
+        Dataset('values', parse=parse_values)
+    ])
+    assert page_containers(PAGE) is None
+    records = extract_html(PAGE, HTML, datetime.now(timezone.utc))
+    assert records == {'spans': [{'value': 3}], 'values': [{'value': 12}]}
+
+def test_dataset_without_container_or_parse_is_rejected():
+    with pytest.raises(ValueError, match='container or a parse function'):
+        Dataset('empty', fields={'value': lambda i: i.text})
+
+def test_workers_register_the_source_pages_without_the_crawler_imports():
+    # what a spawned ExtractPool worker loads for US_SOURCE and WHO_SOURCE
+    script = (
+        "import sys, extraction, us_pages, who_pages; "
+        "print(len(extraction.REGISTRY), sorted(m for m in ('mcp', 'pymongo', 'html_cache', 'snapshot_store') if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, check=True).stdout.split(' ', 1)
+    assert int(output[0]) == 11 and output[1].strip() == '[]'
@@ -0,0 +1,90 @@
+import asyncio
+from datetime import datetime, timezone
+from aiohttp import web
+import extraction
+from extraction import Dataset, register, validates, forget_validated, EXTRACT_POOL
+from utils import FETCH_TIERS, HTTP_POOL, fetch_pages
+
+PORT = 8932
+FAILING = f'http://127.0.0.1:{PORT}/failing.html'
+STATIC = f'http://127.0.0.1:{PORT}/static.html'
+SHELL = f'http://127.0.0.1:{PORT}/shell.html'
+TABLE = '<html><body><div class="table-container"><table><tr><td>2025-03-29</td><td>2.46</td></tr></table></div></body></html>'
+# what a script-rendered page looks like before the browser runs it
+SHELL_HTML = '<html><body><div id="root"></div><script src="app.js"></script></body></html>'
+
+for page in (STATIC, SHELL, FAILING):
+    register(page, [Dataset('trends', ('div', {'class': 'table-container'}), rows=('tr', {}), fields={'date': lambda i: i.find_all('td')[0].text})])
+
+class RenderingCrawler:
+    """FireCrawl standing in for the rendering tier: every page it gets comes back with its table."""
+    rendered = []
+    def __init__(self, url):
+        self.url = url
+    async def fetch_async(self):
+        RenderingCrawler.rendered.append(self.url)
+        return TABLE
+
+async def static(request):
+    return web.Response(text=TABLE, content_type='text/html')
+
+async def shell(request):
+    return web.Response(text=SHELL_HTML, content_type='text/html')
+
+async def serve():
+    app = web.Application()
+    app.router.add_get('/static.html', static)
+    app.router.add_get('/shell.html', shell)
+    app.router.add_get('/failing.html', shell)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', PORT).start()
+    return runner
+
+def test_static_page_is_fetched_directly_and_shell_page_is_rendered(monkeypatch):
+    extracted = []
+    extract_html = extraction.extract_html
+    monkeypatch.setattr(extraction, 'extract_html', lambda *args, **kwargs: extracted.append(args[0]) or extract_html(*args, **kwargs))
+    RenderingCrawler.rendered.clear()
+
+    async def crawl():
+        runner = await serve()
+        try:
+            pages = {url: html async for url, html in fetch_pages([STATIC, SHELL], crawler=RenderingCrawler, batch=False, validate=validates)}
+            records = {url: await EXTRACT_POOL.extract('extraction', url, html, datetime.now(timezone.utc)) for url, html in pages.items()}
+        finally:
+            await runner.cleanup()
+            await HTTP_POOL.aclose()
+        return pages, records
+
+    pages, records = asyncio.run(crawl())
+    assert RenderingCrawler.rendered == [SHELL]
+    assert FETCH_TIERS.tiers()[STATIC]['tier'] == 'direct' and FETCH_TIERS.tiers()[SHELL]['tier'] == 'firecrawl'
+    assert records[STATIC] == records[SHELL] == {'trends': [{'date': '2025-03-29'}]}
+    # the static page's validation records are reused; the shell page failed validation and is extracted once rendered
+    assert sorted(extracted) == sorted([STATIC, SHELL, SHELL])
+
+class FailingCrawler(RenderingCrawler):
+    async def fetch_async(self):
+        raise RuntimeError('FireCrawl job failed')
+
+def test_firecrawl_tier_is_recorded_only_once_firecrawl_delivers():
+    async def crawl(crawler):
+        runner = await serve()
+        try:
+            return [url async for url, html in fetch_pages([FAILING, STATIC], crawler=crawler, batch=False, validate=validates)]
+        except RuntimeError:
+            return None
+        finally:
+            await runner.cleanup()
+            await HTTP_POOL.aclose()
+
+    assert asyncio.run(crawl(FailingCrawler)) is None
+    assert FAILING not in FETCH_TIERS.tiers()
+    assert asyncio.run(crawl(RenderingCrawler)) == [STATIC, FAILING]
+    assert FETCH_TIERS.tiers()[FAILING]['tier'] == 'firecrawl'
+
+    # STATIC was validated twice and never extracted: the end of the run drops its records
+    assert any(page == STATIC for page, _ in extraction.VALIDATED)
+    forget_validated([FAILING, STATIC])
+    assert not any(page in (FAILING, STATIC) for page, _ in extraction.VALIDATED)
@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+from firecrawl_emulator import FirecrawlEmulator
+from utils import FireCrawl, HTTP_POOL
+
+PORT = 8935
+URLS = [f'https://example.org/page-{i}' for i in range(7)]
+
+class RecordingEmulator(FirecrawlEmulator):
+    """The emulator, keeping the URLs of every batch submitted to it."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = []
+    async def post_batch(self, request):
+        self.batches.append((await request.json())['urls'])
+        return await super().post_batch(request)
+
+def batch(emulator, urls):
+    """Run one batch job against `emulator`; returns the pages yielded and the error raised, if any."""
+    pages, error = [], None
+    async def main():
+        nonlocal error
+        runner = await emulator.start('127.0.0.1', PORT)
+        try:
+            async for url, html in FireCrawl.batch_async(urls):
+                pages.append((url, html))
+        except Exception as e:
+            error = e
+        finally:
+            await runner.cleanup()
+            await HTTP_POOL.aclose()
+    asyncio.run(main())
+    return pages, error
+
+@pytest.fixture(autouse=True)
+def endpoint(monkeypatch):
+    monkeypatch.setenv('FIRECRAWL_ENDPOINT', f'http://127.0.0.1:{PORT}/v1/crawl')
+
+def test_a_batch_is_read_through_every_next_page():
+    emulator = RecordingEmulator({url: f'<html>{url}</html>' for url in URLS}, render_sec=0.1, slow_rate=0, batch_page_size=3, seed=1)
+    pages, error = batch(emulator, URLS)
+    assert error is None
+    # every status answer holds 3 pages, the other 4 are only reachable through `next`
+    assert sorted(pages) == sorted((url, f'<html>{url}</html>') for url in URLS)
+
+def test_duplicate_urls_are_submitted_and_yielded_once():
+    emulator = RecordingEmulator({}, render_sec=0.1, slow_rate=0, seed=1)
+    pages, error = batch(emulator, URLS[:3] + URLS[:2])
+    assert error is None
+    assert emulator.batches == [URLS[:3]]
+    assert sorted(url for url, _ in pages) == URLS[:3]
+
+def test_a_batch_with_failed_pages_yields_the_rest_then_names_the_missing_ones():
+    emulator = RecordingEmulator({}, render_sec=0.1, slow_rate=0, failure_rate=0.5, batch_page_size=2, seed=3)
+    pages, error = batch(emulator, URLS)
+    failed = sorted(i['url'] for job in emulator.jobs.values() for i in job['pages'] if i['failed'])
+    assert failed and len(failed) < len(URLS)
+    assert sorted(url for url, _ in pages) == sorted(set(URLS) - set(failed))
+    assert str(error) == f"batch job completed; no html for {failed}"
@@ -0,0 +1,56 @@
+import os
+import json
+import asyncio
+import threading
+from datetime import datetime, timezone
+from conftest import ROOT, FIXTURES, load_script
+from extraction import extract_html
+from history_index import HistoryIndex
+
+WHO_RUN = '2025-05-15-05-59-21'
+REALTIME_VARIANTS = 'WHO_realtime_28d_variants_prevalence'
+
+def who_run():
+    with open(os.path.join(ROOT, 'history', f'covid19_WHO_{WHO_RUN}.json')) as f:
+        return json.load(f)
+
+def test_latest_is_the_whole_mix_of_the_latest_run(tmp_path):
+    index = HistoryIndex(str(tmp_path / 'index.sqlite3'))
+    data = who_run()
+    index.index_run(data, WHO_RUN)
+    # rows of this run carry per-row extraction times, microseconds apart
+    assert {i['variant'] for i in index.latest(REALTIME_VARIANTS)} == {i['variant'] for i in data[REALTIME_VARIANTS]}
+
+    later = [{'date': '2025-05-22 06:00:00+00:00', 'variant': variant, 'prevalence': 50.0, 'change': '+0'} for variant in ('LP.8.1', 'NB.1.8.1')]
+    index.index_run({REALTIME_VARIANTS: later}, '2025-05-22-06-00-00')
+    assert index.latest(REALTIME_VARIANTS) == later
+    # a history series still answers its last date only
+    world = index.latest('WHO_weekly_positivity_rate_world_history')
+    assert len({i['date'] for i in world}) == 1
+    assert world[0]['date'] == max(i['date'] for i in data['WHO_weekly_positivity_rate_world_history'])
+    index.close()
+
+def test_realtime_rows_are_stamped_with_the_run_time():
+    who = load_script('getdata_covid19_who')
+    with open(os.path.join(FIXTURES, 'pages', 'who-circulation.html'), encoding='utf-8') as f:
+        html = f.read()
+    time_now = datetime(2025, 5, 15, 6, 2, 53, 425220, tzinfo=timezone.utc)
+    records = extract_html(who.WHO_URL_LIST[1], html, time_now)
+    for dataset in (REALTIME_VARIANTS, 'WHO_realtime_7d_countries_positivity_rate', 'WHO_realtime_28d_GISAID_variants_submitted'):
+        assert records[dataset] and {i['date'] for i in records[dataset]} == {str(time_now)}
+
+def test_history_tools_query_off_the_loop_and_limit_series(tmp_path, monkeypatch):
+    epi_crawl = load_script('epi-crawl')
+    index = HistoryIndex(str(tmp_path / 'index.sqlite3'))
+    index.index_run(who_run(), WHO_RUN)
+    threads = []
+    series = index.series
+    monkeypatch.setattr(index, 'series', lambda *args: threads.append(threading.current_thread()) or series(*args))
+    monkeypatch.setattr(epi_crawl, 'HISTORY_INDEX', index)
+
+    dataset = 'WHO_history_weekly_countries_reported_cases'
+    records = asyncio.run(epi_crawl.query_history_series(dataset, limit=5))
+    assert records == index.series(dataset)[:5]
+    assert threads[0] is not threading.main_thread()
+    assert len(index.series(dataset)) > 5
+    index.close()
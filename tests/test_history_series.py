@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta, timezone
+import mongomock
+import pytest
+from pymongo import DeleteMany, InsertOne
+from conftest import load_script
+
+COLLECTION = 'WHO_history_weekly_countries_reported_cases'
+
+def week(n):
+    return datetime(2025, 1, 5, tzinfo=timezone.utc) + timedelta(weeks=n)
+
+def point(n, country='FR', cases=100):
+    return {'date': week(n), 'country': country, 'cases': cases + n}
+
+def stored(db):
+    return sorted((i['country'], i['date'].replace(tzinfo=timezone.utc), i['cases']) for i in db[COLLECTION].find())
+
+@pytest.fixture
+def who():
+    return load_script('getdata_covid19_who')
+
+class Collection:
+    """A mongomock collection whose bulk_write takes the request objects of the installed pymongo."""
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            if isinstance(request, InsertOne):
+                self.collection.insert_one(request._doc)
+            elif isinstance(request, DeleteMany):
+                self.collection.delete_many(request._filter)
+            else:
+                self.collection.update_one(request._filter, request._doc, upsert=request._upsert)
+
+class Database:
+    def __init__(self):
+        self.db = mongomock.MongoClient(tz_aware=True)['covid19_WHO']
+
+    def __getitem__(self, name):
+        return Collection(self.db[name])
+
+@pytest.fixture
+def db():
+    return Database()
+
+def test_only_new_and_revised_points_are_written(who, db):
+    assert who.save_history_series(db, COLLECTION, [point(0), point(1), point(0, 'DE')]) == (3, 0)
+    # a rerun with the same data writes nothing
+    assert who.save_history_series(db, COLLECTION, [point(0), point(1), point(0, 'DE')]) == (0, 0)
+    # WHO revised week 1 of FR and published week 2
+    assert who.save_history_series(db, COLLECTION, [point(0), point(1, cases=500), point(2), point(0, 'DE')]) == (1, 1)
+    assert stored(db) == [('DE', week(0), 100), ('FR', week(0), 100), ('FR', week(1), 501), ('FR', week(2), 102)]
+
+def test_a_collection_without_watermarks_is_rewritten_once(who, db):
+    # every earlier run inserted its own copy of each point
+    db[COLLECTION].insert_many([point(0), point(0), point(1), point(1)])
+    assert who.save_history_series(db, COLLECTION, [point(0), point(1)]) == (0, 2)
+    assert stored(db) == [('FR', week(0), 100), ('FR', week(1), 101)]
+    assert who.save_history_series(db, COLLECTION, [point(0), point(1)]) == (0, 0)
+
+def test_digests_are_kept_for_the_revision_window_only(who, db, monkeypatch):
+    monkeypatch.setattr(who, 'WHO_REVISION_DAYS', 14)
+    who.save_history_series(db, COLLECTION, [point(n) for n in range(3)])
+    who.save_history_series(db, COLLECTION, [point(n) for n in range(6)])
+    watermark = db['watermarks'].find_one({'collection': COLLECTION, 'series': 'FR'})
+    assert sorted(watermark['points']) == [week(n).strftime('%Y%m%dT%H%M%S') for n in (3, 4, 5)]
+    assert watermark['date'].replace(tzinfo=timezone.utc) == week(5)
+    # a revision older than the window is not compared, nor written again
+    assert who.save_history_series(db, COLLECTION, [point(0, cases=900)] + [point(n) for n in range(1, 6)]) == (0, 0)
+    assert len(stored(db)) == 6
+
+def test_history_writes_need_mongodb_7(who, monkeypatch):
+    monkeypatch.setattr(who.MONGO_STORE, 'server_version', lambda: (6, 0))
+    monkeypatch.setattr(who.MONGO_STORE, 'client', lambda: pytest.fail('wrote to MongoDB 6'))
+    with pytest.raises(RuntimeError, match='MongoDB 7.0'):
+        who.save_to_mongodb({COLLECTION: [point(0)]}, '2025-05-15-06-00-00')
@@ -0,0 +1,74 @@
+import os
+import time
+import pytest
+from datetime import datetime, timezone
+from html_cache import HtmlCache
+import extraction
+
+def cache(tmp_path):
+    return HtmlCache(str(tmp_path / 'html'), no_probe=['example.org'])
+
+def test_reused_records_carry_the_reusing_run_time(tmp_path):
+    html_cache = cache(tmp_path)
+    html = '<table><tr><td>LP.8.1</td></tr></table>'
+    first, second = datetime(2025, 5, 15, 6, tzinfo=timezone.utc), datetime(2025, 5, 22, 6, tzinfo=timezone.utc)
+    records = {
+        'realtime': [{'date': str(first), 'variant': 'LP.8.1'}],
+        'history': [{'date': '2025-05-11 00:00:00+00:00', 'variant': 'LP.8.1'}]
+    }
+    html_cache.store_records('https://example.org/variants', html, extraction, records, first)
+
+    reused = html_cache.records('https://example.org/variants', html, extraction, second)
+    assert reused['realtime'] == [{'date': str(second), 'variant': 'LP.8.1'}]
+    assert reused['history'] == records['history']
+
+def test_a_blob_shared_by_another_url_is_kept(tmp_path):
+    html_cache = cache(tmp_path)
+    html_cache.store('https://example.org/a', '<p>same</p>')
+    content_hash = html_cache.store('https://example.org/b', '<p>same</p>')
+    html_cache.store('https://example.org/a', '<p>changed</p>')
+    assert os.path.exists(os.path.join(html_cache.root, 'blobs', f'{content_hash}.html'))
+    assert html_cache.lookup('https://example.org/b') == '<p>same</p>'
+
+    html_cache.store('https://example.org/b', '<p>changed too</p>')
+    assert not os.path.exists(os.path.join(html_cache.root, 'blobs', f'{content_hash}.html'))
+
+def test_script_shells_are_rescraped_without_probing(tmp_path, monkeypatch):
+    # the default HTML_CACHE_NO_PROBE: a shell's validators do not change with its data
+    html_cache = HtmlCache(str(tmp_path / 'html'), ttl=0)
+    monkeypatch.setattr(html_cache, '_validators', lambda *args: pytest.fail('probed a script shell'))
+    for url in ('https://data.who.int/dashboards/covid19/cases', 'https://covid.cdc.gov/covid-data-tracker/#variant-proportions'):
+        html_cache.store(url, '<div id="root"></div>')
+        assert html_cache.lookup(url) is None
+
+def test_validators_come_from_the_probe_not_from_store(tmp_path, monkeypatch):
+    html_cache = HtmlCache(str(tmp_path / 'html'), ttl=0, no_probe=[])
+    heads = []
+    def validators(url, entry=None):
+        heads.append(dict(entry or {}).get('etag'))
+        return (304 if entry and entry.get('etag') == '"v1"' else 200), {'etag': '"v1"', 'last_modified': None}
+    monkeypatch.setattr(html_cache, '_validators', validators)
+    url = 'https://example.org/data.html'
+    html_cache.store(url, '<p>data</p>')
+    assert heads == []
+    # no validators yet: the expired page is re-scraped and stored with those of the probe
+    assert html_cache.lookup(url) is None
+    html_cache.store(url, '<p>data</p>')
+    assert html_cache.lookup(url) == '<p>data</p>'
+    assert heads == [None, '"v1"']
+
+def test_eviction_removes_the_records_of_evicted_entries_only(tmp_path):
+    html_cache = HtmlCache(str(tmp_path / 'html'), no_probe=[])
+    time_now = datetime.now(timezone.utc)
+    for i in range(3):
+        html_cache.store(f'https://example.org/{i}', f'<p>{i}</p>')
+        html_cache.store_records(f'https://example.org/{i}', f'<p>{i}</p>', extraction, {'d': [{'i': i}]}, time_now)
+        time.sleep(0.01)
+    html_cache.lookup('https://example.org/0')
+    records = os.path.join(html_cache.root, 'records')
+    # one byte too many: the least recently used entry goes
+    html_cache.max_bytes = sum(os.path.getsize(os.path.join(records, i)) for i in os.listdir(records)) + 3 * len('<p>0</p>') - 1
+    html_cache.evict()
+    assert len(os.listdir(records)) == 2
+    assert html_cache.records('https://example.org/1', '<p>1</p>', extraction, time_now) is None
+    assert html_cache.records('https://example.org/0', '<p>0</p>', extraction, time_now) == {'d': [{'i': 0}]}
@@ -0,0 +1,25 @@
+import asyncio
+import sqlite3
+from conftest import cdc_pages
+from firecrawl_emulator import FirecrawlEmulator, load_test
+from rate_ledger import RATE_LEDGER, ledger_key
+from utils import POLLER
+
+PORT = 8933
+
+def test_each_concurrency_starts_afresh(monkeypatch):
+    monkeypatch.setenv('FIRECRAWL_ENDPOINT', f'http://127.0.0.1:{PORT}/v1/crawl')
+    pages = cdc_pages()
+    urls = list(pages)[:2]
+    emulator = FirecrawlEmulator(pages, render_sec=0.2, slow_rate=0, seed=1)
+    learned = []
+    schedule = POLLER.schedule
+    monkeypatch.setattr(POLLER, 'schedule', lambda *args: learned.append(sum(map(len, POLLER.completions.values()))) or schedule(*args))
+
+    rows = asyncio.run(load_test(emulator, urls, [1, 2], 600, port=PORT))
+    assert [row['pages'] for row in rows] == [2, 2]
+    # the second run polls without the first run's completion times
+    assert learned[len(urls)] == 0
+    with sqlite3.connect(RATE_LEDGER.path) as conn:
+        keys = {i[0] for i in conn.execute('SELECT key FROM buckets')}
+    assert {ledger_key('test-1'), ledger_key('test-2')} <= keys
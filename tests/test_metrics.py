@@ -0,0 +1,51 @@
+import os
+import json
+import asyncio
+from datetime import datetime, timezone
+from extraction import ExtractPool
+from metrics import METRICS, Metrics
+from conftest import FIXTURES, load_script
+
+def test_worker_spans_join_the_submitting_trace(tmp_path, monkeypatch):
+    who = load_script('getdata_covid19_who')
+    url = who.WHO_URL_LIST[2]
+    with open(os.path.join(FIXTURES, 'pages', 'who-cases.html'), encoding='utf-8') as f:
+        html = f.read()
+    monkeypatch.setattr(METRICS, 'spans_path', str(tmp_path / 'spans.jsonl'))
+    METRICS.report('before')
+    pool = ExtractPool(2)
+    try:
+        with METRICS.span('extract', url=url):
+            submitted = pool.submit('who_pages', url, html, datetime.now(timezone.utc)).result()
+        async def extract():
+            with METRICS.span('extract', url=url):
+                return await pool.extract('who_pages', url, html, datetime.now(timezone.utc))
+        awaited = asyncio.run(extract())
+    finally:
+        pool.shutdown()
+    assert submitted.keys() == awaited.keys() and all(submitted.values())
+
+    METRICS.flush()
+    with open(tmp_path / 'spans.jsonl', encoding='utf-8') as f:
+        spans = [json.loads(line) for line in f]
+    extracts = [i for i in spans if i['name'] == 'extract']
+    parses = [i for i in spans if i['name'] == 'parse']
+    assert len(extracts) == len(parses) == 2
+    for extract, parse in zip(extracts, parses):
+        assert (parse['trace_id'], parse['parent_span_id']) == (extract['trace_id'], extract['span_id'])
+    # datasets are extracted after the parse, beside it
+    datasets = [i for i in spans if i['name'] == 'extract.dataset']
+    assert datasets and all(i['parent_span_id'] in {j['span_id'] for j in extracts} for i in datasets)
+    assert 'parse' in METRICS.summary()
+    assert any(labels == (('site', 'data.who.int'), ('stage', 'parse')) for name, labels in METRICS.histograms if name == 'stage_seconds')
+
+def test_spans_file_is_rotated_when_full(tmp_path):
+    metrics = Metrics(textfile='', spans_path=str(tmp_path / 'spans.jsonl'), spans_max_bytes=1)
+    for stage in ('first', 'second'):
+        with metrics.span(stage):
+            pass
+        metrics.flush()
+    with open(tmp_path / 'spans.jsonl.1', encoding='utf-8') as f:
+        assert json.loads(f.read())['name'] == 'first'
+    with open(tmp_path / 'spans.jsonl', encoding='utf-8') as f:
+        assert json.loads(f.read())['name'] == 'second'
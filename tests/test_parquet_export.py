@@ -0,0 +1,43 @@
+import json
+import math
+import pandas as pd
+from parquet_export import ParquetExport, to_number
+
+def test_dashboard_strings_become_numbers():
+    values = to_number(pd.Series(['14.8k', '1,234', '2.1M', '7', ' 3.5K ', 'No data', '', 'N/A']))
+    assert values.tolist()[:5] == [14800.0, 1234.0, 2100000.0, 7.0, 3500.0]
+    assert all(math.isnan(i) for i in values.tolist()[5:])
+
+def state(directory):
+    with open(directory / '_state.json') as f:
+        return json.load(f)
+
+def weekly(*rows):
+    return [{'date': date, 'country': country, 'cases': cases} for date, country, cases in rows]
+
+def test_only_rows_past_their_own_series_watermark_are_appended(tmp_path):
+    export = ParquetExport(str(tmp_path))
+    name = 'WHO_history_weekly_countries_reported_cases'
+    assert export.export_dataset(name, weekly(('2025-01-05', 'China', '10'), ('2025-01-12', 'France', '20')), '2025-01-13-06-00-00') == 2
+    # France is already at 01-12, so its 01-05 row is old; China's 01-12 row is new even though it is older than France's watermark
+    rows = weekly(('2025-01-05', 'China', '10'), ('2025-01-12', 'China', '11'), ('2025-01-05', 'France', '19'), ('2025-01-12', 'France', '20'))
+    assert export.export_dataset(name, rows, '2025-01-14-06-00-00') == 1
+
+    assert state(tmp_path / name)['watermarks'] == {'China': '2025-01-12T00:00:00+00:00', 'France': '2025-01-12T00:00:00+00:00'}
+    frame = pd.read_parquet(tmp_path / name).sort_values(['country', 'date'])
+    assert list(zip(frame['country'], frame['cases'])) == [('China', 10.0), ('China', 11.0), ('France', 20.0)]
+    assert export.export_dataset(name, rows, '2025-01-15-06-00-00') == 0
+
+def test_column_types_are_kept_from_the_first_export(tmp_path):
+    export = ParquetExport(str(tmp_path))
+    name = 'WHO_history_weekly_countries_reported_cases'
+    export.export_dataset(name, weekly(('2025-01-05', 'China', '14.8k'), ('2025-01-05', 'France', 'No data')), '2025-01-06-06-00-00')
+    dtypes = state(tmp_path / name)['dtypes']
+    assert dtypes == {'date': 'timestamp', 'country': 'string', 'cases': 'number'}
+
+    # on its own this run would infer 'cases' as a string column
+    export.export_dataset(name, weekly(('2025-01-12', 'China', 'No data')), '2025-01-13-06-00-00')
+    assert state(tmp_path / name)['dtypes'] == dtypes
+    frame = pd.read_parquet(tmp_path / name).sort_values(['date', 'country'])
+    assert str(frame['cases'].dtype) == 'float64'
+    assert frame['cases'].tolist()[0] == 14800.0 and frame['cases'].isna().tolist() == [False, True, True]
@@ -0,0 +1,78 @@
+import pytest
+import utils
+from utils import AdaptivePoller, FireCrawlTimeout
+
+URL = 'https://www.cdc.gov/nwss/rv/COVID19-variants.html'
+HOST = 'www.cdc.gov'
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+    def monotonic(self):
+        return self.now
+
+class Jitter:
+    """random.uniform at the middle of its range, or at one end."""
+    def __init__(self, at=0.5):
+        self.at = at
+    def uniform(self, low, high):
+        return low + (high - low) * self.at
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(utils, 'time', clock)
+    monkeypatch.setattr(utils, 'random', Jitter())
+    return clock
+
+def poller(completions=(), kind='crawl'):
+    poller = AdaptivePoller(min_interval=1, factor=2, deadline=300)
+    for seconds in completions:
+        poller.record((HOST, kind), seconds)
+    return poller
+
+def test_backoff_doubles_from_the_minimum_up_to_the_fixed_interval(clock):
+    schedule = poller().schedule(URL, 5)
+    delays = []
+    for _ in range(5):
+        delays.append(schedule.next_delay())
+        clock.now += delays[-1]
+    assert delays == [1, 2, 4, 5, 5]
+
+def test_jitter_stays_within_a_fifth_of_the_delay(clock, monkeypatch):
+    for at, expected in ((0, 0.8), (1, 1.2)):
+        monkeypatch.setattr(utils, 'random', Jitter(at))
+        assert poller().schedule(URL, 5).next_delay() == pytest.approx(expected)
+
+def test_first_poll_waits_for_the_fastest_recent_completions(clock):
+    schedule = poller(range(10, 101, 10)).schedule(URL, 30)
+    # the 10th percentile of 10, 20, ..., 100
+    assert schedule.next_delay() == 20
+    clock.now += 20
+    assert schedule.next_delay() == 2
+
+def test_a_job_slower_than_the_90th_percentile_polls_at_the_fixed_interval(clock):
+    schedule = poller([10] * 9 + [20]).schedule(URL, 30)
+    schedule.next_delay()
+    clock.now += 21
+    assert schedule.next_delay() == 30
+
+def test_the_deadline_caps_the_last_delay_and_then_times_out(clock):
+    schedule = poller().schedule(URL, 30)
+    delays = []
+    with pytest.raises(FireCrawlTimeout):
+        while True:
+            delays.append(schedule.next_delay())
+            clock.now += delays[-1]
+    # 1 + 2 + 4 + 8 + 16 + 8 * 30 = 271 seconds, then only 29 are left
+    assert delays[-1] == 29 and sum(delays) == 300
+
+def test_batch_completions_do_not_skew_single_page_estimates(clock):
+    adaptive = poller([200] * 10, kind='batch')
+    assert adaptive.schedule(URL, 30).next_delay() == 1
+    assert adaptive.schedule(URL, 30, 'batch').next_delay() == 200
+    # a completed single-page job is recorded with its kind
+    schedule = adaptive.schedule(URL, 30)
+    clock.now += 12
+    schedule.completed()
+    assert list(adaptive.completions[(HOST, 'crawl')]) == [12]
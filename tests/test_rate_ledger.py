@@ -0,0 +1,91 @@
+import time
+import asyncio
+import threading
+import pytest
+import httpx
+import rate_ledger
+from rate_ledger import RateLedger, RateLimitOpen, retry_after_of
+from firecrawl_emulator import FirecrawlEmulator
+from scheduler import Source
+from utils import FireCrawl, FireCrawlRateLimitExceeded, HTTP_POOL
+
+PORT = 8934
+
+def test_ledgers_sharing_a_file_share_one_bucket(tmp_path):
+    path = str(tmp_path / 'ledger.sqlite3')
+    first, second = RateLedger(path, requests_per_minute=2, headroom=1), RateLedger(path, requests_per_minute=2, headroom=1)
+    assert first.try_acquire('key') == 0 and second.try_acquire('key') == 0
+    # the bucket is empty for both; a token comes back every 30 seconds
+    assert 29 < first.try_acquire('key') <= 30
+    assert 29 < second.try_acquire('key') <= 30
+    assert first.try_acquire('other key') == 0
+
+def test_concurrent_acquires_never_hand_out_a_token_twice(tmp_path):
+    path = str(tmp_path / 'ledger.sqlite3')
+    ledgers = [RateLedger(path, requests_per_minute=5, headroom=1) for _ in range(2)]
+    waits = []
+    def take(ledger):
+        for _ in range(5):
+            waits.append(ledger.try_acquire('key'))
+    threads = [threading.Thread(target=take, args=(ledgers[i % 2],)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(waits) == 20 and waits.count(0) == 5
+
+def test_a_429_opens_the_breaker_and_consecutive_ones_double_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(rate_ledger, 'FIRECRAWL_BREAKER_SEC', 10)
+    monkeypatch.setattr(rate_ledger, 'FIRECRAWL_BREAKER_MAX_SEC', 30)
+    ledger = RateLedger(str(tmp_path / 'ledger.sqlite3'), requests_per_minute=60)
+    # each trip opens the breaker from now for the escalated time, or keeps a longer opening
+    assert ledger.trip('key') == pytest.approx(10, abs=0.5)
+    assert ledger.trip('key') == pytest.approx(20, abs=0.5)
+    assert ledger.trip('key') == pytest.approx(30, abs=0.5)
+    assert ledger.trip('key') == pytest.approx(30, abs=0.5)
+    with pytest.raises(RateLimitOpen) as e:
+        ledger.try_acquire('key')
+    assert e.value.retry_after == pytest.approx(30, abs=0.5)
+    assert ledger.status('key')['trips'] == 4
+    ledger.succeeded('key')
+    assert ledger.status('key')['trips'] == 0
+
+def test_a_retry_after_the_429_gives_is_used_as_is(tmp_path):
+    ledger = RateLedger(str(tmp_path / 'ledger.sqlite3'), requests_per_minute=60)
+    assert ledger.trip('key', 5) == pytest.approx(5, abs=0.5)
+    # a shorter one never closes the breaker early
+    assert ledger.trip('key', 1) == pytest.approx(5, abs=0.5)
+
+def test_retry_after_is_read_from_the_header_or_the_error_text():
+    def response(headers=None, error=''):
+        return httpx.Response(429, headers=headers or {}, json={'success': False, 'error': error})
+    assert retry_after_of(response({'Retry-After': '42'})) == 42
+    assert retry_after_of(response(error='Rate limit exceeded. ... please retry after 17s')) == 17
+    assert retry_after_of(response(error='Rate limit exceeded.')) is None
+    assert retry_after_of(None) is None
+
+def test_the_retry_after_of_a_429_reaches_the_scheduler(monkeypatch):
+    monkeypatch.setenv('FIRECRAWL_ENDPOINT', f'http://127.0.0.1:{PORT}/v1/crawl')
+    # a key of its own, so the breaker it opens stays in this test
+    monkeypatch.setenv('FIRECRAWL_API_KEY', 'test-breaker')
+    emulator = FirecrawlEmulator({}, render_sec=0.1, slow_rate=0, requests_per_minute=1, seed=1)
+    async def crawl():
+        for url in ('https://example.org/a', 'https://example.org/b'):
+            await FireCrawl(url).fetch_async()
+    source = Source('test', crawl, 3600, jitter=0)
+
+    async def main():
+        runner = await emulator.start('127.0.0.1', PORT)
+        try:
+            await source.tick()
+        finally:
+            await runner.cleanup()
+            await HTTP_POOL.aclose()
+    asyncio.run(main())
+
+    assert emulator.stats['rate_limited'] == 1 and source.state['failures'] == 1
+    # the emulator asks for the rest of its minute; the scheduler waits exactly that long
+    assert 55 < source.state['retry_at'] - time.time() <= 60
+    assert source.next_delay(time.time()) == pytest.approx(source.state['retry_at'] - time.time(), abs=0.5)
+    with pytest.raises(FireCrawlRateLimitExceeded):
+        asyncio.run(FireCrawl('https://example.org/c').fetch_async())
@@ -0,0 +1,15 @@
+from conftest import load_script
+from snapshot_store import SNAPSHOT_STORE
+
+def test_a_replay_saves_nothing(monkeypatch):
+    who = load_script('getdata_covid19_who')
+    epi = load_script('epi-crawl')
+    monkeypatch.setattr(who, 'FIRECRAWL_MODE', 'replay')
+    monkeypatch.setattr(epi, 'FIRECRAWL_MODE', 'replay')
+    data = {'realtime': [{'date': '2025-05-15 06:00:00+00:00', 'variant': 'LP.8.1'}]}
+
+    who.save_who_covid19({'variants': data}, '2025-05-15-06-00-00')
+    epi.save_us_epidata({'variants': data}, {})
+    # MongoDB is not running here, reaching it would raise
+    epi._update_db({'variants': data}, {})
+    assert SNAPSHOT_STORE.runs('covid19_WHO') == [] and SNAPSHOT_STORE.runs('data_us_history') == []
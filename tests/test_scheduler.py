@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+import scheduler
+from scheduler import Source, Scheduler
+
+class Clock:
+    def __init__(self):
+        self.now = 1_750_000_000.0
+    def time(self):
+        return self.now
+
+class Jitter:
+    """random.uniform at one end of its range, or in the middle."""
+    def __init__(self, at=0.5):
+        self.at = at
+    def uniform(self, low, high):
+        return low + (high - low) * self.at
+
+class Probe:
+    def __init__(self, changed):
+        self._changed = changed
+    async def changed(self, seen):
+        return self._changed
+    async def validators(self):
+        return {'https://example.org/data.csv': '"v1"'}
+
+class RateLimited(Exception):
+    retry_after = 42.0
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(scheduler, 'time', clock)
+    monkeypatch.setattr(scheduler, 'random', Jitter())
+    return clock
+
+def runner(error=None):
+    runs = []
+    async def run():
+        runs.append(1)
+        if error is not None:
+            raise error
+    return run, runs
+
+def test_failures_back_off_exponentially_up_to_the_cap(clock):
+    run, runs = runner(RuntimeError('crawl failed'))
+    source = Source('cdc', run, 3600, backoff_sec=10, max_backoff_sec=50)
+    delays = []
+    for _ in range(5):
+        asyncio.run(source.tick())
+        delays.append(source.next_delay(clock.now))
+    assert delays == [10, 20, 40, 50, 50]
+    assert len(runs) == 5 and source.state['failures'] == 5
+
+def test_jitter_bounds(clock, monkeypatch):
+    source = Source('cdc', runner()[0], 1000, jitter=0.1)
+    source.state['last_success'] = clock.now
+    for at, expected in ((0, 900), (1, 1100)):
+        monkeypatch.setattr(scheduler, 'random', Jitter(at))
+        assert source.next_delay(clock.now) == pytest.approx(expected)
+
+def test_a_rate_limited_failure_retries_when_the_breaker_closes(clock):
+    source = Source('who', runner(RateLimited('429'))[0], 3600, backoff_sec=600)
+    asyncio.run(source.tick())
+    assert source.state['retry_at'] == clock.now + 42
+    clock.now += 40
+    # exactly, without backoff or jitter
+    assert source.next_delay(clock.now) == 2
+
+def test_a_success_waits_for_the_cadence_and_probes_in_between(clock):
+    run, runs = runner()
+    source = Source('who', run, 7 * 86400, probe=Probe(None), probe_sec=6 * 3600)
+    assert source.next_delay(clock.now) == 0
+    asyncio.run(source.tick())
+    assert source.state['validators'] == {'https://example.org/data.csv': '"v1"'}
+    assert source.next_delay(clock.now) == 6 * 3600
+
+    # a probe that cannot tell (None) means no new data, as does False
+    for changed in (None, False):
+        source.probe = Probe(changed)
+        asyncio.run(source.tick())
+    assert len(runs) == 1 and source.state['skipped'] == 2 and source.state['probes'] == 2
+    source.probe = Probe(True)
+    asyncio.run(source.tick())
+    assert len(runs) == 2
+
+def test_state_survives_a_restart(clock, tmp_path):
+    path = str(tmp_path / 'scheduler.json')
+    failing = Source('who', runner(RateLimited('429'))[0], 3600)
+    succeeding = Source('cdc', runner()[0], 3600)
+    for source in (failing, succeeding):
+        asyncio.run(source.tick())
+    Scheduler([failing, succeeding], path).save_state()
+
+    restarted = [Source('who', runner()[0], 3600), Source('cdc', runner()[0], 3600)]
+    Scheduler(restarted, path).load_state()
+    assert [i.state for i in restarted] == [failing.state, succeeding.state]
+    clock.now += 10
+    # neither crawls again at once: one waits for the breaker, the other for its cadence
+    assert restarted[0].next_delay(clock.now) == 32
+    assert restarted[1].next_delay(clock.now) == 3590
@@ -0,0 +1,63 @@
+import os
+import json
+import pytest
+from snapshot_store import SnapshotStore, compress
+
+def run(i):
+    # one record changes and one is appended per run, so each run is a small delta on the last
+    records = [{'date': f"2025-01-{day % 28 + 1:02d}", 'value': day * 10 + (i if day == i else 0)} for day in range(200 + i)]
+    return {'clinical_cov': {'trends': records, 'updated': f"run {i}"}}
+
+def blobs(store):
+    return [name for _, _, names in os.walk(os.path.join(store.root, 'blobs')) for name in names]
+
+def test_runs_read_back_through_delta_chains_capped_at_max_chain(tmp_path):
+    store = SnapshotStore(str(tmp_path), codec='gzip', max_chain=2)
+    for i in range(7):
+        store.save('data_us_history', f"2025-05-{i + 10}-06-00-00", run(i))
+
+    runs = store.runs('data_us_history')
+    assert [store.load('data_us_history', time_run) for time_run in runs] == [run(i) for i in range(7)]
+    hashes = [next(d['hash'] for d in store.manifest('data_us_history', time_run)['datasets'] if d['path'] == ['clinical_cov', 'trends']) for time_run in runs]
+    # full, delta, delta, then a full again once the chain would pass 2
+    assert [store._depth(h) for h in hashes] == [0, 1, 2, 0, 1, 2, 0]
+    assert sum('.delta.' in name for name in blobs(store)) == 4
+    assert list(store.iter_records('data_us_history', runs[-1], ('clinical_cov', 'trends'))) == run(6)['clinical_cov']['trends']
+
+def test_an_unchanged_dataset_is_stored_once(tmp_path):
+    store = SnapshotStore(str(tmp_path), codec='gzip')
+    store.save('covid19_WHO', '2025-05-10-06-00-00', run(0))
+    count = len(blobs(store))
+    store.save('covid19_WHO', '2025-05-11-06-00-00', run(0))
+    assert len(blobs(store)) == count
+
+def dump(directory, name, time_run, data):
+    path = os.path.join(directory, f"{name}_{time_run}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    return path
+
+def test_migrate_deletes_dumps_that_read_back_identically(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'snapshots'), codec='gzip')
+    history = tmp_path / 'history'
+    history.mkdir()
+    paths = [dump(str(history), 'data_us_history', f"2025-05-1{i}-06-00-00", run(i)) for i in range(3)]
+
+    assert store.migrate([str(history)], delete=True) == 3
+    assert not any(os.path.exists(path) for path in paths)
+    assert store.load('data_us_history') == run(2)
+
+def test_migrate_keeps_a_dump_that_does_not_read_back_identically(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'snapshots'), codec='gzip')
+    history = tmp_path / 'history'
+    history.mkdir()
+    path = dump(str(history), 'data_us_history', '2025-05-10-06-00-00', run(0))
+    store.migrate([str(history)])
+    # a blob already stored under the dataset's hash but holding other records
+    content_hash = store.manifest('data_us_history', '2025-05-10-06-00-00')['datasets'][0]['hash']
+    with open(store._blob(content_hash), 'wb') as f:
+        f.write(compress(b'[]\n', 'gzip'))
+
+    with pytest.raises(ValueError, match='does not read back identically'):
+        store.migrate([str(history)], delete=True)
+    assert os.path.exists(path)
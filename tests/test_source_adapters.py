@@ -0,0 +1,54 @@
+import os
+from datetime import datetime, timezone
+import source_adapters
+from source_adapters import ADAPTERS, SOURCE_ADAPTER_FIXTURES, adapt, check
+from extraction import extract_html
+from conftest import ROOT, FIXTURES, CDC_PAGES, load_script
+
+def page_records():
+    """Records the page extractors produce from the fixture pages, by dataset name."""
+    who = load_script('getdata_covid19_who')
+    load_script('epi-crawl')
+    pages = {url: name for url, name in CDC_PAGES.items()}
+    pages.update({who.WHO_URL_LIST[2]: 'who-cases.html', who.WHO_URL_LIST[3]: 'who-deaths.html'})
+    records = {}
+    for url, name in pages.items():
+        with open(os.path.join(FIXTURES, 'pages', name), encoding='utf-8') as f:
+            records.update(extract_html(url, f.read(), datetime.now(timezone.utc)))
+    return records
+
+def shape(records):
+    """Every key of `records` with the types its values take."""
+    types = {}
+    for record in records:
+        for key, value in record.items():
+            types.setdefault(key, set()).add(type(value).__name__)
+    return types
+
+def test_adapter_records_have_the_shape_of_scraped_records():
+    scraped = page_records()
+    for item in ADAPTERS:
+        adapted = item.read(os.path.join(ROOT, SOURCE_ADAPTER_FIXTURES, f'{item.name}.csv'))
+        for dataset in item.datasets:
+            assert adapted[dataset] and scraped[dataset], dataset
+            assert shape(adapted[dataset]) == shape(scraped[dataset]), dataset
+
+def test_adapters_reproduce_their_recorded_records():
+    assert check(os.path.join(ROOT, SOURCE_ADAPTER_FIXTURES)) == []
+
+def test_unreadable_source_leaves_its_datasets_to_the_page(tmp_path, monkeypatch):
+    load_script('epi-crawl')
+    # the columns were renamed
+    changed = tmp_path / 'activity_levels.csv'
+    changed.write_text('week,sars,flu,rsv\n2025-03-29,3.7,9.7,4.1\n')
+    monkeypatch.setattr(source_adapters, 'SOURCE_ADAPTERS', ['all'])
+    for item in ADAPTERS:
+        if item.name == 'cdc_activity_levels':
+            monkeypatch.setattr(item, 'source', str(changed))
+        elif item.name == 'cdc_wastewater_variants':
+            monkeypatch.setattr(item, 'source', str(tmp_path / 'missing.csv'))
+        else:
+            monkeypatch.setattr(item, 'source', None)
+    pages = ['https://www.cdc.gov/respiratory-viruses/data/activity-levels.html', 'https://www.cdc.gov/nwss/rv/COVID19-variants.html']
+    records, remaining = adapt(pages)
+    assert records == {} and remaining == pages
@@ -0,0 +1,36 @@
+import time
+import asyncio
+from utils import StaleWhileRevalidate
+
+def test_concurrent_callers_share_the_stored_value_on_a_cold_cache():
+    crawls = []
+    async def refresh():
+        crawls.append(1)
+        return 'crawled'
+    def load():
+        time.sleep(0.1)
+        return 'stored', time.time()
+    cache = StaleWhileRevalidate(refresh, 3600, load=load)
+
+    async def main():
+        return await asyncio.gather(*[cache.get() for _ in range(3)])
+
+    assert [value for value, _ in asyncio.run(main())] == ['stored'] * 3
+    assert not crawls
+    assert cache.stats()['misses'] == 0
+
+def test_a_failed_load_falls_back_to_one_crawl():
+    crawls = []
+    async def refresh():
+        crawls.append(1)
+        await asyncio.sleep(0.05)
+        return 'crawled'
+    def load():
+        raise OSError('snapshot store unreadable')
+    cache = StaleWhileRevalidate(refresh, 3600, load=load)
+
+    async def main():
+        return await asyncio.gather(*[cache.get() for _ in range(3)])
+
+    assert [value for value, _ in asyncio.run(main())] == ['crawled'] * 3
+    assert len(crawls) == 1
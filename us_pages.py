@@ -0,0 +1,125 @@
+"""CDC pages of epi-crawl.py and their datasets, the US_SOURCE extraction workers import."""
+from datetime import datetime, timezone
+from extraction import Dataset, register
+
+URL_US = {
+    'all_respiratory_viruses': {
+        'summary': 'https://www.cdc.gov/respiratory-viruses/data/activity-levels.html',
+        'trends': 'https://www.cdc.gov/respiratory-viruses/data/activity-levels.html'
+    },
+    'clinical_cov': {
+        'trends': 'same with all_respiratory_viruses > trends > COVID-19_percent_of_tests_positive',
+        'variants': 'https://covid.cdc.gov/covid-data-tracker/#variant-proportions'
+    },
+    'wastewater_cov': {
+        'trends': 'https://www.cdc.gov/nwss/rv/COVID19-nationaltrend.html',
+        'variants': 'https://www.cdc.gov/nwss/rv/COVID19-variants.html'
+    }
+}
+
+US_SOURCE = __name__
+
+## all_respiratory_viruses & clinical_cov trends
+def activity_level_rows(table_container):
+    return [row.find_all('td') for row in table_container.find('tbody').find_all('tr')]
+
+def cdc_date(text, fmt):
+    return str(datetime.strptime(text, fmt).replace(tzinfo=timezone.utc))
+
+register(URL_US['all_respiratory_viruses']['summary'], [
+    Dataset(
+        'arv_summary',
+        ('div', {'class': 'update-snapshot'}),
+        fields={
+            'date': lambda snapshot: cdc_date(''.join(snapshot.text.strip().split()[4:8])[:-3], '%A,%B%d,%Y'),
+            'virus_type': lambda snapshot: 'all respiratory viruses',
+            'summary': lambda snapshot: snapshot.text.strip()
+        }
+    ),
+    Dataset(
+        'arv_trends',
+        ('div', {'class': 'table-container'}), select=-1,
+        rows=activity_level_rows,
+        fields={
+            'date': lambda cells: cdc_date(cells[0].text.strip(), '%B %d, %Y'),
+            'virus_type': lambda cells: 'all respiratory viruses',
+            'COVID-19_percent_of_tests_positive': lambda cells: float(cells[1].text.strip()),
+            'Influenza_percent_of_tests_positive': lambda cells: float(cells[2].text.strip()),
+            'RSV_percent_of_tests_positive': lambda cells: float(cells[3].text.strip())
+        }
+    ),
+    Dataset(
+        'cc_cov_trends',
+        ('div', {'class': 'table-container'}), select=-1,
+        rows=activity_level_rows,
+        fields={
+            'date': lambda cells: cdc_date(cells[0].text.strip(), '%B %d, %Y'),
+            'virus_type': lambda cells: 'COVID-19',
+            'COVID-19_percent_of_tests_positive': lambda cells: float(cells[1].text.strip())
+        }
+    )
+])
+
+## clinical_cov variants
+def filter_by_maxwidth(div_list, max_width):
+    filtered_divs = []
+    for div in div_list:
+        style_content = div['style']
+        for style in style_content.split(';'):
+            if 'max-width' in style:
+                width = style.split(':')[1].strip()
+                if width == max_width:
+                    filtered_divs.append(div)
+    return [i.text for i in filtered_divs]
+
+def parse_clinical_variants(index, time_now):
+    cc_cov_raw_soup = index.find_all(None, {'id': 'circulatingVariants'})[0]
+    cc_cov_variants_list = cc_cov_raw_soup.find_all('div', class_ = 'tab-vizHeaderWrapper')
+    cc_cov_variant_name = filter_by_maxwidth([i.select('.tab-vizHeader')[0] for i in cc_cov_variants_list], '88px')
+    cc_cov_variant_ratio = filter_by_maxwidth([i.select('.tab-vizHeader')[0] for i in cc_cov_variants_list], '64px')[1:]
+    cc_cov_variants = [
+        {
+        'date': cdc_date(cc_cov_variants_list[-1].text, '%m/%d/%y'),
+        'virus_type': 'COVID-19',
+        'percentage': ';'.join([f"{voc}:{float(ratio[:-1])/100:.2f}" for voc, ratio in zip(cc_cov_variant_name, cc_cov_variant_ratio)]) + ';'
+        }
+    ]
+    return cc_cov_variants
+
+register(URL_US['clinical_cov']['variants'], [
+    Dataset('cc_cov_variants', parse=parse_clinical_variants, containers=[(None, {'id': 'circulatingVariants'})])
+])
+
+## wastewater_cov
+register(URL_US['wastewater_cov']['trends'], [
+    Dataset(
+        'ww_cov_trends',
+        ('div', {'class': 'table-container'}),
+        rows=lambda table_container: table_container.find('tbody').find_all('tr'),
+        fields={
+            'date': lambda row: cdc_date(row.find('td').text.strip(), '%m/%d/%y'),
+            'virus_type': lambda row: 'COVID-19',
+            'COVID-19_NWSS_wastewater_viral_activity_levels': lambda row: float(row.find_all('td')[1].text.strip())
+        }
+    )
+])
+
+def parse_wastewater_variants(index, time_now):
+    ww_cov_variants = []
+    ww_cov_variants_soup = index.find_all('div', {'class': 'table-container'})[0]
+    ww_cov_variants_name = [i.text.split('Press')[0].strip() for i in ww_cov_variants_soup.find('thead').find_all('th')]
+    ww_cov_variants_name[0] = 'Date'
+    for row in ww_cov_variants_soup.find('tbody').find_all('tr'):
+        cells = row.find_all('td')
+        ww_cov_var = dict(zip(ww_cov_variants_name, [i.text.strip() for i in cells]))
+        ww_cov_td = {
+            'date': cdc_date(ww_cov_var['Date'], '%Y-%m-%d'),
+            'virus_type': 'COVID-19',
+            'percentage': ';'.join([f"{voc}:{float(partio[:-1]) / 100:.2f}" for voc, partio in ww_cov_var.items() if voc != 'Date' and partio != 'N/A'])
+        }
+        ww_cov_variants.append(ww_cov_td)
+    return ww_cov_variants
+
+register(URL_US['wastewater_cov']['variants'], [
+    Dataset('ww_cov_variants', parse=parse_wastewater_variants, containers=[('div', {'class': 'table-container'})])
+])
@@ -1,30 +1,517 @@
 import os
+import gzip
 import json
 import time
+import hashlib
+import atexit
+import random
+import threading
+import functools
 import asyncio
-import aiohttp
-import requests
+import httpx
+from collections import defaultdict, deque
+from urllib.parse import urlparse
 from loguru import logger
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from dotenv import load_dotenv
+from rate_ledger import RATE_LEDGER, RateLimitOpen, ledger_key, retry_after_of, FIRECRAWL_REQUESTS_PER_MINUTE
+from metrics import METRICS, site_of
 
 load_dotenv()
 TIMEGEP_SEC = 10
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 20))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 60))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 60))
+HTTP_HTTP2 = os.getenv('HTTP_HTTP2', '0') == '1'
+POLL_MIN_SEC = float(os.getenv('POLL_MIN_SEC', 1))
+POLL_DEADLINE_SEC = float(os.getenv('POLL_DEADLINE_SEC', 900))
+POLL_HISTORY = int(os.getenv('POLL_HISTORY', 50))
+FIRECRAWL_BATCH = os.getenv('FIRECRAWL_BATCH', '1') == '1'
+HTML_PARSER = os.getenv('HTML_PARSER', 'html.parser')
+HTML_PARSERS = ['html.parser', 'lxml', 'html5lib']
+# crawl_many result formats and the longest html/text it returns per page
+CRAWL_FORMATS = ('html', 'text', 'tables')
+CRAWL_MAX_CHARS = int(os.getenv('CRAWL_MAX_CHARS', 20000))
+# tiered fetch: which tier served each URL, and how long a URL stays on FireCrawl before a plain GET is tried again
+FETCH_TIERS_PATH = os.getenv('FETCH_TIERS_PATH', '.cache/fetch_tiers.json')
+FETCH_DIRECT_RETRY_SEC = float(os.getenv('FETCH_DIRECT_RETRY_SEC', 3600 * 24 * 7))
+FETCH_USER_AGENT = os.getenv('FETCH_USER_AGENT', 'Mozilla/5.0 (compatible; epi-crawl)')
+# 'live' scrapes, 'record' scrapes and saves every page to FIRECRAWL_FIXTURES, 'replay' serves them offline
+FIRECRAWL_MODE = os.getenv('FIRECRAWL_MODE', 'live')
+FIRECRAWL_FIXTURES = os.getenv('FIRECRAWL_FIXTURES', 'fixtures/firecrawl')
+
+@functools.lru_cache(maxsize=None)
+def resolve_parser(parser):
+    """The BeautifulSoup tree builder to use for `parser`, html.parser if it is not installed."""
+    if parser not in HTML_PARSERS:
+        raise ValueError(f"unknown HTML_PARSER {parser}, expected one of {HTML_PARSERS}")
+    try:
+        BeautifulSoup('', parser)
+    except Exception:
+        logger.warning(f"⚠️ HTML parser {parser} is not installed, falling back to html.parser")
+        return 'html.parser'
+    return parser
+
+def attr_matches(attrs, attr, value):
+    """Whether `attrs` (of a tag, or raw while parsing) has `attr` == `value`; a class value matches a single class or the full class string."""
+    if attr == 'class':
+        classes = attrs.get('class') or []
+        classes = classes.split() if isinstance(classes, str) else classes
+        return value in classes or value == ' '.join(classes)
+    return attrs.get(attr) == value
+
+class ContainerStrainer(SoupStrainer):
+    """Builds only the subtrees rooted at one of `containers`, a list of (name, attrs) as for `find_all`.
+
+    Everything outside them, text included, is dropped while parsing instead of after.
+    """
+    def __init__(self, containers):
+        super().__init__()
+        self.containers = containers
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        attrs = attrs or {}
+        return any(
+            (tag_name is None or tag_name == name) and all(attr_matches(attrs, attr, value) for attr, value in tag_attrs.items())
+            for tag_name, tag_attrs in self.containers
+        )
+
+    def allow_string_creation(self, string):
+        return False
+
+def make_soup(html, parser=None, containers=None) -> BeautifulSoup:
+    """Parse `html` with the configured tree builder (`HTML_PARSER`: html.parser, lxml or html5lib).
+
+    With `containers`, only those subtrees are built (html5lib cannot skip and builds the whole page).
+    """
+    parser = resolve_parser(parser or HTML_PARSER)
+    if containers and parser != 'html5lib':
+        return BeautifulSoup(html, parser, parse_only=ContainerStrainer(containers))
+    return BeautifulSoup(html, parser)
+
+class ElementIndex:
+    """Elements of a parsed page by `id`, `class`, `data-testid` and `role`, collected in one traversal.
+
+    `find_all(name, attrs)` answers the same page-level queries as `soup.find_all(name, attrs=attrs)`
+    from the index instead of walking the whole tree again. At least one of `attrs` must be
+    an indexed attribute; a class value matches a single class or the full class string.
+    """
+    INDEXED = ('id', 'class', 'data-testid', 'role')
+
+    def __init__(self, soup):
+        self.soup = soup
+        self.elements = defaultdict(list)
+        for tag in soup.find_all(True):
+            for attr in ('id', 'data-testid', 'role'):
+                value = tag.get(attr)
+                if value is not None:
+                    self.elements[(attr, value)].append(tag)
+            classes = tag.get('class')
+            if classes:
+                for value in {' '.join(classes), *classes}:
+                    self.elements[('class', value)].append(tag)
+
+    def find_all(self, name=None, attrs=None):
+        attrs = attrs or {}
+        keys = [(attr, value) for attr, value in attrs.items() if attr in self.INDEXED]
+        if not keys:
+            raise ValueError(f"ElementIndex needs one of {self.INDEXED} to look up, got {list(attrs)}")
+        candidates = min((self.elements.get(key, []) for key in keys), key=len)
+        return [
+            tag for tag in candidates
+            if (name is None or tag.name == name) and all(attr_matches(tag, attr, value) for attr, value in attrs.items())
+        ]
 
 class FireCrawlRateLimitExceeded(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        # seconds until the shared rate-limit breaker closes, when known
+        self.retry_after = retry_after
+    def __str__(self):
+        if self.retry_after is None:
+            return f"FireCrawlRateLimitExceeded: {self.message}"
+        return f"FireCrawlRateLimitExceeded: {self.message}; retry after {self.retry_after:.1f} seconds"
+
+class FireCrawlFixtureMissing(Exception):
+    def __init__(self, url, path):
+        super().__init__(url)
+        self.url = url
+        self.path = path
+    def __str__(self):
+        return f"FireCrawlFixtureMissing: no recorded page for {self.url} at {self.path}; record it with FIRECRAWL_MODE=record"
+
+class FireCrawlTimeout(Exception):
     def __init__(self, message):
         super().__init__(message)
         self.message = message
     def __str__(self):
-        return f"FireCrawlRateLimitExceeded: {self.message}"
+        return f"FireCrawlTimeout: {self.message}"
+
+class CountingTransport(httpx.HTTPTransport):
+    def __init__(self, pool, **kwargs):
+        super().__init__(**kwargs)
+        self.pool = pool
+
+    def handle_request(self, request):
+        self.pool.requests += 1
+        request.extensions['trace'] = lambda event_name, info: self.pool.count(event_name)
+        return super().handle_request(request)
+
+class CountingAsyncTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, pool, **kwargs):
+        super().__init__(**kwargs)
+        self.pool = pool
+
+    async def handle_async_request(self, request):
+        self.pool.requests += 1
+        async def trace(event_name, info):
+            self.pool.count(event_name)
+        request.extensions['trace'] = trace
+        return await super().handle_async_request(request)
+
+class HttpClientPool:
+    """Process-wide keep-alive HTTP clients shared by every FireCrawl call.
+
+    One `httpx.Client` serves the synchronous crawls and one `httpx.AsyncClient` per event
+    loop serves the async ones, so submit and status-poll requests reuse open connections.
+    `stats()` reports how many requests went over a reused connection.
+    """
+    def __init__(self):
+        self._client = None
+        self._async_client = None
+        self._async_loop = None
+        self._async_closer = None
+        self.requests = 0
+        self.connections_opened = 0
+
+    def _transport_options(self):
+        http2 = HTTP_HTTP2
+        if http2:
+            try:
+                import h2 # noqa: F401
+            except ImportError:
+                logger.warning('⚠️ HTTP_HTTP2=1 but the h2 package is not installed, falling back to HTTP/1.1')
+                http2 = False
+        return {
+            'http2': http2,
+            'limits': httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            )
+        }
+
+    def count(self, event_name):
+        if event_name == 'connection.connect_tcp.complete':
+            self.connections_opened += 1
+
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            self._client = httpx.Client(
+                transport=CountingTransport(self, **self._transport_options()),
+                timeout=HTTP_TIMEOUT
+            )
+        return self._client
+
+    def async_client(self) -> httpx.AsyncClient:
+        # httpx connections are bound to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            if self._async_client is not None and not self._async_loop.is_closed():
+                # the previous loop still runs, in another thread: close its client there
+                self._async_loop.call_soon_threadsafe(self._async_closer.cancel)
+            self._async_client = httpx.AsyncClient(
+                transport=CountingAsyncTransport(self, **self._transport_options()),
+                timeout=HTTP_TIMEOUT
+            )
+            self._async_loop = loop
+            # asyncio.run cancels leftover tasks before closing its loop, so a client nobody
+            # closed still releases its connections on the loop that opened them
+            self._async_closer = loop.create_task(self._close_when_cancelled(self._async_client))
+        return self._async_client
+
+    @staticmethod
+    async def _close_when_cancelled(client):
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            await client.aclose()
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'connections_opened': self.connections_opened,
+            'connections_reused': self.requests - self.connections_opened
+        }
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self):
+        if self._async_client is not None and self._async_loop is asyncio.get_running_loop():
+            await self._async_client.aclose()
+            self._async_closer.cancel()
+        elif self._async_client is not None and not self._async_loop.is_closed():
+            self._async_loop.call_soon_threadsafe(self._async_closer.cancel)
+        self._async_client = None
+        self._async_loop = None
+        self._async_closer = None
+
+HTTP_POOL = HttpClientPool()
+atexit.register(HTTP_POOL.close)
+
+class PollSchedule:
+    """Delays between status polls of one FireCrawl job, see `AdaptivePoller.schedule`."""
+    def __init__(self, poller, host, max_interval, deadline, kind='crawl'):
+        self.poller = poller
+        self.host = host
+        self.key = (host, kind)
+        self.max_interval = max(max_interval, poller.min_interval)
+        self.deadline = deadline
+        self.start = time.monotonic()
+        self.polls = 0
+
+    def next_delay(self):
+        elapsed = time.monotonic() - self.start
+        if elapsed >= self.deadline:
+            raise FireCrawlTimeout(f"{self.host}; job not completed after {elapsed:.0f} seconds")
+        # exponential backoff with jitter, capped at the old fixed interval; a job already slower
+        # than 90% of recent jobs on the host goes straight to that interval
+        backoff = min(self.max_interval, self.poller.min_interval * self.poller.factor ** self.polls)
+        if self.poller.completions[self.key] and elapsed > self.poller.percentile(self.key, 90):
+            backoff = self.max_interval
+        delay = backoff * random.uniform(0.8, 1.2)
+        if self.polls == 0:
+            # almost no job on this host finishes before its fastest recent completions
+            delay = max(delay, self.poller.percentile(self.key, 10) - elapsed)
+        self.polls += 1
+        return min(delay, self.deadline - elapsed)
+
+    def completed(self):
+        self.poller.record(self.key, time.monotonic() - self.start)
+
+class AdaptivePoller:
+    """Learns per-host FireCrawl job completion times and schedules status polls from them.
+
+    Completion times are kept per (host, job kind): a batch job takes longer than a single
+    page and would skew the estimates of the other. The first poll waits for the 10th
+    percentile of recent completion times of the same kind on the same host,
+    then intervals grow exponentially (with jitter) from `min_interval` up to the caller's
+    fixed interval. Jobs past the host's 90th percentile poll at that fixed interval, and a
+    job still unfinished after `deadline` raises FireCrawlTimeout.
+    """
+    def __init__(self, min_interval=POLL_MIN_SEC, factor=2, history=POLL_HISTORY, deadline=POLL_DEADLINE_SEC):
+        self.min_interval = min_interval
+        self.factor = factor
+        self.deadline = deadline
+        self.completions = defaultdict(lambda: deque(maxlen=history))
+
+    def record(self, key, elapsed):
+        self.completions[key].append(elapsed)
+
+    def percentile(self, key, q):
+        samples = sorted(self.completions[key])
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+    def schedule(self, url, max_interval, kind='crawl') -> PollSchedule:
+        return PollSchedule(self, urlparse(url).netloc, max_interval, self.deadline, kind)
+
+POLLER = AdaptivePoller()
+
+class RateBudget:
+    """Token bucket for FireCrawl jobs: `requests_per_minute` submissions, at most `max_in_flight` running.
+
+    Use as `async with budget:` around one job (submit + polling).
+    """
+    def __init__(self, requests_per_minute=10, max_in_flight=5):
+        self.rate = requests_per_minute / 60
+        self.capacity = max(1, requests_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+
+    async def _take_token(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def __aenter__(self):
+        await self._in_flight.acquire()
+        try:
+            await self._take_token()
+        except BaseException:
+            self._in_flight.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._in_flight.release()
+
+class StaleWhileRevalidate:
+    """Last good result of an expensive coroutine function, served at once with its age.
+
+    `await cache.get()` returns `(value, age_sec)`. A value older than `ttl_sec` is still
+    returned immediately, and a refresh starts in the background. Without any value the caller
+    waits for the refresh. Concurrent callers share one in-flight refresh. A failed refresh
+    keeps the last good value. `load()` may return `(value, fetched_at)` from persistent
+    storage, and is tried once before the first refresh so a restart does not mean a cold
+    cache; a failed load counts as finding nothing stored.
+    """
+    def __init__(self, refresh, ttl_sec, load=None):
+        self.refresh = refresh
+        self.ttl_sec = ttl_sec
+        self.load = load
+        self.loading = None
+        self.value = None
+        self.fetched_at = None
+        self.task = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def age(self):
+        return None if self.fetched_at is None else max(0.0, time.time() - self.fetched_at)
+
+    async def _run(self):
+        try:
+            value = await self.refresh()
+            self.value, self.fetched_at = value, time.time()
+            self.refreshes += 1
+            return value
+        except Exception:
+            self.refresh_errors += 1
+            raise
+        finally:
+            self.task = None
+
+    def _done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"⚠️ refresh failed, keeping the last good value: {task.exception()!r}")
+
+    def revalidate(self):
+        """The in-flight refresh, started if there is none."""
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+            self.task.add_done_callback(self._done)
+        return self.task
+
+    async def _load(self):
+        try:
+            loaded = await asyncio.to_thread(self.load)
+            if loaded is not None:
+                self.value, self.fetched_at = loaded
+        except Exception as e:
+            logger.warning(f"⚠️ loading the stored value failed, refreshing instead: {e!r}")
+        finally:
+            self.load = None
+
+    async def get(self):
+        if self.fetched_at is None and self.load is not None:
+            # callers arriving while the stored value loads wait for it rather than count a miss
+            if self.loading is None:
+                self.loading = asyncio.create_task(self._load())
+            await asyncio.shield(self.loading)
+        if self.fetched_at is None:
+            self.misses += 1
+            # shielded so one cancelled caller does not cancel the refresh the others wait on
+            value = await asyncio.shield(self.revalidate())
+            return value, self.age()
+        age = self.age()
+        if age < self.ttl_sec:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+            self.revalidate()
+        return self.value, age
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'refresh_errors': self.refresh_errors,
+            'age_sec': self.age(),
+            'ttl_sec': self.ttl_sec,
+            'refreshing': self.task is not None
+        }
+
+    async def aclose(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+class FireCrawlFixtures:
+    """Recorded scrape responses, one gzipped JSON per URL: the FireCrawl page document
+    (html, metadata) with the tier that produced it and when.
+
+    In record mode every page fetched, directly or through FireCrawl, is saved; in replay
+    mode `FireCrawl` serves the saved documents instead of calling the API and direct GETs
+    are skipped, so a whole crawl runs offline and deterministically.
+    """
+    def __init__(self, root=FIRECRAWL_FIXTURES):
+        self.root = root
+
+    def path(self, url):
+        return os.path.join(self.root, f"{hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]}.json.gz")
+
+    def record(self, url, document, tier):
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(url)
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+            json.dump({'url': url, 'tier': tier, 'recorded_at': time.time(), 'document': document}, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+        logger.info(f"Recorded: {url} -> {path}")
+
+    def replay(self, url) -> dict:
+        path = self.path(url)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                return json.load(f)['document']
+        except FileNotFoundError:
+            raise FireCrawlFixtureMissing(url, path)
+
+    def pages(self):
+        """`(url, html)` of every recorded page."""
+        if not os.path.isdir(self.root):
+            return []
+        pages = []
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith('.json.gz'):
+                with gzip.open(os.path.join(self.root, name), 'rt', encoding='utf-8') as f:
+                    fixture = json.load(f)
+                pages.append((fixture['url'], fixture['document']['html']))
+        return pages
+
+FIXTURES = FireCrawlFixtures()
 
 class FireCrawl:
     def __init__(self, url):
         
+        self.logger = logger
+        self.timegep_sec = TIMEGEP_SEC
         self.FIRECRAWL_API_KEY = os.getenv('FIRECRAWL_API_KEY')
         self.FIRECRAWL_ENDPOINT = os.getenv('FIRECRAWL_ENDPOINT')
+        self.FIRECRAWL_BATCH_ENDPOINT = os.getenv('FIRECRAWL_BATCH_ENDPOINT') or str(self.FIRECRAWL_ENDPOINT).rstrip('/').rsplit('/', 1)[0] + '/batch/scrape'
         self.url = url
         self.url_snap = url.split('https://')[1].strip()
+        # submissions of every process using this API key share one RATE_LEDGER bucket
+        self.ledger_key = ledger_key(self.FIRECRAWL_API_KEY)
         
         self.payload = {
             "url": url,
@@ -39,69 +526,491 @@ class FireCrawl:
             "Content-Type": "application/json"
         }
     
+    def _acquire(self):
+        try:
+            with METRICS.span('firecrawl.ledger', url=self.url):
+                RATE_LEDGER.acquire(self.ledger_key)
+        except RateLimitOpen as e:
+            raise FireCrawlRateLimitExceeded(str(e), e.retry_after)
+
+    async def _acquire_async(self):
+        try:
+            with METRICS.span('firecrawl.ledger', url=self.url):
+                await RATE_LEDGER.acquire_async(self.ledger_key)
+        except RateLimitOpen as e:
+            raise FireCrawlRateLimitExceeded(str(e), e.retry_after)
+
+    def _rate_limited(self, response, response_json):
+        """Open the shared breaker for as long as the 429 asks and return the exception to raise."""
+        METRICS.count('firecrawl_rate_limited_total', site=site_of(self.url))
+        retry_after = RATE_LEDGER.trip(self.ledger_key, retry_after_of(response))
+        self.logger.warning(f"⚠️ FireCrawl rate limit exceeded, submissions paused for {retry_after:.1f} seconds")
+        return FireCrawlRateLimitExceeded(f"{response_json['error']}", retry_after)
+
+    def _submitted(self, urls):
+        METRICS.count('firecrawl_submissions_total', site=site_of(self.url))
+        for url in urls:
+            METRICS.count('firecrawl_pages_submitted_total', site=site_of(url))
+
+    @staticmethod
+    def _completed(url, html, last_delay):
+        """Count a finished page; the wait before the poll that found it bounds how late polling noticed."""
+        METRICS.observe('firecrawl_poll_overshoot_seconds', last_delay, site=site_of(url))
+        METRICS.count('bytes_downloaded_total', len(html.encode('utf-8')), tier='firecrawl', site=site_of(url))
+
     def crawl(self) -> BeautifulSoup:
+        soup = make_soup(self.fetch())
+        return soup
+
+    def fetch(self) -> str:
+        if FIRECRAWL_MODE == 'replay':
+            return FIXTURES.replay(self.url)['html']
         
         #POST
-        response = requests.request("POST", self.FIRECRAWL_ENDPOINT, json=self.payload, headers=self.headers) # type: ignore
-        response_json = json.loads(response.text)
-        
-        while True:
-            if response_json['success']:
-                res_url = response_json['url']
-                logger.info(f"Submitted: {self.url_snap};")
-                break
-            elif 'Rate limit exceeded' in response_json['error']:
-                logger.info('⚠️ FireCrawl Rate limit exceeded, retrying in 60 seconds...')
-                raise FireCrawlRateLimitExceeded(f"{response_json['error']}")
-            else:
-                logger.error(f"{self.url_snap}; {response_json['error']}, retrying in {TIMEGEP_SEC} seconds...")
-                time.sleep(TIMEGEP_SEC)
+        with METRICS.span('firecrawl.submit', url=self.url):
+            while True:
+                self._acquire()
+                response = HTTP_POOL.client().post(self.FIRECRAWL_ENDPOINT, json=self.payload, headers=self.headers) # type: ignore
+                response_json = response.json()
+                if response_json['success']:
+                    RATE_LEDGER.succeeded(self.ledger_key)
+                    self._submitted([self.url])
+                    res_url = response_json['url'].replace("https:", self.FIRECRAWL_ENDPOINT.split('//')[0]) # type: ignore
+                    self.logger.info(f"Submitted: {self.url_snap};")
+                    break
+                elif 'Rate limit exceeded' in response_json['error']:
+                    raise self._rate_limited(response, response_json)
+                else:
+                    self.logger.error(f"{self.url_snap}; {response_json['error']}, retrying in {self.timegep_sec} seconds...")
+                    time.sleep(self.timegep_sec)
         
         #GET
-        while True:
-            response = requests.request("GET", res_url, headers=self.headers)
-            response_json = json.loads(response.text)
-            if response_json['status'] == 'completed':
-                logger.info(f"Completed: {self.url_snap};")
-                break
-            elif response_json['status'] == 'scraping':
-                logger.info(f"Scraping: {self.url_snap};")
-                time.sleep(TIMEGEP_SEC)
-        soup = BeautifulSoup(response_json['data'][0]['html'], 'html.parser')
+        with METRICS.span('firecrawl.render', url=self.url) as span:
+            schedule = POLLER.schedule(self.url, self.timegep_sec)
+            delay = schedule.next_delay()
+            time.sleep(delay)
+            polls = 0
+            while True:
+                response = HTTP_POOL.client().get(res_url, headers=self.headers)
+                polls += 1
+                response_json = response.json()
+                if response_json['status'] == 'completed':
+                    schedule.completed()
+                    self.logger.info(f"Completed: {self.url_snap};")
+                    if FIRECRAWL_MODE == 'record':
+                        FIXTURES.record(self.url, response_json['data'][0], 'firecrawl')
+                    break
+                elif response_json['status'] == 'scraping':
+                    delay = schedule.next_delay()
+                    self.logger.info(f"Scraping: {self.url_snap}, retrying in {delay:.1f} seconds...")
+                    time.sleep(delay)
+                else:
+                    raise Exception(f"{self.url_snap}; job {response_json['status']}")
+            span['polls'] = polls
+            METRICS.count('firecrawl_polls_total', polls, site=site_of(self.url))
+            self._completed(self.url, response_json['data'][0]['html'], delay)
+        return response_json['data'][0]['html']
+
+    async def crawl_async(self, client=None) -> BeautifulSoup:
+        html = await self.fetch_async(client)
+        # parsing a large page takes long enough to stall other crawls sharing the loop
+        soup = await asyncio.to_thread(make_soup, html)
         return soup
 
-    async def crawl_async(self, session) -> BeautifulSoup:
+    async def fetch_async(self, client=None) -> str:
+        if FIRECRAWL_MODE == 'replay':
+            return (await asyncio.to_thread(FIXTURES.replay, self.url))['html']
         
+        client = client or HTTP_POOL.async_client()
         # POST
-        async with session.post(self.FIRECRAWL_ENDPOINT, json=self.payload, headers=self.headers) as response:
-            response_json = await response.json()
-            
+        with METRICS.span('firecrawl.submit', url=self.url):
             while True:
+                await self._acquire_async()
+                response = await client.post(self.FIRECRAWL_ENDPOINT, json=self.payload, headers=self.headers) # type: ignore
+                response_json = response.json()
                 if response_json['success']:
+                    await asyncio.to_thread(RATE_LEDGER.succeeded, self.ledger_key)
+                    self._submitted([self.url])
                     res_url = response_json['url'].replace("https:", self.FIRECRAWL_ENDPOINT.split('//')[0]) # type: ignore
-                    logger.info(f"Submitted: {self.url_snap}")
+                    self.logger.info(f"Submitted: {self.url_snap}")
                     break
                 elif 'Rate limit exceeded' in response_json['error']:
-                    raise Exception(f"{response_json['error']}")
+                    raise await asyncio.to_thread(self._rate_limited, response, response_json)
                 else:
-                    logger.error(f"{self.url_snap}; {response_json['error']}, retrying in {TIMEGEP_SEC} seconds...")
-                    time.sleep(TIMEGEP_SEC)
+                    self.logger.error(f"{self.url_snap}; {response_json['error']}, retrying in {self.timegep_sec} seconds...")
+                    await asyncio.sleep(self.timegep_sec)
 
         # GET
-        while True:
-            async with session.get(res_url, headers=self.headers) as response:
-                response_json = await response.json()
+        with METRICS.span('firecrawl.render', url=self.url) as span:
+            schedule = POLLER.schedule(self.url, self.timegep_sec)
+            delay = schedule.next_delay()
+            await asyncio.sleep(delay)
+            polls = 0
+            while True:
+                response = await client.get(res_url, headers=self.headers)
+                polls += 1
+                response_json = response.json()
                 if response_json['status'] == 'completed':
-                    logger.info(f"Completed: {self.url_snap}; {response_json['status']}")
+                    schedule.completed()
+                    self.logger.info(f"Completed: {self.url_snap}; {response_json['status']}")
+                    if FIRECRAWL_MODE == 'record':
+                        await asyncio.to_thread(FIXTURES.record, self.url, response_json['data'][0], 'firecrawl')
                     break
                 elif response_json['status'] == 'scraping':
-                    logger.info(f"Scraping: {self.url_snap}, retrying in {TIMEGEP_SEC} seconds...")
-                    await asyncio.sleep(TIMEGEP_SEC)
-        soup = BeautifulSoup(response_json['data'][0]['html'], 'html.parser')
-        return soup
+                    delay = schedule.next_delay()
+                    self.logger.info(f"Scraping: {self.url_snap}, retrying in {delay:.1f} seconds...")
+                    await asyncio.sleep(delay)
+                else:
+                    raise Exception(f"{self.url_snap}; job {response_json['status']}")
+            span['polls'] = polls
+            METRICS.count('firecrawl_polls_total', polls, site=site_of(self.url))
+            self._completed(self.url, response_json['data'][0]['html'], delay)
+        return response_json['data'][0]['html']
+
+    @classmethod
+    async def batch_async(cls, urls, client=None):
+        """Scrape `urls` as a single FireCrawl batch job and yield `(url, html)` as each page completes.
+
+        Duplicate URLs are submitted once; the job is polled through one status handle. Each page
+        gets its own 'firecrawl.render' span, from submission to the poll that returned it.
+        """
+        urls = list(dict.fromkeys(urls))
+        if FIRECRAWL_MODE == 'replay':
+            for url in urls:
+                yield url, (await asyncio.to_thread(FIXTURES.replay, url))['html']
+            return
+        crawler = cls(urls[0])
+        client = client or HTTP_POOL.async_client()
+        payload = {
+            "urls": urls,
+            "formats": crawler.payload['scrapeOptions']['formats'],
+            "waitFor": crawler.payload['scrapeOptions']['waitFor']
+        }
+
+        # POST
+        with METRICS.span('firecrawl.submit', url=crawler.url, pages=len(urls)):
+            while True:
+                await crawler._acquire_async()
+                response = await client.post(crawler.FIRECRAWL_BATCH_ENDPOINT, json=payload, headers=crawler.headers)
+                response_json = response.json()
+                if response_json['success']:
+                    await asyncio.to_thread(RATE_LEDGER.succeeded, crawler.ledger_key)
+                    crawler._submitted(urls)
+                    res_url = response_json['url'].replace("https:", crawler.FIRECRAWL_BATCH_ENDPOINT.split('//')[0])
+                    crawler.logger.info(f"Submitted: batch of {len(urls)} pages")
+                    break
+                elif 'Rate limit exceeded' in response_json['error']:
+                    raise await asyncio.to_thread(crawler._rate_limited, response, response_json)
+                else:
+                    crawler.logger.error(f"batch; {response_json['error']}, retrying in {crawler.timegep_sec} seconds...")
+                    await asyncio.sleep(crawler.timegep_sec)
+
+        # GET
+        def source_url(page):
+            source = page.get('metadata', {}).get('sourceURL', '')
+            if source in pending:
+                return source
+            # FireCrawl may report the URL without fragment or trailing slash
+            for url in pending:
+                if url.split('#')[0].rstrip('/') == source.split('#')[0].rstrip('/'):
+                    return url
+
+        pending = set(urls)
+        spans = {url: METRICS.start('firecrawl.render', url=url, batch=len(urls)) for url in urls}
+        schedule = POLLER.schedule(crawler.url, crawler.timegep_sec, 'batch')
+        delay = schedule.next_delay()
+        await asyncio.sleep(delay)
+        polls = 0
+        try:
+            while True:
+                response_json = (await client.get(res_url, headers=crawler.headers)).json()
+                polls += 1
+                pages = response_json.get('data', [])
+                next_url = response_json.get('next')
+                while next_url:
+                    next_json = (await client.get(next_url.replace("https:", crawler.FIRECRAWL_BATCH_ENDPOINT.split('//')[0]), headers=crawler.headers)).json()
+                    polls += 1
+                    pages += next_json.get('data', [])
+                    next_url = next_json.get('next')
+                for page in pages:
+                    url = source_url(page)
+                    if url is not None and page.get('html'):
+                        pending.discard(url)
+                        spans[url]['attributes']['polls'] = polls
+                        METRICS.end(spans.pop(url))
+                        cls._completed(url, page['html'], delay)
+                        crawler.logger.info(f"Completed: {url.split('://')[-1]}")
+                        if FIRECRAWL_MODE == 'record':
+                            await asyncio.to_thread(FIXTURES.record, url, page, 'firecrawl')
+                        yield url, page['html']
+                if not pending:
+                    schedule.completed()
+                    break
+                if response_json['status'] == 'scraping':
+                    delay = schedule.next_delay()
+                    crawler.logger.info(f"Scraping: batch {response_json.get('completed')}/{response_json.get('total')}, retrying in {delay:.1f} seconds...")
+                    await asyncio.sleep(delay)
+                else:
+                    raise Exception(f"batch job {response_json['status']}; no html for {sorted(pending)}")
+        finally:
+            METRICS.count('firecrawl_polls_total', polls, site=site_of(crawler.url))
+            # pages the job never returned, or the consumer stopped waiting for
+            for span in spans.values():
+                METRICS.end(span, 'not completed')
+
+class FetchTiers:
+    """Which tier last produced a usable page for each URL: 'direct' (a plain GET) or 'firecrawl' (a rendered scrape).
+
+    A URL is fetched directly unless the last direct attempt failed less than
+    FETCH_DIRECT_RETRY_SEC ago, so a page that becomes static is picked up again.
+    """
+    def __init__(self, path=FETCH_TIERS_PATH):
+        self.path = path
+        self._tiers = None
+        # URLs whose direct attempt failed, recorded as 'firecrawl' once FireCrawl delivers them
+        self._failed = set()
+        # async fetches record from worker threads
+        self._lock = threading.Lock()
+
+    def tiers(self):
+        if self._tiers is None:
+            try:
+                with open(self.path) as f:
+                    self._tiers = json.load(f)
+            except (OSError, ValueError):
+                self._tiers = {}
+        return self._tiers
+
+    def try_direct(self, url):
+        entry = self.tiers().get(url)
+        return entry is None or entry['tier'] == 'direct' or time.time() - entry['at'] > FETCH_DIRECT_RETRY_SEC
+
+    def record(self, url, tier):
+        with self._lock:
+            self.tiers()[url] = {'tier': tier, 'at': time.time()}
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.tiers(), f, indent=4)
+            os.replace(self.path + '.tmp', self.path)
+
+    def direct_failed(self, url):
+        self._failed.add(url)
+
+    def rendered(self, url):
+        """FireCrawl delivered `url`: if its direct attempt failed, FireCrawl is its tier."""
+        if url in self._failed:
+            self._failed.discard(url)
+            self.record(url, 'firecrawl')
+
+FETCH_TIERS = FetchTiers()
+
+def direct_document(url, response, html):
+    """A direct response in the shape of a FireCrawl page document."""
+    return {'html': html, 'metadata': {'sourceURL': url, 'url': str(response.url), 'statusCode': response.status_code}}
+
+def validate_direct(url, response, html, validate):
+    METRICS.count('bytes_downloaded_total', len(response.content), tier='direct', site=site_of(url))
+    with METRICS.span('fetch.validate', url=url) as span:
+        span['accepted'] = validate(url, html)
+    return span['accepted']
+
+def fetch_direct(url, validate):
+    """The page from a plain pooled GET if `validate(url, html)` accepts it, else None (use FireCrawl)."""
+    # replayed pages all come through FireCrawl, whichever tier recorded them
+    if FIRECRAWL_MODE == 'replay' or not FETCH_TIERS.try_direct(url):
+        return None
+    with METRICS.span('fetch.direct', url=url):
+        try:
+            response = HTTP_POOL.client().get(url, headers={'User-Agent': FETCH_USER_AGENT}, follow_redirects=True)
+            html = response.text if response.status_code == 200 else None
+        except Exception as e:
+            logger.warning(f"⚠️ direct fetch failed: {url}; {e}")
+            html = None
+    if html is not None and validate_direct(url, response, html, validate):
+        FETCH_TIERS.record(url, 'direct')
+        logger.info(f"Fetched directly: {url}")
+        if FIRECRAWL_MODE == 'record':
+            FIXTURES.record(url, direct_document(url, response, html), 'direct')
+        return html
+    FETCH_TIERS.direct_failed(url)
+    return None
+
+async def fetch_direct_async(url, validate):
+    if FIRECRAWL_MODE == 'replay' or not await asyncio.to_thread(FETCH_TIERS.try_direct, url):
+        return None
+    with METRICS.span('fetch.direct', url=url):
+        try:
+            response = await HTTP_POOL.async_client().get(url, headers={'User-Agent': FETCH_USER_AGENT}, follow_redirects=True)
+            html = response.text if response.status_code == 200 else None
+        except Exception as e:
+            logger.warning(f"⚠️ direct fetch failed: {url}; {e}")
+            html = None
+    if html is not None and await asyncio.to_thread(validate_direct, url, response, html, validate):
+        await asyncio.to_thread(FETCH_TIERS.record, url, 'direct')
+        logger.info(f"Fetched directly: {url}")
+        if FIRECRAWL_MODE == 'record':
+            await asyncio.to_thread(FIXTURES.record, url, direct_document(url, response, html), 'direct')
+        return html
+    FETCH_TIERS.direct_failed(url)
+    return None
+
+async def fetch_pages(urls, budget=None, crawler=FireCrawl, batch=FIRECRAWL_BATCH, cache=None, validate=None):
+    """Yield `(url, html)` for each distinct URL as soon as its page is available.
+
+    Pages `cache` (an `html_cache.HtmlCache`) can still vouch for are served from it. With
+    `validate(url, html)`, typically "the page's extractor finds its data", the rest are
+    first tried with a plain GET (`fetch_direct_async`). Whatever is left goes out as one
+    FireCrawl batch job with `batch`, otherwise as one job per URL limited by `budget`.
+    Fetched pages are stored back into `cache`.
+    """
+    urls = list(dict.fromkeys(urls))
+    # a replay is served from the fixtures only, the cache would probe the origins
+    if FIRECRAWL_MODE == 'replay':
+        cache = None
+    # a recording scrapes every page, pages served from the cache would never be recorded
+    if cache is not None and FIRECRAWL_MODE != 'record':
+        cached = await asyncio.gather(*[asyncio.to_thread(cache.lookup, url) for url in urls])
+        for url, html in zip(urls, cached):
+            if html is not None:
+                yield url, html
+        urls = [url for url, html in zip(urls, cached) if html is None]
+    if validate is not None and urls:
+        async def direct(url):
+            return url, await fetch_direct_async(url, validate)
+        rendered = []
+        for task in asyncio.as_completed([direct(url) for url in urls]):
+            url, html = await task
+            if html is None:
+                rendered.append(url)
+                continue
+            if cache is not None:
+                await asyncio.to_thread(cache.store, url, html)
+            yield url, html
+        urls = [url for url in urls if url in rendered]
+    if not urls:
+        return
+
+    async for url, html in scrape_pages(urls, budget, crawler, batch):
+        await asyncio.to_thread(FETCH_TIERS.rendered, url)
+        if cache is not None:
+            await asyncio.to_thread(cache.store, url, html)
+        yield url, html
+
+async def scrape_pages(urls, budget, crawler, batch):
+    if batch:
+        async for url, html in crawler.batch_async(urls):
+            yield url, html
+        return
+
+    budget = budget or RateBudget()
+    async def fetch(url):
+        queued = METRICS.start('queue', url=url)
+        async with budget:
+            METRICS.end(queued)
+            return url, await crawler(url).fetch_async()
+    tasks = [asyncio.create_task(fetch(url)) for url in urls]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def check_formats(formats):
+    unknown = set(formats) - set(CRAWL_FORMATS)
+    if unknown:
+        raise ValueError(f"unknown formats {sorted(unknown)}, expected some of {list(CRAWL_FORMATS)}")
+
+def compact_page(html, formats, max_chars=CRAWL_MAX_CHARS):
+    """A serializable digest of a page: trimmed `html`, visible `text` and/or `tables` as rows of cell texts."""
+    check_formats(formats)
+    soup = make_soup(html)
+    for tag in soup.find_all(['script', 'style', 'noscript', 'svg', 'template']):
+        tag.decompose()
+    page = {}
+    if 'html' in formats:
+        trimmed = str(soup)
+        page['html'] = trimmed[:max_chars]
+        page['html_truncated'] = len(trimmed) > max_chars
+    if 'text' in formats:
+        text = soup.get_text(' ', strip=True)
+        page['text'] = text[:max_chars]
+        page['text_truncated'] = len(text) > max_chars
+    if 'tables' in formats:
+        page['tables'] = [
+            [[cell.get_text(' ', strip=True) for cell in row.find_all(['th', 'td'])] for row in table.find_all('tr')]
+            for table in soup.find_all('table')
+        ]
+    return page
+
+async def crawl_many(urls, max_concurrency=4, formats=('text',), crawler=FireCrawl, requests_per_minute=FIRECRAWL_REQUESTS_PER_MINUTE):
+    """Crawl `urls`, at most `max_concurrency` at a time, and yield one result per distinct URL in completion order.
+
+    A result is `{'url', 'ok', 'elapsed_sec'}` plus the `compact_page` fields, or `error` when
+    that URL failed; a failure does not stop the other crawls. Submissions are paced at
+    `requests_per_minute`, by default the FireCrawl quota that RATE_LEDGER shares across processes.
+    Bad arguments raise ValueError before anything is crawled.
+    """
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+    urls = list(dict.fromkeys(urls))
+    formats = list(formats)
+    check_formats(formats)
+    budget = RateBudget(requests_per_minute, max_concurrency)
+    async def crawl(url):
+        start = time.monotonic()
+        try:
+            queued = METRICS.start('queue', url=url)
+            async with budget:
+                METRICS.end(queued)
+                html = await crawler(url).fetch_async()
+            page = await asyncio.to_thread(compact_page, html, formats)
+            return {'url': url, 'ok': True, 'elapsed_sec': round(time.monotonic() - start, 3), **page}
+        except Exception as e:
+            logger.warning(f"⚠️ crawl of {url} failed: {e!r}")
+            return {'url': url, 'ok': False, 'elapsed_sec': round(time.monotonic() - start, 3), 'error': repr(e)}
+    tasks = [asyncio.create_task(crawl(url)) for url in urls]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+class EventLoopStallMonitor:
+    """Measures how long the running event loop is blocked, e.g. by a synchronous call inside a coroutine.
+
+    Use as `async with EventLoopStallMonitor() as monitor:`; `monitor.max_stall` holds the
+    longest observed delay in seconds and a warning is logged for each stall over `threshold`.
+    """
+    def __init__(self, threshold=0.5, interval=0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_stall = 0.0
+        self._task = None
+
+    async def _watch(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            stall = time.monotonic() - start - self.interval
+            self.max_stall = max(self.max_stall, stall)
+            if stall > self.threshold:
+                logger.warning(f"⚠️ event loop blocked for {stall:.2f} seconds")
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._watch())
+        await asyncio.sleep(0)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._task.cancel() # type: ignore
+        try:
+            await self._task # type: ignore
+        except asyncio.CancelledError:
+            pass
 
 async def crawl_2_url(url_1, url_2):
-    async with aiohttp.ClientSession() as session:
-        tasks = [FireCrawl(url).crawl_async(session) for url in [url_1, url_2]]
-        soup_list = await asyncio.gather(*tasks)
+    tasks = [FireCrawl(url).crawl_async() for url in [url_1, url_2]]
+    soup_list = await asyncio.gather(*tasks)
     return soup_list
@@ -0,0 +1,305 @@
+"""The WHO COVID-19 dashboard pages and the datasets extracted from each, for getdata_covid19_who.py.
+
+Spawned extraction workers import WHO_SOURCE to find a page's datasets; being this module
+rather than the script, they skip its Mongo, cache and snapshot imports.
+"""
+import re
+from datetime import datetime, timezone
+from extraction import Dataset, RUN_TIME, per_group, register
+
+WHO_URL_LIST = [
+    'https://data.who.int/dashboards/covid19/summary',
+    'https://data.who.int/dashboards/covid19/circulation',
+    'https://data.who.int/dashboards/covid19/cases',
+    'https://data.who.int/dashboards/covid19/deaths',
+    'https://data.who.int/dashboards/covid19/hospitalizations',
+    'https://data.who.int/dashboards/covid19/vaccines',
+    'https://data.who.int/dashboards/covid19/variants'
+]
+
+WHO_SOURCE = __name__
+
+def utc_date(text, fmt):
+    return str(datetime.strptime(text, fmt).replace(tzinfo=timezone.utc))
+
+def listitem_fields(value_key):
+    """'13 Apr 2025: 1,234' list items of the world series charts."""
+    return {
+        'date': lambda i: utc_date(i.text.split(':')[0], '%d %b %Y'),
+        value_key: lambda i: int(i.text.split(':')[1].replace(',', ''))
+    }
+
+def cell_fields(key, value, label):
+    """Cells of the small multiple charts, one chart per `key` whose name is `label` of the chart."""
+    return {
+        'date': lambda j: utc_date(j['data-test-time-dim'], '%Y-%m-%d'),
+        key: per_group(label),
+        **value
+    }
+
+# 0. summary
+def parse_summary(index, time_now):
+    p1_soup = index.find_all('div', {'id': 'PageContent_C493_Col00', 'class': 'sf_colsIn col-md-12'})[0]
+    p2_soup = index.find_all('div', {'id': 'PageContent_C629_Col00', 'class': 'sf_colsIn col-md-9'})[0]
+    p1_paragraphs = p1_soup.find_all('p')
+    p2_paragraphs = p2_soup.find_all('p')
+    return [
+        {
+            'date': str(time_now.replace(tzinfo=timezone.utc)),
+            'summary_circulation': p1_paragraphs[0].text,
+            'summary_cases': p1_paragraphs[10].text,
+            'summary_variant': p1_soup.find_all('div', class_ = 'sfContentBlock sf-Long-text')[9].text,
+            'summary_severity': p2_paragraphs[0].text,
+            'summary_death': p2_paragraphs[10].text
+        }
+    ]
+
+register(WHO_URL_LIST[0], [
+    # 0.1 实时：新冠疫情概况
+    Dataset('WHO_realtime_summary', parse=parse_summary, containers=[
+        ('div', {'id': 'PageContent_C493_Col00', 'class': 'sf_colsIn col-md-12'}),
+        ('div', {'id': 'PageContent_C629_Col00', 'class': 'sf_colsIn col-md-9'})
+    ])
+])
+
+# 1. circulation
+def parse_positivity_rate_history(index, time_now):
+    tmp_history_rawlist = [
+        [re.sub(r'[:,]', '', j.strip()) for j in i.text.split('\n')]
+        for i in index.find_all(None, {"id": "PageContent_C481_Col00"})[0].find_all(attrs={"role": "listitem"})
+    ]
+    x = int(len(tmp_history_rawlist) / 3)
+    return [
+        {
+            'date': utc_date(tmp_history_rawlist[0][0], '%d %b %Y'),
+            'Number_of_specimens_tested_for_SARS-CoV-2': int(tmp_history_rawlist[0][1]),
+            'Number_of_specimens_tested_Positive_for_SARS-CoV-2': int(tmp_history_rawlist[x][1]),
+            'Percentage_of_samples_testing_positive_for_SARS-CoV-2': float(tmp_history_rawlist[2*x][1])
+        }
+        for n_specimens, n_positive, n_percentage in zip(tmp_history_rawlist[:x], tmp_history_rawlist[x:2*x], tmp_history_rawlist[2*x:])
+    ]
+
+def parse_variants_prevalence_history(index, time_now):
+    WHO_history_weekly_variants_prevalence = []
+    variant_charts = index.find_all('svg', {'class': 'touch-action-pan-y svelte-4havvh dataDotViz-chart'})
+    for x in range(len(['VOIs', 'VUMs'])):
+        flag = False
+        for i in variant_charts[x].find_all('text', role = 'cell'):
+            if i['data-testid'] == 'dataDotViz-line-summary':
+                variant = i.text.split('In')[1].split(',')[0].strip()
+                time_start = i.text.split('week')[1].split('to')[0].strip()
+                time_end = i.text.split('week')[2].split('.')[0].strip()
+            try:
+                if i['data-test-time-dim'] == time_start:
+                    flag = True
+                if i['data-test-time-dim'] == time_end:
+                    prevalence, flag = float(i.text), False
+                    WHO_history_weekly_variants_prevalence.append({
+                        'date': utc_date(i['data-test-time-dim'], '%Y-%m-%d'),
+                        'variant': variant,
+                        'prevalence': prevalence
+                    })
+                if flag:
+                    prevalence = float(i.text)
+                    WHO_history_weekly_variants_prevalence.append({
+                        'date': utc_date(i['data-test-time-dim'], '%Y-%m-%d'),
+                        'variant': variant,
+                        'prevalence': prevalence
+                    })
+                continue
+            except:
+                pass
+    return WHO_history_weekly_variants_prevalence
+
+register(WHO_URL_LIST[1], [
+    # 1.1 实时：上周各国新冠阳性率
+    Dataset(
+        'WHO_realtime_7d_countries_positivity_rate',
+        (None, {"data-testid": "dataDotViz-choroplethMap-borders"}),
+        rows=(None, {"role": "button"}),
+        fields={
+            'date': RUN_TIME,
+            'country': lambda i: i['aria-label'].split(':')[0].strip(),
+            'covid19_positivity_rate': lambda i: float(i['aria-label'].split(':')[1].strip()[:-1])
+        }
+    ),
+    # 1.2 历史：每周全球新冠阳性率变化
+    Dataset('WHO_weekly_positivity_rate_world_history', parse=parse_positivity_rate_history, containers=[(None, {"id": "PageContent_C481_Col00"})]),
+    # 1.3 实时：上月新冠突变株占比情况
+    Dataset(
+        'WHO_realtime_28d_variants_prevalence',
+        ('table', {'class': 'data-table svelte-1hj6lq3'}),
+        rows=('tr', {'class': 'svelte-1hj6lq3'}), skip=1,
+        fields={
+            'date': RUN_TIME,
+            'variant': lambda v_line: v_line.find_all('td', class_ = 'inline-border value-column svelte-1hj6lq3')[0].text,
+            'prevalence': lambda v_line: float(v_line.find_all('td', class_ = 'value-column align-end svelte-1hj6lq3')[0].text[:-1]),
+            'change': lambda v_line: v_line.find_all('td', class_ = 'value-column align-end svelte-1hj6lq3')[1].text
+        }
+    ),
+    # 1.4  实时：上月提交GISAID新冠突变株序列条数
+    Dataset(
+        'WHO_realtime_28d_GISAID_variants_submitted',
+        ('table', {'class': 'data-table svelte-szsgy'}),
+        rows=('tr', {'class': 'svelte-szsgy'}), skip=1,
+        fields={
+            'date': RUN_TIME,
+            'variant': lambda v_line: v_line.find_all('td', class_ = 'inline-border value-column svelte-szsgy')[0].text,
+            'countries': lambda v_line: int(v_line.find_all('td', class_ = 'inline-border value-column align-end svelte-szsgy')[0].text),
+            'sequences_submitted_to_GISAID': lambda v_line: int(v_line.find_all('td', class_ = 'value-column align-end svelte-szsgy')[0].text.replace(',', ''))
+        }
+    ),
+    # 1.5 历史：每周主要新冠突变株占比变化
+    Dataset('WHO_history_weekly_variants_prevalence', parse=parse_variants_prevalence_history, containers=[('svg', {'class': 'touch-action-pan-y svelte-4havvh dataDotViz-chart'})])
+])
+
+# 2. cases, 3. deaths, 4. hospitalizations
+WHO_HEADLINE_CARDS = [
+    ('span', {'class': 'end-date svelte-aejddw'}),
+    ('strong', {'class': 'value svelte-aejddw'}),
+    ('strong', {'class': 'change-value svelte-aejddw'})
+]
+
+def headline(value_key, position=0):
+    """The 'World, 28 days to ...' card at `position`: its end date, value and change."""
+    def parse(index, time_now):
+        end_date = datetime.strptime(index.find_all('span', {'class': 'end-date svelte-aejddw'})[0].text, 'World, 28 days to %d %B %Y').replace(tzinfo=timezone.utc)
+        return [
+            {
+                'date': str(end_date),
+                value_key: int(index.find_all('strong', {'class': 'value svelte-aejddw'})[position].text.replace(',', '')),
+                f'{value_key}_change': index.find_all('strong', {'class': 'change-value svelte-aejddw'})[position].text[1:].replace(',', '')
+            }
+        ]
+    return parse
+
+def world_series(name, value_key, container=('div', {'id': 'PageContent_C014_Col01', 'class': 'sf_colsIn col-md-6'})):
+    return Dataset(name, container, rows=('text', {'role': 'listitem'}), fields=listitem_fields(value_key))
+
+def region_series(name, value_key, value):
+    return Dataset(
+        name,
+        ('div', {'id': 'PageContent_C033_Col00', 'class': 'sf_colsIn col-md-12'}),
+        group=('section', {'class': 'covid19-groups-row svelte-sfsmwu'}),
+        rows=('text', {'role': 'listitem'}),
+        fields={
+            'date': lambda j: utc_date(j.text.split(':')[0], '%d %b %Y'),
+            'WHO_region': per_group(lambda i: i.find_all('h3', attrs={'data-testid': 'dataDotViz-covid19-groups-spatialDimName'})[0].text),
+            value_key: value
+        }
+    )
+
+def countries_series(name, value_key):
+    return Dataset(
+        name,
+        ('div', {'id': 'PageContent_C040_Col00', 'class': 'sf_colsIn col-md-12'}),
+        group=('div', {'data-testid': 'dataDotViz-small-multiple'}),
+        rows=('text', {'role': 'cell'}), skip=1,
+        fields=cell_fields('country', {value_key: lambda j: j.text}, lambda i: i.text.split('Reported')[0].strip())
+    )
+
+register(WHO_URL_LIST[2], [
+    # 2.1 实时：上月全球总的新冠病例数量
+    Dataset('WHO_realtime_28d_world_reported_cases', parse=headline('Number_of_cases_reported_to_WHO_in_the_past_28_days'), containers=WHO_HEADLINE_CARDS),
+    # 2.2 历史：全球总的新冠病例数量
+    world_series('WHO_history_weekly_world_reported_cases', 'Number_of_cases_reported_to_WHO'),
+    # 2.3 历史：全球各洲上报的病例数量
+    region_series('WHO_history_weekly_region_reported_cases', 'Number_of_cases_reported_to_WHO', lambda j: int(j.text.split(':')[1].replace(',', ''))),
+    # 2.4 历史：全球各国上报的病例数量
+    countries_series('WHO_history_weekly_countries_reported_cases', 'Number_of_cases_reported_to_WHO')
+])
+
+register(WHO_URL_LIST[3], [
+    # 3.1 实时：上月全球总的新冠死亡数量
+    Dataset('WHO_realtime_28d_world_reported_deaths', parse=headline('Number_of_deaths_reported_to_WHO_in_the_past_28_days'), containers=WHO_HEADLINE_CARDS),
+    # 3.2 历史：全球总的新冠死亡案例数量
+    world_series('WHO_history_weekly_world_reported_deaths', 'Number_of_deaths_reported_to_WHO'),
+    # 3.3 历史：全球各洲上报的死亡案例数量
+    region_series('WHO_history_weekly_region_reported_deaths', 'Number_of_deaths_reported_to_WHO', lambda j: j.text.split(':')[1].replace(',', '').strip()),
+    # 3.4 历史：全球各国上报的死亡案例数量
+    countries_series('WHO_history_weekly_countries_reported_deaths', 'Number_of_deaths_reported_to_WHO'),
+    # 3.5 历史：死亡案例年龄占比
+    Dataset(
+        'WHO_history_weekly_age_distribution_reported_deaths',
+        ('div', {'class': 'dataDotViz-jsonChartConfig dataDotViz-theme dataDotViz-reset dataDotViz-dynamic dataDotViz-chartConfig dataDotViz-ChartRenderer dataDotViz-chartMode-l'}),
+        group=('div', {'data-testid': 'dataDotViz-small-multiple'}),
+        rows=('text', {'role': 'cell'}), skip=1,
+        fields=cell_fields('age_group', {'Percentage_of_deaths_reported_to_WHO': lambda j: float(j.text[:-1])}, lambda i: i.find_all('h3', class_ = 'headline svelte-1g6zpbj')[0].text)
+    )
+])
+
+def parse_severity(index, time_now):
+    return [
+        {
+            'date': utc_date(i.text.split(':')[0], '%d %b %Y'),
+            'Number_of_ICU_admissions_per_1000_hospitalizations_reported_to_WHO': int(i.text.split(':')[1].replace(',', '')),
+            'Number_of_death_per_1000_hospitalizations_reported_to_WHO': int(j.text.split(':')[1].replace(',', ''))
+        }
+        for i, j in zip(
+            index.find_all('div', {'id': 'PageContent_C190_Col00', 'class': 'sf_colsIn col-md-6', 'data-sf-element': 'Column 1'})[0].find_all('text', attrs={'role': 'listitem'}),
+            index.find_all('div', {'id': 'PageContent_C190_Col01', 'class': 'sf_colsIn col-md-6', 'data-sf-element': 'Column 2'})[0].find_all('text', attrs={'role': 'listitem'})
+        )
+    ]
+
+register(WHO_URL_LIST[4], [
+    # 4.1 实时：上月全球总的新冠住院数量
+    Dataset('WHO_realtime_28d_world_reported_hospitalizations', parse=headline('Number_of_hospitalizations_reported_to_WHO_in_the_past_28_days'), containers=WHO_HEADLINE_CARDS),
+    # 4.2 历史：全球每月新冠住院人数
+    world_series('WHO_history_monthly_world_reported_hospitalizations', 'Number_of_hospitalizations_reported_to_WHO'),
+    # 4.3 实时：上月全球总的由新冠导致的ICU住院数量
+    Dataset('WHO_realtime_28d_world_reported_ICU', parse=headline('Number_of_ICU_hospitalizations_reported_to_WHO_in_the_past_28_days', 1), containers=WHO_HEADLINE_CARDS),
+    # 4.4 历史：全球每月新冠ICU住院人数
+    world_series('WHO_history_monthly_world_reported_ICU', 'Number_of_ICU_hospitalizations_reported_to_WHO', ('div', {'id': 'PageContent_C181_Col01', 'class': 'sf_colsIn col-md-6', 'data-sf-element': 'Column 2'})),
+    # 4.5 历史：全球每月新冠重症人数
+    Dataset('WHO_history_monthly_world_reported_severity', parse=parse_severity, containers=[
+        ('div', {'id': 'PageContent_C190_Col00', 'class': 'sf_colsIn col-md-6', 'data-sf-element': 'Column 1'}),
+        ('div', {'id': 'PageContent_C190_Col01', 'class': 'sf_colsIn col-md-6', 'data-sf-element': 'Column 2'})
+    ])
+])
+
+# 5. vaccines
+def parse_total_vaccines(index, time_now):
+    sub_soup = index.find_all('div', {'id': 'PageContent_C001_Col00', 'class': 'sf_colsIn container--contrast'})[0]
+    data_values = sub_soup.find_all('strong', class_ = 'data-value svelte-phjb1n')
+    coverage_values = sub_soup.find_all('span', class_ = 'value svelte-1jx75w7')
+    return [
+        {
+            'date': str(time_now.replace(tzinfo=timezone.utc)),
+            'Total_COVID-19_vaccine_doses_administered': data_values[0].text,
+            'Date_of_first_COVID-19_vaccine_product_introduction': data_values[1].text,
+            'Percentage_of_total_population_vaccinated_with_a_complete_primary_series_of_a_COVID-19_vaccine': float(coverage_values[0].text[:-1]),
+            'Percentage_of_total_population_vaccinated_with_at_least_one_booster_dose_of_a_COVID-19_vaccine': float(coverage_values[1].text[:-1])
+        }
+    ]
+
+register(WHO_URL_LIST[5], [
+    # 5.1 实时：全球接种新冠疫苗总剂数、第一针和加强针覆盖率
+    Dataset('WHO_realtime_total_world_vaccines', parse=parse_total_vaccines, containers=[('div', {'id': 'PageContent_C001_Col00', 'class': 'sf_colsIn container--contrast'})]),
+    # 5.2 实时：各国新冠疫苗覆盖率
+    Dataset(
+        'WHO_realtime_vaccine_coverage',
+        ('div', {'id': 'PageContent_C013_Col00', 'class': 'sf_colsIn container'}),
+        rows=('use', {"role": "button"}),
+        fields={
+            'date': RUN_TIME,
+            'country': lambda i: i['aria-label'].split(':')[0].strip(),
+            'Percentage_of_total_population_vaccinated_with_at_least_one_dose_of_a_COVID-19_vaccine': lambda i: float(i['aria-label'].split(':')[1].strip()[:-1]) if i['aria-label'].split(':')[1].strip() != 'No data' else None
+        }
+    )
+])
+
+# 6. variants
+WHO_VARIANT_FIELDS = {
+    'pango_lineage': lambda i: i.find_all('th')[0].text.split('Pango lineage')[1].split('Excludes')[0].strip(),
+    'nextstrain_clade': lambda i: i.find_all('p')[0].text.split('Nextstrain clade')[1].strip(),
+    'genetic_features': lambda i: i.find_all('p')[1].text.split('Genetic features')[1].strip(),
+    'earliest_documented_samples': lambda i: i.find_all('p')[2].text.split('Earliest documented samples')[1].strip(),
+    'date_of_designation': lambda i: i.find_all('p')[3].text.split('Date of designation')[1].strip(),
+    'risk_assessments_reports': lambda i: [j['href'] for j in i.find_all('a')]
+}
+
+register(WHO_URL_LIST[6], [
+    # 6.1 历史：VOI & VUM 相关信息
+    Dataset('WHO_variants_information', ('div', {'id': 'PageContent_C085_Col00', 'class': 'table-container table--contrast sf_colsIn', 'data-sf-element': 'Table'}), select=None, fields=WHO_VARIANT_FIELDS),
+    Dataset('WHO_variants_information', ('div', {'id': 'PageContent_C095_Col00', 'class': 'table-container table--contrast sf_colsIn', 'data-sf-element': 'Table'}), rows=('tr', {}), fields=WHO_VARIANT_FIELDS)
+])